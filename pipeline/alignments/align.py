@@ -5,7 +5,7 @@ Calculates alignments for a parallel corpus.
 Some efficiency measures were implemented as it needs to process 500M sentences long corpus for the student model:
 1. Tokenization with Moses with remapping the alignments back to whitespace based tokenization to reduce vocabulary size and improve accuracy
 2. Using fast C++ Moses tokenizer
-2. Parallelization with multiprocessing (tokenization and remapping)
+2. Parallelization with a persistent pool of processes (tokenization and remapping)
 3. Buffering on writing the output files to improve throughput
 
 
@@ -19,7 +19,6 @@ Example:
 """
 
 import argparse
-import multiprocessing
 import os
 import shutil
 import subprocess
@@ -34,6 +33,7 @@ from tqdm import tqdm
 
 from pipeline.alignments.tokenizer import tokenize_moses
 from pipeline.common.logging import get_logger
+from pipeline.common.parallel import BlockPool
 
 logger = get_logger("alignments")
 
@@ -259,6 +259,7 @@ def remap(
     tok_trg_path: str,
     aln_path: str,
     output_aln_path: str,
+    processes: int = -1,
 ) -> None:
     """
     Remaps alignments that were calculated for Moses-tokenized corpus to whitespace-tokenized ones.
@@ -268,11 +269,12 @@ def remap(
     :param tok_trg_path: path to Moses-tokenized sentences in target language
     :param aln_path: path to the alignments calculated for Moses-tokenized corpus
     :param output_aln_path: path to output alignments file remapped to whitespace-tokenized corpus
+    :param processes: number of processes to remap with, -1 for one per logical CPU
     """
     logger.info("Remapping alignments to whitespace tokenization")
 
     with ExitStack() as stack:
-        pool = stack.enter_context(multiprocessing.Pool(processes=multiprocessing.cpu_count()))
+        pool = stack.enter_context(BlockPool(processes))
         # Buffering helps to minimize IO operations which speeds thing up significantly
         output = stack.enter_context(open(output_aln_path, "w", buffering=500000))
 
@@ -285,8 +287,17 @@ def remap(
         )
 
         # send lines to worker processes in chunks
-        for aln in tqdm(pool.imap(remap_line, lines, chunksize=10000), mininterval=10):
-            output.write(aln)
+        pbar = tqdm(mininterval=10)
+        for alns in pool.imap_lines(remap_lines, lines, max_lines=10000):
+            output.writelines(alns)
+            pbar.update(len(alns))
+
+
+def remap_lines(lines):
+    """
+    Remaps alignments for a chunk of lines in a corpus
+    """
+    return [remap_line(params) for params in lines]
 
 
 def remap_line(params):
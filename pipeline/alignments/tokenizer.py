@@ -12,60 +12,60 @@ export LD_LIBRARY_PATH=.../<you-python-env>/lib/python3.10/site-packages/mosesto
 
 """
 import argparse
-import multiprocessing
-from typing import List
+from typing import List, Optional
 
 from tqdm import tqdm
 
 from pipeline.common.logging import get_logger
+from pipeline.common.parallel import BLOCK_SIZE, BlockPool
 
 logger = get_logger("tokenizer")
 
+# The tokenizer of a worker process, which is loaded once by `_init_tokenizer`.
+_tokenizer = None
 
-def _read_file_in_chunks(file_path, chunk_size):
-    with open(file_path, "r", encoding="utf-8") as file:
-        while True:
-            lines = file.readlines(chunk_size)
-            if not lines:
-                break
-            yield lines
 
-
-def _tokenize_lines(params) -> List[str]:
-    lines, lang = params
+def _init_tokenizer(lang: str) -> None:
+    global _tokenizer
     from mosestokenizer import MosesTokenizer
 
     try:
-        tokenizer = MosesTokenizer(lang)
+        _tokenizer = MosesTokenizer(lang)
     except RuntimeError as err:
         msg = str(err)
         if "No known abbreviations for language" in msg:
             # Fall-back to English if the language is not found
-            tokenizer = MosesTokenizer("en")
+            _tokenizer = MosesTokenizer("en")
         else:
             raise err
 
+
+def _tokenize_lines(lines: List[str]) -> List[str]:
     tokenized = []
     for line in lines:
-        tokens = tokenizer.tokenize(line)
+        tokens = _tokenizer.tokenize(line)
         tokenized.append(" ".join(tokens))
     return tokenized
 
 
 def tokenize_moses(
-    input_path: str, output_path: str, lang: str, sentences_per_chunk: int = 100000
+    input_path: str,
+    output_path: str,
+    lang: str,
+    sentences_per_chunk: Optional[int] = 100000,
+    processes: int = -1,
 ) -> None:
     logger.info(f"Tokenizing {input_path} with Moses tokenizer")
 
-    with multiprocessing.Pool(processes=multiprocessing.cpu_count()) as pool:
-        with open(output_path, "w") as output_file:
-            chunks = _read_file_in_chunks(input_path, chunk_size=sentences_per_chunk)
-
+    # The tokenizer is loaded once per worker, rather than for every chunk.
+    with BlockPool(processes, initializer=_init_tokenizer, initargs=(lang,)) as pool:
+        with open(input_path, "r", encoding="utf-8") as input_file, open(
+            output_path, "w"
+        ) as output_file:
             pbar = tqdm(mininterval=10)
             # ~100K sentences per second on a single core
-            for tokenized_chunk in pool.imap(
-                _tokenize_lines,
-                ((ch, lang) for ch in chunks),
+            for tokenized_chunk in pool.imap_lines(
+                _tokenize_lines, input_file, BLOCK_SIZE, max_lines=sentences_per_chunk
             ):
                 output_file.write("\n".join(tokenized_chunk) + "\n")
                 pbar.update(len(tokenized_chunk))
@@ -104,5 +104,12 @@ if __name__ == "__main__":
         default=None,
         help="Number of lines to process per chunk",
     )
+    parser.add_argument(
+        "--processes",
+        metavar="PROCESSES",
+        type=int,
+        default=-1,
+        help="Number of processes to tokenize with, -1 for one per logical CPU",
+    )
     args = parser.parse_args()
-    tokenize_moses(args.input_path, args.output_path, args.lang, args.chunk_size)
+    tokenize_moses(args.input_path, args.output_path, args.lang, args.chunk_size, args.processes)
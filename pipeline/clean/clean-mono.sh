@@ -30,7 +30,7 @@ if [ "$threads" = "auto" ]; then
   threads=$(nproc)
 fi
 cd "$(dirname "${0}")"
-export PYTHONPATH="tools"
+export PYTHONPATH="tools:$(realpath ../..)"
 
 dir="$(dirname "${output_prefix}")"
 mkdir -p "${dir}"
@@ -58,12 +58,12 @@ fi
 ######################################################################
 echo "### Filter by language identification"
 test -s "${output_prefix}.${lang}.langid.zst" ||
-  # langid_fasttext.py will download this file if it is not already present. When it runs in
-  # parallel, this will typically cause the file to be corrupt.
-  test -s tools/lid.176.bin || wget -O tools/lid.176.bin https://dl.fbaipublicfiles.com/fasttext/supervised-models/lid.176.bin
+  # langid_fasttext.py downloads the model under a lock if it is not already present, and loads
+  # it once before forking its workers, so they share the memory of a single copy.
   zstdmt -dc "${output_prefix}.${lang}.monofix.zst" |
-  # memory intensive
-  parallel --no-notice --pipe -k -j "$(echo "${threads}"/4 | bc)" --block 50M "python3 tools/langid_fasttext.py" |
+  # The languages are cached when LANGID_CACHE is set to a file, which can be shared between
+  # the tasks.
+  python3 tools/langid_fasttext.py --processes "${threads}" ${LANGID_CACHE:+--cache "${LANGID_CACHE}"} |
   grep -P "^${lang}\t" | cut -f2 |
   zstdmt >"${output_prefix}.${lang}.langid.zst"
 
@@ -71,8 +71,7 @@ test -s "${output_prefix}.${lang}.langid.zst" ||
 echo "### Rule-based filtering"
 
 zstdmt -dc "${output_prefix}.${lang}.langid.zst" |
-parallel --no-notice --pipe -k -j "${threads}" --block 50M \
-  "python3 tools/clean_mono.py -l ${lang} --debug" \
+python3 tools/clean_mono.py -l "${lang}" --debug --processes "${threads}" \
   2>"${output_prefix}.${lang}.clean.debug.txt" |
 zstdmt >"${output_prefix}.${lang}.zst"
 
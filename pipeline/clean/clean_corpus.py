@@ -0,0 +1,585 @@
+"""
+Basic cleaning of a parallel corpus in a single pass. Each sentence pair is read and decompressed
+once, goes through the cleaning stages in memory, and the kept pairs are compressed and written
+once, rather than writing every intermediate step to disk.
+
+The stages match the steps of the previous shell pipeline, and produce the same lines:
+
+  1. normalize          tools/deescape-special-chars.perl, tools/remove-non-printing-char.perl
+  2. monolingual_fixes  fixes/{dataset}.{lang}.sh
+  3. bilingual_fixes    fixes/{dataset}.sh, or sacremoses in-process when it runs fixes/detok.sh
+  4. rule_based         tools/clean_parallel.py
+  5. langid             tools/langid_fasttext.py on each side
+  6. whitespace         Removing leading and repetitive white spaces
+
+The batches of pairs are cleaned in a pool of processes, and written in order. How many pairs
+each stage keeps and filters is saved to {output_prefix}.{src}{trg}.stats.json, with the hit rate
+of the --langid_cache when there is one.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from itertools import islice, zip_longest
+from pathlib import Path
+from typing import Any, Generator, Optional
+
+from pipeline.clean.tools.clean_parallel import clean_batch
+from pipeline.clean.tools.langid_fasttext import (
+    LangIdCache,
+    get_model_checksum,
+    get_model_path,
+    load_model,
+    predict_languages,
+)
+from pipeline.common.datasets import FilteringStep, Statistics
+from pipeline.common.downloads import read_lines, write_lines
+from pipeline.common.logging import get_logger
+from pipeline.common.parallel import BlockPool
+
+logger = get_logger(__file__)
+
+CLEAN_DIR = Path(__file__).parent
+
+# How many sentence pairs are cleaned at a time by a worker.
+CLEAN_BATCH_SIZE = 50_000
+
+# A sentence pair, without the newlines.
+Pair = tuple[str, str]
+
+# The substitutions of tools/deescape-special-chars.perl, which are applied in order.
+DEESCAPE_SUBSTITUTIONS = [
+    ("&bar;", "|"),
+    ("&#124;", "|"),
+    ("&lt;", "<"),
+    ("&gt;", ">"),
+    ("&bra;", "["),
+    ("&ket;", "]"),
+    ("&quot;", '"'),
+    ("&apos;", "'"),
+    ("&#91;", "["),
+    ("&#93;", "]"),
+    ("&amp;", "&"),
+]
+
+
+@lru_cache(maxsize=None)
+def get_non_printing_regex() -> re.Pattern:
+    """
+    Python's regular expressions don't support the \\p{C} class of Perl, so build a character
+    class of the ranges of the code points in the "Other" categories, which are the control,
+    format, surrogate, private use, and unassigned characters.
+    """
+    ranges = []
+    start = None
+    for code_point in range(sys.maxunicode + 2):
+        is_other = code_point <= sys.maxunicode and unicodedata.category(chr(code_point))[0] == "C"
+        if is_other and start is None:
+            start = code_point
+        elif not is_other and start is not None:
+            ranges.append(f"\\U{start:08x}-\\U{code_point - 1:08x}")
+            start = None
+    return re.compile(f"[{''.join(ranges)}]")
+
+
+class CleaningStage:
+    """
+    A step of the cleaning, which is given a batch of sentence pairs, and returns the pairs that
+    are kept, with any changes applied. The worker processes are forked after the stages are
+    prepared, so they inherit them.
+    """
+
+    name: str
+    description: str
+
+    def prepare(self) -> None:
+        """Load anything the stage shares between the workers, before they're forked."""
+
+    def clean(self, pairs: list[Pair], debug_lines: list[str]) -> list[Pair]:
+        raise NotImplementedError
+
+    def take_results(self) -> Any:
+        """Take what the stage gathered while cleaning a batch, to send it to the main process."""
+        return None
+
+    def add_results(self, results: Any) -> None:
+        """Add the results of a batch from `take_results` in the main process."""
+
+    def finish(self, stats: "CleaningStatistics") -> None:
+        """Called in the main process once every batch is cleaned."""
+
+
+class NormalizeStage(CleaningStage):
+    name = "normalize"
+    description = "Un-escape the special characters, and replace the non-printing characters"
+
+    def clean(self, pairs: list[Pair], debug_lines: list[str]) -> list[Pair]:
+        return [(self.normalize(src), self.normalize(trg)) for src, trg in pairs]
+
+    @staticmethod
+    def normalize(line: str) -> str:
+        for escaped, character in DEESCAPE_SUBSTITUTIONS:
+            line = line.replace(escaped, character)
+        return get_non_printing_regex().sub(" ", line)
+
+
+class FixStage(CleaningStage):
+    """
+    Runs a dataset specific fix script on the batch. A monolingual fix is given the lines of one
+    side, and a bilingual fix is given the "src\\ttrg" lines. The scripts are line based, so they
+    are run once per batch. The scripts that only detokenize are run by DetokenizeStage instead.
+    """
+
+    def __init__(
+        self,
+        src_fix: Optional[list[str]] = None,
+        trg_fix: Optional[list[str]] = None,
+        pair_fix: Optional[list[str]] = None,
+    ) -> None:
+        self.src_fix = src_fix
+        self.trg_fix = trg_fix
+        self.pair_fix = pair_fix
+        if pair_fix:
+            self.name = "bilingual_fixes"
+            self.description = f"Apply the bilingual fixes: {Path(pair_fix[0]).name}"
+        else:
+            self.name = "monolingual_fixes"
+            fixes = [Path(fix[0]).name for fix in (src_fix, trg_fix) if fix]
+            self.description = f"Apply the monolingual fixes: {', '.join(fixes)}"
+
+    @staticmethod
+    def run_fix(command: list[str], lines: list[str]) -> list[str]:
+        result = subprocess.run(
+            command,
+            input="".join(f"{line}\n" for line in lines),
+            capture_output=True,
+            check=True,
+            cwd=CLEAN_DIR,
+            encoding="utf-8",
+            errors="surrogateescape",
+        )
+        fixed_lines = result.stdout.split("\n")
+        # The output ends with a newline, which leaves an empty string at the end.
+        fixed_lines.pop()
+        if len(fixed_lines) != len(lines):
+            raise ValueError(
+                f"The fix {command} returned {len(fixed_lines)} lines for {len(lines)} lines"
+            )
+        return fixed_lines
+
+    def clean(self, pairs: list[Pair], debug_lines: list[str]) -> list[Pair]:
+        if self.pair_fix:
+            lines = self.run_fix(self.pair_fix, [f"{src}\t{trg}" for src, trg in pairs])
+            # Like `cut -f1` and `cut -f2`.
+            return [tuple((line.split("\t") + [""])[:2]) for line in lines]
+
+        src_lines = [src for src, _ in pairs]
+        trg_lines = [trg for _, trg in pairs]
+        if self.src_fix:
+            src_lines = self.run_fix(self.src_fix, src_lines)
+        if self.trg_fix:
+            trg_lines = self.run_fix(self.trg_fix, trg_lines)
+        return list(zip(src_lines, trg_lines))
+
+
+class DetokenizeStage(CleaningStage):
+    """
+    Detokenize both sides with sacremoses in this process, like the fixes/detok.sh that the
+    bilingual fixes of several datasets run. Running the script for each batch would start two
+    sacremoses interpreters per batch, so the detokenizers are created once per worker instead.
+    """
+
+    name = "bilingual_fixes"
+
+    def __init__(self, src: str, trg: str, script: Path) -> None:
+        self.src = src
+        self.trg = trg
+        self.description = f"Apply the bilingual fixes: {script.name}, detokenized in-process"
+        self.detokenizers = None
+
+    def prepare(self) -> None:
+        if self.detokenizers is None:
+            from sacremoses import MosesDetokenizer
+
+            self.detokenizers = (MosesDetokenizer(lang=self.src), MosesDetokenizer(lang=self.trg))
+
+    def clean(self, pairs: list[Pair], debug_lines: list[str]) -> list[Pair]:
+        self.prepare()
+        src_detokenizer, trg_detokenizer = self.detokenizers
+        fixed_pairs = []
+        for src, trg in pairs:
+            # Like `cut -f1` and `cut -f2` of the "src\ttrg" line.
+            fields = f"{src}\t{trg}".split("\t")
+            # Like `sacremoses detokenize`, which splits each line on the white space.
+            fixed_pairs.append(
+                (
+                    src_detokenizer.detokenize(fields[0].split(), return_str=True, unescape=True),
+                    trg_detokenizer.detokenize(fields[1].split(), return_str=True, unescape=True),
+                )
+            )
+        return fixed_pairs
+
+
+class RuleBasedStage(CleaningStage):
+    name = "rule_based"
+    description = "Filter with the rules of tools/clean_parallel.py"
+
+    def __init__(self, src: str, trg: str) -> None:
+        self.src = src
+        self.trg = trg
+
+    def clean(self, pairs: list[Pair], debug_lines: list[str]) -> list[Pair]:
+        split_pairs = []
+        fields_pairs = []
+        for src, trg in pairs:
+            # The pairs are split exactly as clean_parallel.py splits its input lines.
+            fields = f"{src}\t{trg}".strip().split("\t")
+            if len(fields) < 2:
+                continue
+            split_pairs.append((src, trg))
+            fields_pairs.append((fields[-2].strip(), fields[-1].strip()))
+
+        kept = []
+        skips = clean_batch(fields_pairs, self.src, self.trg)
+        for (src, trg), skip in zip(split_pairs, skips):
+            if skip:
+                debug_lines.append(f"{skip}\t{src}\t{trg}\n")
+                continue
+            kept.append((src, trg))
+        return kept
+
+
+class LangIdCacheStats(Statistics):
+    """How many of the texts had their language looked up in the cache."""
+
+    def __init__(self, path: Path) -> None:
+        super().__init__()
+        self.path = str(path)
+        self.lookups = 0
+        self.hits = 0
+        self.hit_rate = 0.0
+
+    def update_derived_data(self):
+        super().update_derived_data()
+        self.hit_rate = self.hits / self.lookups if self.lookups else 0.0
+
+
+class LangIdStage(CleaningStage):
+    """
+    Identify the language of each side with fastText, and keep the pairs that are in the
+    expected languages. The model is loaded once before the workers are forked, so they share
+    its memory, and each side of a batch is predicted in a single call.
+
+    With a cache, only the texts that were never predicted by the same model are predicted, and
+    the new predictions are saved to the cache at the end.
+    """
+
+    name = "langid"
+    description = "Filter the pairs that fastText doesn't identify as the expected languages"
+
+    def __init__(
+        self, src: str, trg: str, model_path: Path, cache_path: Optional[Path] = None
+    ) -> None:
+        self.src = src
+        self.trg = trg
+        self.model_path = model_path
+        self.cache_path = cache_path
+        self.model = None
+        self.cache: Optional[LangIdCache] = None
+        self.cache_stats = LangIdCacheStats(cache_path) if cache_path else None
+        self.new_entries = []
+
+    def __getstate__(self) -> dict:
+        # Don't pickle the model, a process that isn't forked loads its own.
+        return {**self.__dict__, "model": None}
+
+    def prepare(self) -> None:
+        if self.model is None:
+            self.model = load_model(str(self.model_path))
+        if self.cache_path and self.cache is None:
+            self.cache = LangIdCache.load(
+                self.cache_path, get_model_checksum(str(self.model_path))
+            )
+
+    def predict(self, texts: list[str]) -> list[str]:
+        if self.cache is None:
+            return predict_languages(self.model, texts)
+        langs, new_entries = self.cache.predict(self.model, texts)
+        self.new_entries.append((len(texts), new_entries))
+        return langs
+
+    def clean(self, pairs: list[Pair], debug_lines: list[str]) -> list[Pair]:
+        if not pairs:
+            return pairs
+        self.prepare()
+        # The texts are selected exactly as langid_fasttext.py selects the field of a line.
+        trg_langs = self.predict([f"{src}\t{trg}".strip().split("\t")[1] for src, trg in pairs])
+        src_langs = self.predict([src for src, _ in pairs])
+        return [
+            pair
+            for pair, src_lang, trg_lang in zip(pairs, src_langs, trg_langs)
+            if trg_lang == self.trg and src_lang == self.src
+        ]
+
+    def take_results(self) -> list:
+        new_entries = self.new_entries
+        self.new_entries = []
+        return new_entries
+
+    def add_results(self, results: list) -> None:
+        for lookups, new_entries in results:
+            self.cache_stats.lookups += lookups
+            self.cache_stats.hits += lookups - len(new_entries)
+            self.cache.add(new_entries)
+
+    def finish(self, stats: "CleaningStatistics") -> None:
+        if self.cache is None:
+            return
+        self.cache.save(self.cache_path)
+        stats.langid_cache = self.cache_stats
+        logger.info(
+            f"Found {self.cache_stats.hits:,} of {self.cache_stats.lookups:,} languages in the "
+            f"cache, which now has {len(self.cache):,} entries: {self.cache_path}"
+        )
+
+
+class WhitespaceStage(CleaningStage):
+    name = "whitespace"
+    description = "Remove the leading white space, and squeeze the repeated spaces"
+
+    def clean(self, pairs: list[Pair], debug_lines: list[str]) -> list[Pair]:
+        return [(self.squeeze(src), self.squeeze(trg)) for src, trg in pairs]
+
+    @staticmethod
+    def squeeze(line: str) -> str:
+        # Like `sed -e 's/^[[:space:]]*//' | tr -s " "`
+        return re.sub(" +", " ", line.lstrip(" \t\n\v\f\r"))
+
+
+class CleaningStatistics(Statistics):
+    """
+    Gather statistics about the cleaning stages.
+    """
+
+    def __init__(self, dataset_path: Path, stages: list[CleaningStage]) -> None:
+        super().__init__(dataset_path)
+        self.stages = {stage.name: FilteringStep(stage.description) for stage in stages}
+        self.rule_based_reasons = {}
+
+
+# The stages of a worker process, see `init_worker`.
+_worker_stages: list[CleaningStage] = []
+
+
+def init_worker(stages: list[CleaningStage]) -> None:
+    global _worker_stages
+    _worker_stages = stages
+
+
+def clean_pairs(
+    pairs: list[Pair], stages: Optional[list[CleaningStage]] = None
+) -> tuple[list[Pair], list[int], list[str], list[Any]]:
+    """
+    Run a batch of pairs through the stages. Returns the kept pairs, how many pairs there were
+    before the first stage and after each stage, the debug lines of the filtered pairs, and the
+    results of each stage.
+    """
+    stages = stages or _worker_stages
+    debug_lines = []
+    counts = [len(pairs)]
+    for stage in stages:
+        pairs = stage.clean(pairs, debug_lines)
+        counts.append(len(pairs))
+    return pairs, counts, debug_lines, [stage.take_results() for stage in stages]
+
+
+def read_pairs(src_path: str, trg_path: str) -> Generator[list[Pair], None, None]:
+    """
+    Read the batches of sentence pairs. The lines are only split on the newlines, as they can
+    contain other line breaks, which are normalized by the first stage.
+    """
+    with read_lines(src_path, binary=True) as src_lines, read_lines(
+        trg_path, binary=True
+    ) as trg_lines:
+        pairs = zip_longest(src_lines, trg_lines, fillvalue=b"")
+        while batch := list(islice(pairs, CLEAN_BATCH_SIZE)):
+            # Like `paste`, a missing line is empty.
+            yield [
+                (
+                    src.decode("utf-8", errors="surrogateescape").removesuffix("\n"),
+                    trg.decode("utf-8", errors="surrogateescape").removesuffix("\n"),
+                )
+                for src, trg in batch
+            ]
+
+
+def imap_clean_pairs(
+    batches: Generator[list[Pair], None, None], stages: list[CleaningStage], processes: int
+) -> Generator[tuple[list[Pair], list[int], list[str], list[Any]], None, None]:
+    """Clean the batches in a pool of processes, and yield the results in order."""
+    for stage in stages:
+        stage.prepare()
+
+    with BlockPool(processes, initializer=init_worker, initargs=(stages,)) as pool:
+        yield from pool.imap(clean_pairs, batches)
+
+
+def get_fix_command(script: Path, *args: str) -> Optional[list[str]]:
+    """The fixes are only applied when the dataset has an executable fix script."""
+    if script.is_file() and os.access(script, os.X_OK):
+        return [str(script), *args]
+    return None
+
+
+def is_detokenize_fix(script: Path) -> bool:
+    """Whether a bilingual fix script only runs fixes/detok.sh, see DetokenizeStage."""
+    commands = [
+        line.strip()
+        for line in script.read_text().splitlines()
+        if line.strip() and not line.startswith(("#", "set "))
+    ]
+    return script.name == "detok.sh" or commands == ["fixes/detok.sh $1 $2 $3"]
+
+
+def get_stages(
+    src: str,
+    trg: str,
+    dataset: str,
+    langid_model: Path,
+    langid_cache: Optional[Path] = None,
+) -> list[CleaningStage]:
+    stages: list[CleaningStage] = [NormalizeStage()]
+    fixes_dir = CLEAN_DIR / "fixes"
+    src_fix = get_fix_command(fixes_dir / f"{dataset}.{src}.sh")
+    trg_fix = get_fix_command(fixes_dir / f"{dataset}.{trg}.sh")
+    if src_fix or trg_fix:
+        stages.append(FixStage(src_fix=src_fix, trg_fix=trg_fix))
+    # The batches are fixed in parallel, so each fix only needs one thread.
+    pair_fix = get_fix_command(fixes_dir / f"{dataset}.sh", src, trg, "1")
+    if pair_fix and is_detokenize_fix(fixes_dir / f"{dataset}.sh"):
+        stages.append(DetokenizeStage(src, trg, fixes_dir / f"{dataset}.sh"))
+    elif pair_fix:
+        stages.append(FixStage(pair_fix=pair_fix))
+    stages.append(RuleBasedStage(src, trg))
+    stages.append(LangIdStage(src, trg, langid_model, langid_cache))
+    stages.append(WhitespaceStage())
+    return stages
+
+
+def clean_corpus(
+    input_prefix: str,
+    output_prefix: str,
+    src: str,
+    trg: str,
+    stages: list[CleaningStage],
+    processes: int,
+) -> CleaningStatistics:
+    src_output = Path(f"{output_prefix}.{src}.zst")
+    trg_output = Path(f"{output_prefix}.{trg}.zst")
+    debug_path = Path(f"{output_prefix}.{src}{trg}.clean.debug.txt")
+    stats = CleaningStatistics(Path(f"{output_prefix}.{src}{trg}.zst"), stages)
+    src_output.parent.mkdir(parents=True, exist_ok=True)
+
+    logger.info(f"Cleaning {input_prefix} with the stages:")
+    for stage in stages:
+        logger.info(f" - {stage.name}: {stage.description}")
+
+    rule_based_reasons = Counter()
+    line_count = 0
+    with (
+        write_lines(src_output, compression_threads=-1) as src_outfile,
+        write_lines(trg_output, compression_threads=-1) as trg_outfile,
+        open(debug_path, "w", encoding="utf-8", errors="surrogateescape") as debug_file,
+    ):
+        batches = read_pairs(f"{input_prefix}.{src}.zst", f"{input_prefix}.{trg}.zst")
+        for pairs, counts, debug_lines, results in imap_clean_pairs(batches, stages, processes):
+            for stage, stage_results in zip(stages, results):
+                stage.add_results(stage_results)
+            visited = counts[0]
+            for stage, kept in zip(stages, counts[1:]):
+                step = stats.stages[stage.name]
+                step.kept += kept
+                step.filtered += visited - kept
+                visited = kept
+            for debug_line in debug_lines:
+                rule_based_reasons[debug_line.split("\t", 1)[0]] += 1
+                debug_file.write(debug_line)
+
+            for src_line, trg_line in pairs:
+                src_outfile.write(f"{src_line}\n")
+                trg_outfile.write(f"{trg_line}\n")
+            line_count += len(pairs)
+            logger.info(f"Wrote {line_count:,} pairs")
+
+    stats.rule_based_reasons = dict(rule_based_reasons.most_common())
+    for stage in stages:
+        stage.finish(stats)
+    stats_path = stats.save_json()
+    logger.info(f"Saved the stats: {stats_path}")
+
+    if not line_count:
+        raise ValueError(f"No sentence pairs were kept from {input_prefix}")
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("--src", type=str, required=True, help="The source locale")
+    parser.add_argument("--trg", type=str, required=True, help="The target locale")
+    parser.add_argument(
+        "--input_prefix",
+        type=str,
+        required=True,
+        help="The prefix of the dataset, e.g. $MOZ_FETCHES_DIR/opus_ada83_v1",
+    )
+    parser.add_argument(
+        "--output_prefix",
+        type=str,
+        required=True,
+        help="The prefix of the cleaned dataset, e.g. $TASK_WORKDIR/artifacts/opus_ada83_v1",
+    )
+    parser.add_argument(
+        "--dataset",
+        type=str,
+        required=True,
+        help="The name of the dataset, which selects the fixes, e.g. opus_ada83/v1",
+    )
+    parser.add_argument(
+        "--langid_cache",
+        type=Path,
+        help="A cache of the languages that fastText identified, which is read and updated.",
+    )
+    parser.add_argument(
+        "--threads",
+        type=str,
+        default="auto",
+        help='How many processes clean the pairs, or "auto" for one per logical CPU.',
+    )
+    args = parser.parse_args()
+
+    processes = os.cpu_count() or 1 if args.threads == "auto" else int(args.threads)
+    stages = get_stages(
+        args.src, args.trg, args.dataset, Path(get_model_path()), args.langid_cache
+    )
+    clean_corpus(
+        input_prefix=args.input_prefix,
+        output_prefix=args.output_prefix,
+        src=args.src,
+        trg=args.trg,
+        stages=stages,
+        processes=processes,
+    )
+    logger.info(f"Clean {args.input_prefix} is written to {args.output_prefix}")
+
+
+if __name__ == "__main__":
+    main()
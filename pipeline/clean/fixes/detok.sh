@@ -9,8 +9,15 @@ threads=$3
 
 temp=$(mktemp -d)
 
-tee >(cut -f1 | sacremoses -j $threads -l $SRC detokenize >$temp/$SRC.detok) \
-    | cut -f2 | sacremoses -j $threads -l $TRG detokenize >$temp/$TRG.detok
+# Both sides are detokenized in the background, and waited on before they're pasted, so that
+# neither output is read before it's complete.
+cat >$temp/input
+cut -f1 $temp/input | sacremoses -j $threads -l $SRC detokenize >$temp/$SRC.detok &
+src_pid=$!
+cut -f2 $temp/input | sacremoses -j $threads -l $TRG detokenize >$temp/$TRG.detok &
+trg_pid=$!
+wait $src_pid
+wait $trg_pid
 
 paste $temp/$SRC.detok $temp/$TRG.detok
 
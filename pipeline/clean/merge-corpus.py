@@ -12,20 +12,56 @@ For instance:
 
   corpus.en.zst
   corpus.ru.zst
+
+The fingerprints of the lines of each language are also written to a sorted index, which
+merge-mono uses to de-duplicate the monolingual data against the parallel corpus:
+
+  corpus.en.hashes
+  corpus.ru.hashes
+
+The fingerprints of the sentence pairs are kept as well, and with --write_manifest the checksums
+of the datasets, so that a later merge can append new datasets to this corpus with
+--previous_corpus rather than merging everything again. Computing the checksums reads every
+dataset once more, so the manifest is opt-in:
+
+  corpus.pairs.hashes
+  corpus.manifest.json
 """
 
 import argparse
+import hashlib
+import json
+import shutil
 from contextlib import ExitStack
+from dataclasses import dataclass
 from glob import glob
+from itertools import islice
 from pathlib import Path
-from typing import Generator, Optional
+from typing import Generator, Iterable, Optional
+
+import numpy as np
 from pipeline.common.datasets import (
     FilteringStep,
     Statistics,
+    TeeSampleWriter,
     WeakStringSet,
     shuffle_with_max_lines,
 )
-from pipeline.common.downloads import get_human_readable_file_size, read_lines, write_lines
+from pipeline.common.downloads import (
+    get_human_readable_file_size,
+    get_seekable_index_path,
+    read_lines,
+    write_lines,
+)
+from pipeline.common.fingerprint_index import (
+    FINGERPRINT_BATCH_SIZE,
+    FingerprintIndex,
+    FingerprintIndexWriter,
+    FingerprintPool,
+    PartitionedFingerprintSet,
+    batch_lines,
+    get_column_fingerprints,
+)
 from pipeline.common.logging import get_logger
 
 logger = get_logger(__file__)
@@ -53,6 +89,41 @@ class FilteringStatistics(Statistics):
         self.datasets.append(step)
         return step
 
+    def add_previous_corpus(self, stats_json: dict) -> None:
+        """Continue the statistics of a previous merge that new datasets are appended to."""
+        self.parallel_corpus.filtered = stats_json["parallel_corpus"]["filtered"]
+        self.parallel_corpus.kept = stats_json["parallel_corpus"]["kept"]
+        for dataset in stats_json["datasets"]:
+            self.datasets.append(
+                FilteringStep(dataset["description"], dataset["filtered"], dataset["kept"])
+            )
+
+
+@dataclass
+class PreviousCorpus:
+    """
+    The outputs of a previous merge of some of the datasets, which the new datasets can be
+    appended to. See `find_previous_corpus`.
+    """
+
+    src_path: Path
+    trg_path: Path
+    src_hashes_path: Path
+    trg_hashes_path: Path
+    pairs_hashes_path: Path
+    sample_path: Path
+    stats: dict
+    manifest: dict
+
+    def get_output_paths(self) -> list[Path]:
+        """The files that are copied to the new corpus, and then appended to."""
+        return [
+            self.src_path,
+            get_seekable_index_path(self.src_path),
+            self.trg_path,
+            get_seekable_index_path(self.trg_path),
+        ]
+
 
 def log_dataset(location: str):
     logger.info(f"Reading dataset {location}")
@@ -65,14 +136,31 @@ class DeduplicateCorpus:
         datasets_trg: list[Path],
         src_outpath: Path,
         trg_outpath: Path,
+        src_hashes_path: Path,
+        trg_hashes_path: Path,
+        pairs_hashes_path: Path,
+        sample_path: Path,
+        sample_size: int,
         stats: FilteringStatistics,
+        pool: FingerprintPool,
+        dedup_partitions: int = 1,
+        previous_corpus: Optional[PreviousCorpus] = None,
     ) -> None:
         self.datasets_src: list[Path] = datasets_src
         self.datasets_trg: list[Path] = datasets_trg
         self.src_outpath: Path = src_outpath
         self.trg_outpath: Path = trg_outpath
+        self.src_hashes_path: Path = src_hashes_path
+        self.trg_hashes_path: Path = trg_hashes_path
+        self.pairs_hashes_path: Path = pairs_hashes_path
+        self.sample_path: Path = sample_path
+        self.sample_size: int = sample_size
         self.stats: FilteringStatistics = stats
+        self.pool: FingerprintPool = pool
+        self.dedup_partitions: int = dedup_partitions
+        self.previous_corpus: Optional[PreviousCorpus] = previous_corpus
         self.dataset_stats: FilteringStep = None
+        self.pairs_index: FingerprintIndexWriter = None
 
     def run(
         self,
@@ -80,33 +168,81 @@ class DeduplicateCorpus:
         max_lines: Optional[int],
     ):
         stats = self.stats
+        previous_corpus = self.previous_corpus
         with ExitStack() as stack:
-            src_outfile = stack.enter_context(write_lines(self.src_outpath))
-            trg_outfile = stack.enter_context(write_lines(self.trg_outpath))
+            # The merged corpus can be tens of gigabytes, so compress it on all of the cores.
+            # It's seekable so that it can be split and decompressed in parallel, and so that
+            # the pairs of new datasets can be appended to it.
+            src_outfile = stack.enter_context(
+                write_lines(
+                    self.src_outpath,
+                    compression_threads=-1,
+                    seekable=True,
+                    append=bool(previous_corpus),
+                )
+            )
+            trg_outfile = stack.enter_context(
+                write_lines(
+                    self.trg_outpath,
+                    compression_threads=-1,
+                    seekable=True,
+                    append=bool(previous_corpus),
+                )
+            )
+            src_index = stack.enter_context(FingerprintIndexWriter(self.src_hashes_path))
+            trg_index = stack.enter_context(FingerprintIndexWriter(self.trg_hashes_path))
+            self.pairs_index = stack.enter_context(FingerprintIndexWriter(self.pairs_hashes_path))
+            # The sample is drawn as the pairs are written, rather than by reading the corpus
+            # back in.
+            logger.info(f"Write a {self.sample_size:,} line sample of the merged corpus:")
+            logger.info(f" - {self.sample_path}")
+            sample_writer = stack.enter_context(
+                TeeSampleWriter(
+                    [src_outfile, trg_outfile], self.sample_path, self.sample_size, seed=9834523434
+                )
+            )
+
+            if previous_corpus:
+                # Carry over the fingerprints and the sample of the previous corpus.
+                for index_writer, previous_path in [
+                    (src_index, previous_corpus.src_hashes_path),
+                    (trg_index, previous_corpus.trg_hashes_path),
+                    (self.pairs_index, previous_corpus.pairs_hashes_path),
+                ]:
+                    index_writer.add_fingerprints(np.fromfile(previous_path, dtype="<u8"))
+                sample_writer.add_previous_sample(
+                    previous_corpus.sample_path, previous_corpus.stats["parallel_corpus"]["kept"]
+                )
+
+            def write_pairs(pairs: Iterable[tuple[str, str]]):
+                # The fingerprints of each side are computed on all of the cores.
+                for batch, (src_fingerprints, trg_fingerprints) in self.pool.imap(
+                    batch_lines(pairs), get_column_fingerprints
+                ):
+                    sample_writer.write_rows(batch)
+                    src_index.add_fingerprints(src_fingerprints)
+                    trg_index.add_fingerprints(trg_fingerprints)
 
             if max_lines:
-                for line in shuffle_with_max_lines(
-                    line_stream=self.yield_lines_string(stack),
+                lines = shuffle_with_max_lines(
+                    line_stream=self.yield_lines_without_tabs(stack),
                     seed=38540735095,
                     max_lines=max_lines,
                     total_byte_size=total_corpus_bytes,
-                ):
-                    src_line, trg_line = line.split("\t")
-                    src_outfile.write(src_line)
-                    trg_outfile.write(trg_line)
+                    # The pairs are stored as two columns, rather than joined by a tab.
+                    columns=2,
+                )
+                write_pairs(lines)
 
                 stats.final_truncated.visited = stats.parallel_corpus.kept
                 stats.final_truncated.kept = min(max_lines, stats.parallel_corpus.kept)
             else:
-                for src_line, trg_line in self.yield_lines_tuple(stack):
-                    src_outfile.write(src_line)
-                    trg_outfile.write(trg_line)
+                write_pairs(self.yield_lines_tuple(stack))
 
                 stats.final_truncated.kept = stats.parallel_corpus.kept
                 stats.final_truncated.visited = stats.parallel_corpus.kept
 
     def yield_lines_tuple(self, stack: ExitStack) -> Generator[tuple[str, str], None, None]:
-        strings_seen = WeakStringSet()
         stats = self.stats
         src_lines: Generator[str, None, None] = stack.enter_context(
             read_lines(self.datasets_src, on_enter_location=self.on_enter_location)
@@ -115,89 +251,146 @@ class DeduplicateCorpus:
             read_lines(self.datasets_trg, on_enter_location=log_dataset)
         )
 
-        for src_line, trg_line in zip(src_lines, trg_lines):
+        pairs = zip(src_lines, trg_lines)
+
+        def read_batches():
+            # The batches are read ahead of the de-duplication, so note which dataset each
+            # pair came from as it's read.
+            while True:
+                batch = []
+                batch_dataset_stats = []
+                for pair in islice(pairs, FINGERPRINT_BATCH_SIZE):
+                    batch.append(pair)
+                    batch_dataset_stats.append(self.dataset_stats)
+                if not batch:
+                    return
+                yield batch, batch_dataset_stats
+
+        # The fingerprints are computed on all of the cores, and checked in order.
+        fingerprinted_batches = self.pool.imap(
+            read_batches(),
             # No separator is needed as the newline is included.
-            line = src_line + trg_line
-
-            if line in strings_seen:
-                stats.parallel_corpus.filtered += 1
-                self.dataset_stats.filtered += 1
-            else:
-                stats.parallel_corpus.kept += 1
-                self.dataset_stats.kept += 1
+            get_lines=lambda batch: [src_line + trg_line for src_line, trg_line in batch[0]],
+        )
 
-                strings_seen.add(line)
+        # The pairs of a previous corpus that the new datasets are appended to.
+        previous_pairs = None
+        if self.previous_corpus:
+            previous_pairs = FingerprintIndex(self.previous_corpus.pairs_hashes_path)
 
-                yield src_line, trg_line
+        # Adding the fingerprints checks if the lines were already seen.
+        if self.dedup_partitions == 1:
+            strings_seen = WeakStringSet()
+            deduplicated_batches = (
+                (item, strings_seen.add_fingerprints(item[1])) for item in fingerprinted_batches
+            )
+        else:
+            # The fingerprints are partitioned across processes, which each check and hold
+            # their own slice. The results are the same as with a single set.
+            strings_seen = stack.enter_context(PartitionedFingerprintSet(self.dedup_partitions))
+            deduplicated_batches = strings_seen.imap_add_fingerprints(
+                fingerprinted_batches, get_fingerprints=lambda item: item[1]
+            )
 
-    def yield_lines_string(self, stack: ExitStack) -> Generator[str, None, None]:
+        for ((batch, batch_dataset_stats), fingerprints), is_unseen in deduplicated_batches:
+            is_new = is_unseen
+            if previous_pairs is not None:
+                # The pairs of the previous corpus are only in its index, and not in the set.
+                is_new = is_unseen & ~previous_pairs.contains_fingerprints(fingerprints)
+            # The pairs that were seen, including the ones that are truncated away later.
+            self.pairs_index.add_fingerprints(fingerprints[is_new])
+
+            for (src_line, trg_line), dataset_stats, keep in zip(
+                batch, batch_dataset_stats, is_new
+            ):
+                if not keep:
+                    stats.parallel_corpus.filtered += 1
+                    dataset_stats.filtered += 1
+                else:
+                    stats.parallel_corpus.kept += 1
+                    dataset_stats.kept += 1
+
+                    yield src_line, trg_line
+
+    def yield_lines_without_tabs(self, stack: ExitStack) -> Generator[tuple[str, str], None, None]:
         for src_line, trg_line in self.yield_lines_tuple(stack):
             if "\t" in src_line or "\t" in trg_line:
                 logger.error("A line contained a tab character, skipping:")
                 logger.error(f" src: {src_line}")
                 logger.error(f" trg: {src_line}")
             else:
-                yield f"{src_line}\t{trg_line}"
+                yield src_line, trg_line
 
     def on_enter_location(self, location):
         log_dataset(location)
         self.dataset_stats = self.stats.add_parallel_dataset(location)
 
 
-def sample_corpus(
-    artifacts: Path, name: str, sample_size: int, src_outpath: Path, trg_outpath: Path
-):
-    """
-    Generate a sample of the corpus data with the following format:
-
-    e.g.
-    > cat artifacts/corpus.sample.txt
-    Sentence 1 in source language
-    Sentence 1 in target language
+def get_checksum(path: Path) -> str:
+    """Compute the sha256 of a dataset, to tell if it changed since a previous merge."""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(1024 * 1024):
+            sha256.update(chunk)
+    return sha256.hexdigest()
 
-    Sentence 2 in source language
-    Sentence 2 in target language
 
-    Sentence 3 in source language
-    Sentence 3 in target language
-    ...
+def find_previous_corpus(
+    previous_dir: Path, name: str, manifest: dict, max_lines: Optional[int]
+) -> Optional[PreviousCorpus]:
+    """
+    Check if the corpus of a previous merge can be reused. All of the datasets that it merged
+    must be unchanged, and neither corpus can be truncated. Otherwise the corpus is merged from
+    scratch, and None is returned.
     """
-    total_byte_size = src_outpath.stat().st_size + trg_outpath.stat().st_size
-
-    with ExitStack() as stack:
-        sample_path = artifacts / f"{name}.sample.txt"
-
-        src_lines = stack.enter_context(read_lines(src_outpath))
-        trg_lines = stack.enter_context(read_lines(trg_outpath))
-        sample_outfile = stack.enter_context(
-            write_lines(
-                sample_path,
-                # The browser won't know the encoding when viewing this sample without including
-                # a "byte order mark", which python can do via this encoding.
-                encoding="utf-8-sig",
-            )
-        )
-
-        def join_src_trg():
-            for src_line, trg_line in zip(src_lines, trg_lines):
-                # The src and trg line each have a newline at the end. This means that
-                # each sentence pair will be separate by a blank line to make for easy
-                # scanning of datasets.
-                yield f"{src_line}{trg_line}\n"
 
-        logger.info("Stream in:")
-        logger.info(f" - {src_outpath}")
-        logger.info(f" - {trg_outpath}")
-        logger.info(f"Write a {sample_size:,} line sample of the merged corpus:")
-        logger.info(f" - {sample_path}")
+    def rebuild(reason: str) -> None:
+        logger.info(
+            f"The previous corpus can't be reused, as {reason}. Merge all of the datasets."
+        )
 
-        for line in shuffle_with_max_lines(
-            line_stream=join_src_trg(),
-            seed=9834523434,
-            max_lines=sample_size,
-            total_byte_size=total_byte_size,
-        ):
-            sample_outfile.write(line)
+    if max_lines is not None:
+        return rebuild("the corpus is truncated by max_lines")
+
+    src, trg = manifest["src"], manifest["trg"]
+    previous_corpus = PreviousCorpus(
+        src_path=previous_dir / f"{name}.{src}.zst",
+        trg_path=previous_dir / f"{name}.{trg}.zst",
+        src_hashes_path=previous_dir / f"{name}.{src}.hashes",
+        trg_hashes_path=previous_dir / f"{name}.{trg}.hashes",
+        pairs_hashes_path=previous_dir / f"{name}.pairs.hashes",
+        sample_path=previous_dir / f"{name}.sample.txt",
+        stats={},
+        manifest={},
+    )
+    stats_path = previous_dir / f"{name}.stats.json"
+    manifest_path = previous_dir / f"{name}.manifest.json"
+    for path in [
+        *previous_corpus.get_output_paths(),
+        previous_corpus.src_hashes_path,
+        previous_corpus.trg_hashes_path,
+        previous_corpus.pairs_hashes_path,
+        previous_corpus.sample_path,
+        stats_path,
+        manifest_path,
+    ]:
+        if not path.exists():
+            return rebuild(f"{path} is missing")
+
+    previous_corpus.stats = json.loads(stats_path.read_text())
+    previous_corpus.manifest = json.loads(manifest_path.read_text())
+    previous_manifest = previous_corpus.manifest
+    if (previous_manifest["src"], previous_manifest["trg"]) != (src, trg):
+        return rebuild("it is for another language pair")
+    if previous_manifest["max_lines"] is not None:
+        return rebuild("it was truncated by max_lines")
+    for dataset, checksum in previous_manifest["datasets"].items():
+        if dataset not in manifest["datasets"]:
+            return rebuild(f"the dataset {dataset} was removed")
+        if manifest["datasets"][dataset] != checksum:
+            return rebuild(f"the dataset {dataset} changed")
+
+    return previous_corpus
 
 
 def get_datasets(src: str, trg: str, datasets_glob: str):
@@ -259,6 +452,32 @@ def main() -> None:
         "--sample_size", type=int, default=10_000, help="Generate a random sample of sentences."
     )
 
+    parser.add_argument(
+        "--dedup_partitions",
+        type=int,
+        default=1,
+        help="De-duplicate the sentence pairs in this many processes, which each hold a "
+        "partition of the fingerprints. -1 uses a process per logical CPU. The result is the "
+        "same as de-duplicating them in a single process.",
+    )
+
+    parser.add_argument(
+        "--previous_corpus",
+        type=Path,
+        default=None,
+        help="The artifacts directory of a previous merge of some of the datasets. If those "
+        "datasets are unchanged, only the new datasets are de-duplicated and appended to the "
+        "previous corpus. The new datasets are appended in order after the previous ones. "
+        "Otherwise all of the datasets are merged.",
+    )
+
+    parser.add_argument(
+        "--write_manifest",
+        action="store_true",
+        help="Write the checksums of the datasets, so that a later merge can append to this "
+        "corpus with --previous_corpus. This is implied by --previous_corpus.",
+    )
+
     parser.add_argument(
         "--artifacts",
         type=Path,
@@ -281,32 +500,75 @@ def main() -> None:
 
     src_outpath = args.artifacts / f"{args.name}.{args.src}.zst"
     trg_outpath = args.artifacts / f"{args.name}.{args.trg}.zst"
+    src_hashes_path = args.artifacts / f"{args.name}.{args.src}.hashes"
+    trg_hashes_path = args.artifacts / f"{args.name}.{args.trg}.hashes"
+    pairs_hashes_path = args.artifacts / f"{args.name}.pairs.hashes"
+    sample_path = args.artifacts / f"{args.name}.sample.txt"
 
     stats = FilteringStatistics(args.artifacts / args.name)
+    pool = FingerprintPool(processes=-1)
 
     max_lines: Optional[int] = None
     if args.max_lines != "None":
         max_lines = int(args.max_lines)
 
+    # The checksums of the datasets, in the order they are merged. They're only computed when
+    # they're needed, as it reads every dataset.
+    manifest = None
+    if args.write_manifest or args.previous_corpus:
+        manifest = {
+            "src": args.src,
+            "trg": args.trg,
+            "max_lines": max_lines,
+            "datasets": {path.name: get_checksum(path) for path in datasets_src + datasets_trg},
+        }
+
+    previous_corpus = None
+    if args.previous_corpus:
+        if args.previous_corpus.resolve() == args.artifacts.resolve():
+            raise ValueError("The previous corpus must be in another directory than the artifacts")
+        previous_corpus = find_previous_corpus(
+            args.previous_corpus, args.name, manifest, max_lines
+        )
+
+    if previous_corpus:
+        # Only merge the new datasets, and keep them in the order after the previous ones.
+        previous_datasets = previous_corpus.manifest["datasets"]
+        datasets_src = [path for path in datasets_src if path.name not in previous_datasets]
+        datasets_trg = [path for path in datasets_trg if path.name not in previous_datasets]
+        manifest["datasets"] = {**previous_datasets, **manifest["datasets"]}
+        logger.info(f"Append {len(datasets_src)} new datasets to the previous corpus:")
+        for path in datasets_src + datasets_trg:
+            logger.info(f" - {path}")
+
+        for path in previous_corpus.get_output_paths():
+            shutil.copyfile(path, args.artifacts / path.name)
+        stats.add_previous_corpus(previous_corpus.stats)
+
     deduplicate_corpus = DeduplicateCorpus(
         datasets_src,
         datasets_trg,
         src_outpath,
         trg_outpath,
+        src_hashes_path,
+        trg_hashes_path,
+        pairs_hashes_path,
+        sample_path,
+        args.sample_size,
         stats,
+        pool,
+        args.dedup_partitions,
+        previous_corpus,
     )
 
-    deduplicate_corpus.run(total_corpus_bytes, max_lines)
-
-    sample_corpus(
-        artifacts=args.artifacts,
-        name=args.name,
-        sample_size=args.sample_size,
-        src_outpath=src_outpath,
-        trg_outpath=trg_outpath,
-    )
+    with pool:
+        deduplicate_corpus.run(total_corpus_bytes, max_lines)
 
     stats.save_json()
+    if manifest:
+        (args.artifacts / f"{args.name}.manifest.json").write_text(
+            json.dumps(manifest, indent=2) + "\n"
+        )
 
 
 if __name__ == "__main__":
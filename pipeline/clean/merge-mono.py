@@ -1,28 +1,44 @@
 import argparse
 import glob
+import math
 import os
 from dataclasses import dataclass
+from itertools import islice
 from pathlib import Path
-from typing import Generator
+from typing import Generator, Optional, Union
+
+import numpy as np
 
 from pipeline.common.datasets import (
+    SHUFFLE_FRAME_BYTES,
+    SHUFFLE_MEMORY_FACTOR,
+    ApproximateDeduplicationStep,
+    ApproximateStringSet,
     CountingStep,
     FilteringStep,
     Statistics,
+    TeeSampleWriter,
     WeakStringSet,
+    shuffle_lines_on_disk,
     shuffle_with_max_lines,
 )
 from pipeline.common.downloads import (
+    count_lines,
     format_bytes,
     get_human_readable_file_size,
     read_lines,
     write_lines,
 )
+from pipeline.common.fingerprint_index import FingerprintIndex, FingerprintPool, batch_lines
 from pipeline.common.logging import get_logger
 from pipeline.common.memory import log_memory
 
 logger = get_logger(__file__)
 
+# Text usually compresses 3-5 times with zstd. The upper end is assumed when sizing the buckets
+# of the shuffle on disk, so that they fit in the memory budget.
+MAX_COMPRESSION_RATIO = 5
+
 
 @dataclass
 class FilteringStatistics(Statistics):
@@ -62,23 +78,49 @@ class FilteringStatistics(Statistics):
             "After deduplication, how much monolingual data is left."
         )
 
+    def add_approximate_deduplication(
+        self, mono_hashes: ApproximateStringSet
+    ) -> ApproximateDeduplicationStep:
+        # This is only reported when the lines are de-duplicated approximately.
+        self.approximate_deduplication = ApproximateDeduplicationStep(mono_hashes)
+        return self.approximate_deduplication
+
+
+def estimate_shuffle_memory(mono_datasets: list[str], max_lines: int) -> int:
+    """
+    Estimate the memory that `shuffle_with_max_lines` needs for `max_lines`, from the average
+    size of the first lines. Each line takes its bytes in the reservoir, up to a quarter more
+    before the reservoir is compacted, and 16 bytes for its offset and index.
+    """
+    with read_lines(mono_datasets) as lines:
+        sample = list(islice(lines, 10_000))
+    bytes_per_line = sum(len(line.encode("utf-8")) for line in sample) / max(len(sample), 1)
+    return int(max_lines * (bytes_per_line * 1.25 + 16))
+
 
 def filter_and_write_monolingual_data(
     mono_datasets: list[str],
     output_path: Path,
-    parallel_hashes: WeakStringSet,
+    parallel_index: FingerprintIndex,
+    mono_hashes: Union[WeakStringSet, ApproximateStringSet],
+    pool: FingerprintPool,
     max_lines: int,
     sample_size: int,
     stats: FilteringStatistics,
+    max_memory_bytes: Optional[int] = None,
 ) -> None:
     """
-    Filtering is done with a set[int]. Seeing if a line is in the set should be O(1)
-    in terms of time complexity. A set[int] was chosen (storing the hash) rather than
-    a set[str], as the latter would retain the string in memory.
+    Filtering is done with line fingerprints. The parallel corpus is looked up with a binary
+    search of its memory-mapped fingerprint index, and the monolingual lines that were already
+    seen are stored in `mono_hashes`. Only the 64 bit fingerprint of each line is stored, as
+    storing the strings would retain them in memory. An ApproximateStringSet caps the memory,
+    but drops a few unique lines. The fingerprints are computed on all of the cores by the pool.
+
+    The lines are shuffled in memory, unless that's estimated to take more than the
+    `max_memory_bytes`. Then the lines are shuffled in compressed buckets on disk, and only a few
+    buckets are held in memory at a time, so the memory doesn't depend on the `max_lines`.
     """
 
-    mono_hashes = WeakStringSet()
-
     def deduplicate_lines(lines: Generator[str, None, None]) -> Generator[str, None, None]:
         """
         This is the generator that will perform the deduplication on a line stream. It's passed
@@ -87,16 +129,20 @@ def filter_and_write_monolingual_data(
         parallel_discards = 0
         mono_discards = 0
         retained = 0
-        for line in lines:
-            # Don't add this sentence if it's in the original parallel corpus, or if it's
+        # The lines are looked up in batches, which is faster than one at a time.
+        for batch, fingerprints in pool.imap(batch_lines(lines)):
+            # Don't add a sentence if it's in the original parallel corpus, or if it's
             # already present in the monolingual data, perhaps from another source.
-            if line in parallel_hashes:
-                parallel_discards += 1
-            elif line in mono_hashes:
-                mono_discards += 1
-            else:
+            in_parallel = parallel_index.contains_fingerprints(fingerprints)
+            is_new = np.zeros(len(batch), dtype=bool)
+            is_new[~in_parallel] = mono_hashes.add_fingerprints(fingerprints[~in_parallel])
+            parallel_discards += int(in_parallel.sum())
+            mono_discards += len(batch) - int(in_parallel.sum()) - int(is_new.sum())
+
+            for line, keep in zip(batch, is_new):
+                if not keep:
+                    continue
                 retained += 1
-                mono_hashes.add(line)  # Don't add this sentence again.
 
                 # Report progress periodically.
                 if retained % 1_000_000 == 0:
@@ -112,7 +158,9 @@ def filter_and_write_monolingual_data(
 
         stats.duplicates_of_parallel_corpus.value = parallel_discards
         stats.duplicates_of_monolingual_corpus.value = mono_discards
-        stats.parallel_corpus_lines.value = len(parallel_hashes)
+        stats.parallel_corpus_lines.value = len(parallel_index)
+        if isinstance(mono_hashes, ApproximateStringSet):
+            stats.approximate_deduplication.dropped_as_duplicates = mono_discards
 
     # Estimate the byte size. The better the estimate, the better the data distribution will be.
     # When filtering mono NLLB data against parallel NLLB data, roughly 70% is kept.
@@ -121,75 +169,83 @@ def filter_and_write_monolingual_data(
         byte_size_estimate += os.path.getsize(dataset)
     byte_size_estimate *= 0.7
 
-    log_memory(gc_collect=True)
-    logger.info("Deduplicated and shuffling lines in memory.")
-    with read_lines(mono_datasets) as mono_dataset_lines:
-        final_lines = shuffle_with_max_lines(
-            line_stream=deduplicate_lines(
-                mono_dataset_lines,
-            ),
-            seed=347489345,
-            max_lines=max_lines,
-            total_byte_size=byte_size_estimate,
-        )
-
-    log_memory(gc_collect=True)
-    logger.info(f"Write the final file: {output_path}")
-    with write_lines(output_path) as outfile:
-        stats.final_truncated_monolingual_lines.value = len(final_lines)
-        for i, line in enumerate(final_lines):
-            stats.final_truncated_monolingual_codepoints.value += len(line)
-            outfile.write(line)
-            if i % 1_000_000 == 999_999:
-                logger.info(f"Wrote line {i+1:,} to {output_path}")
+    shuffle_on_disk = False
+    if max_memory_bytes:
+        shuffle_memory_estimate = estimate_shuffle_memory(mono_datasets, max_lines)
+        shuffle_on_disk = shuffle_memory_estimate > max_memory_bytes
 
     log_memory(gc_collect=True)
-    sample_path = output_path.parent / f"{output_path.stem}.sample.txt"
-    logger.info(f"Write a 10,000 line sample of the final: {sample_path}")
-    with write_lines(
-        sample_path,
-        # The browser won't know the encoding when viewing this sample without including
-        # a "byte order mark", which python can do via this encoding.
-        encoding="utf-8-sig",
-    ) as outfile:
-        for line in shuffle_with_max_lines(
-            line_stream=final_lines,
-            seed=9834523434,
-            max_lines=sample_size,
-            total_byte_size=os.path.getsize(output_path),
+    with read_lines(mono_datasets) as mono_dataset_lines:
+        if shuffle_on_disk:
+            # Size the buckets for the uncompressed size of all of the lines, as they are all
+            # partitioned before they are sampled. The frames that are buffered while
+            # partitioning take at most half of the budget.
+            bucket_count = max(
+                1,
+                math.ceil(
+                    byte_size_estimate
+                    * MAX_COMPRESSION_RATIO
+                    * SHUFFLE_MEMORY_FACTOR
+                    / max_memory_bytes
+                ),
+            )
+            logger.info(
+                f"Shuffling the lines on disk, as shuffling in memory is estimated to take "
+                f"{format_bytes(shuffle_memory_estimate)}, which is over the budget of "
+                f"{format_bytes(max_memory_bytes)}. Deduplicate and partition the lines into "
+                f"{bucket_count:,} buckets."
+            )
+            final_lines = shuffle_lines_on_disk(
+                line_stream=deduplicate_lines(mono_dataset_lines),
+                seed="347489345",
+                bucket_count=bucket_count,
+                max_lines=max_lines,
+                frame_bytes=min(SHUFFLE_FRAME_BYTES, max_memory_bytes // 2 // bucket_count),
+                max_memory_bytes=max_memory_bytes,
+            )
+        else:
+            logger.info("Deduplicated and shuffling lines in memory.")
+            final_lines = shuffle_with_max_lines(
+                line_stream=deduplicate_lines(
+                    mono_dataset_lines,
+                ),
+                seed=347489345,
+                max_lines=max_lines,
+                total_byte_size=byte_size_estimate,
+            )
+            log_memory(gc_collect=True)
+
+        logger.info(f"Write the final file: {output_path}")
+        sample_path = output_path.parent / f"{output_path.stem}.sample.txt"
+        logger.info(f"Write a {sample_size:,} line sample of the final: {sample_path}")
+        # The merged corpus can be tens of gigabytes, so compress it on all of the cores.
+        # It's seekable so that it can be split and decompressed in parallel. The sample is
+        # drawn as the lines are written.
+        with (
+            write_lines(output_path, compression_threads=-1, seekable=True) as outfile,
+            TeeSampleWriter([outfile], sample_path, sample_size, seed=9834523434) as sample_writer,
         ):
-            outfile.write(line)
+            line_count = 0
+            for line in final_lines:
+                stats.final_truncated_monolingual_codepoints.value += len(line)
+                sample_writer.write(line)
+                line_count += 1
+                if line_count % 1_000_000 == 0:
+                    logger.info(f"Wrote line {line_count:,} to {output_path}")
+            stats.final_truncated_monolingual_lines.value = line_count
 
     log_memory(gc_collect=True)
     stats_path = stats.save_json()
     logger.info(f"Saved the stats: {stats_path}")
 
 
-def compute_line_hashes(path: Path) -> WeakStringSet:
-    """
-    In order to de-duplicate sentences we can compute a hash and store it in memory. This makes
-    it so that we don't have to store the full sentence in memory. It's about 10 bytes per int
-    stored in the set.
-    """
-    line_hashes = WeakStringSet()
-    sentences_visited = 0
-
-    with read_lines(path) as lines:
-        for line in lines:
-            sentences_visited += 1
-            if sentences_visited % 1_000_000 == 0:
-                logger.info(f"Hashing sentence {sentences_visited:,}")
-            line_hashes.add(line)
-
-    return line_hashes
-
-
 def main() -> None:
     parser = argparse.ArgumentParser(description="Merge monolingual datasets.")
     parser.add_argument(
-        "--parallel_corpus",
+        "--parallel_hashes",
         type=Path,
-        help="The path to the parallel corpus of this language, e.g. $MOZ_FETCHES_DIR/corpus.ca.zst",
+        help="The fingerprint index of the parallel corpus of this language, "
+        "e.g. $MOZ_FETCHES_DIR/corpus.ca.hashes",
     )
     parser.add_argument(
         "--output",
@@ -207,12 +263,42 @@ def main() -> None:
     parser.add_argument(
         "--sample_size", type=int, default=10_000, help="Generate a random sample of sentences."
     )
+    parser.add_argument(
+        "--dedup",
+        choices=["exact", "approximate"],
+        default="exact",
+        help="How to de-duplicate the monolingual lines. The exact de-duplication stores "
+        "11-23 bytes per kept line. The approximate de-duplication uses a Bloom filter with a "
+        "fixed amount of memory, but drops a few unique lines as false positives.",
+    )
+    parser.add_argument(
+        "--dedup_false_positive_rate",
+        type=float,
+        default=0.001,
+        help="The target rate of unique lines dropped by the approximate de-duplication.",
+    )
+    parser.add_argument(
+        "--dedup_max_megabytes",
+        type=int,
+        default=None,
+        help="The memory cap for the approximate de-duplication. If the target false positive "
+        "rate needs more memory than this, the rate will be higher.",
+    )
+
+    parser.add_argument(
+        "--max_memory_megabytes",
+        type=int,
+        default=None,
+        help="The memory budget for shuffling the lines. If shuffling `max_sentences` in memory "
+        "is estimated to need more than this, the lines are shuffled on disk instead, which "
+        "keeps the memory constant.",
+    )
 
     args = parser.parse_args()
 
     output_path: Path = args.output
     max_sentences: int = args.max_sentences
-    parallel_corpus: str = args.parallel_corpus
+    parallel_hashes: Path = args.parallel_hashes
     mono_dataset_paths: list[str] = glob.glob(args.datasets_glob)
 
     if not mono_dataset_paths:
@@ -227,31 +313,52 @@ def main() -> None:
 
     logger.info(f" - {format_bytes(total_mono_bytes)} total")
 
-    formatted_size = (get_human_readable_file_size(path))[0]
-    logger.info("Parallel corpus:")
-    logger.info(f" - {parallel_corpus} ({formatted_size})")
+    formatted_size = (get_human_readable_file_size(parallel_hashes))[0]
+    logger.info("Parallel corpus fingerprints:")
+    logger.info(f" - {parallel_hashes} ({formatted_size})")
 
     # Ensure output directory exists
     output_dir = output_path.parent
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    # Compute the line hashes so that the monolingual data can be de-duplicated.
-    # It's about 10 bytes per hash in a set, so for a 100 million sentence corpus,
-    # it would be ~1G in memory.
+    # The fingerprints of the parallel corpus were computed by merge-corpus, so that the
+    # monolingual data can be de-duplicated without re-reading the corpus. The index is
+    # memory-mapped rather than loaded.
     log_memory()
-    logger.info(f"Compute hashes of the parallel data: {path}")
-    line_hashes = compute_line_hashes(parallel_corpus)
+    parallel_index = FingerprintIndex(parallel_hashes)
 
     stats = FilteringStatistics(output_path)
 
-    filter_and_write_monolingual_data(
-        mono_datasets=mono_dataset_paths,
-        output_path=output_path,
-        parallel_hashes=line_hashes,
-        max_lines=max_sentences,
-        sample_size=args.sample_size,
-        stats=stats,
-    )
+    if args.dedup == "approximate":
+        # Size the filter for every monolingual line, which is an upper bound on what is kept.
+        mono_line_count = sum(count_lines(path) for path in mono_dataset_paths)
+        mono_hashes = ApproximateStringSet(
+            capacity=mono_line_count,
+            false_positive_rate=args.dedup_false_positive_rate,
+            max_bytes=args.dedup_max_megabytes * 1_000_000 if args.dedup_max_megabytes else None,
+        )
+        dedup_stats = stats.add_approximate_deduplication(mono_hashes)
+        logger.info(
+            f"De-duplicate {mono_line_count:,} lines approximately with a "
+            f"{format_bytes(dedup_stats.memory_bytes)} Bloom filter"
+        )
+    else:
+        mono_hashes = WeakStringSet()
+
+    with FingerprintPool(processes=-1) as pool:
+        filter_and_write_monolingual_data(
+            mono_datasets=mono_dataset_paths,
+            output_path=output_path,
+            parallel_index=parallel_index,
+            mono_hashes=mono_hashes,
+            pool=pool,
+            max_lines=max_sentences,
+            sample_size=args.sample_size,
+            stats=stats,
+            max_memory_bytes=(
+                args.max_memory_megabytes * 1_000_000 if args.max_memory_megabytes else None
+            ),
+        )
 
     logger.info("Done: Merging monolingual datasets")
 
@@ -2,8 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import re
 import sys
+from functools import partial
 
 MIN_LENGTH = 2  # minimum number of words in a sentence
 MAX_LENGTH = 150  # maximum number of words in a sentence
@@ -11,26 +11,57 @@ MAX_LENGTH = 150  # maximum number of words in a sentence
 RATIO_ALPHA_WORDS = 0.4  # minimum fraction of "real" words in a sentence
 RATIO_ALPHA_CHARS = 0.5  # minimum fraction of alpha characters in a sentence
 
-from clean_parallel import CHARS
+# How many lines are read from stdin and cleaned at a time.
+BATCH_SIZE = 10_000
+
+from clean_parallel import get_alpha_char_count, get_alpha_tables, get_alpha_word_count
+
+from pipeline.common.parallel import BlockPool
 
 
 def main():
     args = parse_user_args()
 
-    for i, line in enumerate(sys.stdin):
-        src = line.strip()
-        if not src:
-            continue
-
-        skip = clean_mono(src, args.lang)
-        if skip:
+    # The batches are cleaned in a pool of processes, and written in order.
+    with BlockPool(args.processes) as pool:
+        for kept_lines, debug_lines in pool.imap_lines(
+            partial(filter_lines, lang=args.lang), sys.stdin, max_lines=BATCH_SIZE
+        ):
             if args.debug:
-                sys.stderr.write("{}\t{}\n".format(skip, src))
-            continue
-        sys.stdout.write("{}\n".format(src))
+                sys.stderr.writelines(debug_lines)
+            sys.stdout.writelines(kept_lines)
+
+
+def filter_lines(batch, lang):
+    """
+    Clean a batch of lines. Returns the kept lines, and the skipped lines prefixed with the
+    reason they were skipped.
+    """
+    lines = [src for src in (line.strip() for line in batch) if src]
+    kept_lines = []
+    debug_lines = []
+    for src, skip in zip(lines, clean_batch(lines, lang)):
+        if skip:
+            debug_lines.append("{}\t{}\n".format(skip, src))
+        else:
+            kept_lines.append("{}\n".format(src))
+    return kept_lines, debug_lines
+
+
+def clean_batch(lines, lang):
+    """
+    Clean a batch of lines, which amortizes looking up the character tables of the language.
+    Returns the reason each line is skipped, or None for the lines that are kept.
+    """
+    tables = get_alpha_tables(lang)
+    return [get_skip_reason(src, lang, tables) for src in lines]
 
 
 def clean_mono(src, lang):
+    return get_skip_reason(src, lang, get_alpha_tables(lang))
+
+
+def get_skip_reason(src, lang, tables):
     # TODO: move mono cleaning to OpusCleaner
     #  when it support this https://github.com/hplt-project/OpusCleaner/issues/141
 
@@ -47,12 +78,12 @@ def clean_mono(src, lang):
     if src_len > MAX_LENGTH:
         return "TOO_LONG"
 
-    if lang in CHARS:
-        num_alpha = sum([1 if re.match(CHARS[lang], t, re.IGNORECASE) else 0 for t in src_toks])
-        if num_alpha / float(src_len) < RATIO_ALPHA_WORDS:
+    if tables:
+        alpha_chars, alpha_table = tables
+        if get_alpha_word_count(src_toks, alpha_chars) / float(src_len) < RATIO_ALPHA_WORDS:
             return "RATIO_ALPHA"
 
-        char_alpha = len(re.findall(CHARS[lang], src, re.IGNORECASE))
+        char_alpha = get_alpha_char_count(src, alpha_table)
         if char_alpha / float(len(src.replace(" ", ""))) < RATIO_ALPHA_CHARS:
             return "RATIO_CHARS"
 
@@ -63,6 +94,7 @@ def parse_user_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("-l", "--lang", default="en")
     parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--processes", default=1, type=int, help="-1 for one per logical CPU")
     return parser.parse_args()
 
 
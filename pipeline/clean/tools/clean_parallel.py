@@ -4,6 +4,9 @@
 import argparse
 import re
 import sys
+from functools import lru_cache, partial
+
+from pipeline.common.parallel import BlockPool
 
 # The variables below need to be adjusted for a language pair and dataset.
 # To add a new language, define the list of alpha characters in the dict below.
@@ -51,26 +54,101 @@ CHARS = {
 }
 
 
+# How many lines are read from stdin and cleaned at a time.
+BATCH_SIZE = 10_000
+
+
+@lru_cache(maxsize=None)
+def get_alpha_chars(lang):
+    """
+    The characters that match CHARS[lang] ignoring the case. Every code point is checked against
+    the regex once, so that looking up a character gives the same result as re.match and
+    re.findall with re.IGNORECASE, including the case folding of e.g. the Kelvin sign "K".
+    """
+    pattern = re.compile(CHARS[lang], re.IGNORECASE)
+    return frozenset(char for char in map(chr, range(sys.maxunicode + 1)) if pattern.match(char))
+
+
+@lru_cache(maxsize=None)
+def get_alpha_tables(lang):
+    """
+    The lookup tables of the alpha characters of a language, or None if the language isn't in
+    CHARS. The set checks the first character of a word. The str.translate table removes the
+    alpha characters to count them. It's a tuple indexed by the code point, which is faster
+    to look up than a dict. The code points past its end are left as they are.
+    """
+    if lang not in CHARS:
+        return None
+    alpha_chars = get_alpha_chars(lang)
+    alpha_table = list(range(max(map(ord, alpha_chars)) + 1))
+    for char in alpha_chars:
+        alpha_table[ord(char)] = None
+    return alpha_chars, tuple(alpha_table)
+
+
+def get_alpha_word_count(tokens, alpha_chars):
+    """How many tokens start with an alpha character, like re.match(CHARS[lang], token)."""
+    return sum(token[0] in alpha_chars for token in tokens)
+
+
+def get_alpha_char_count(text, alpha_table):
+    """How many alpha characters are in the text, like len(re.findall(CHARS[lang], text))."""
+    return len(text) - len(text.translate(alpha_table))
+
+
 def main():
     args = parse_user_args()
 
-    for i, line in enumerate(sys.stdin):
+    filter_batch = partial(filter_lines, src_lang=args.src_lang, trg_lang=args.trg_lang)
+    # The batches are cleaned in a pool of processes, and written in order.
+    with BlockPool(args.processes) as pool:
+        for kept_lines, debug_lines in pool.imap_lines(
+            filter_batch, sys.stdin, max_lines=BATCH_SIZE
+        ):
+            if args.debug:
+                sys.stderr.writelines(debug_lines)
+            sys.stdout.writelines(kept_lines)
+
+
+def filter_lines(batch, src_lang, trg_lang):
+    """
+    Clean a batch of "src\\ttrg" lines. Returns the kept lines, and the skipped lines prefixed
+    with the reason they were skipped.
+    """
+    pairs = []
+    lines = []
+    for line in batch:
         fields = line.strip().split("\t")
         if len(fields) < 2:
             continue
+        pairs.append((fields[-2].strip(), fields[-1].strip()))
+        lines.append(line)
 
-        src = fields[-2].strip()
-        trg = fields[-1].strip()
-
-        skip = clean_parallel(src, trg, args.src_lang, args.trg_lang)
+    kept_lines = []
+    debug_lines = []
+    for line, skip in zip(lines, clean_batch(pairs, src_lang, trg_lang)):
         if skip:
-            if args.debug:
-                sys.stderr.write("{}\t{}".format(skip, line))
-            continue
-        sys.stdout.write(line)
+            debug_lines.append("{}\t{}".format(skip, line))
+        else:
+            kept_lines.append(line)
+    return kept_lines, debug_lines
+
+
+def clean_batch(pairs, src_lang, trg_lang):
+    """
+    Clean a batch of (src, trg) pairs, which amortizes looking up the character tables of the
+    languages. Returns the reason each pair is skipped, or None for the pairs that are kept.
+    """
+    src_tables = get_alpha_tables(src_lang)
+    trg_tables = get_alpha_tables(trg_lang)
+    return [get_skip_reason(src, trg, src_tables, trg_tables) for src, trg in pairs]
 
 
 def clean_parallel(src, trg, src_lang, trg_lang):
+    return get_skip_reason(src, trg, get_alpha_tables(src_lang), get_alpha_tables(trg_lang))
+
+
+def get_skip_reason(src, trg, src_tables, trg_tables):
     if src.lower() == trg.lower():
         return "IDENTICAL"
 
@@ -99,25 +177,21 @@ def clean_parallel(src, trg, src_lang, trg_lang):
     if src_len > MAX_LENGTH or trg_len > MAX_LENGTH:
         return "TOO_LONG"
 
-    if src_lang in CHARS:
-        num_alpha = sum(
-            [1 if re.match(CHARS[src_lang], t, re.IGNORECASE) else 0 for t in src_toks]
-        )
-        if num_alpha / float(src_len) < RATIO_ALPHA_WORDS:
+    if src_tables:
+        alpha_chars, alpha_table = src_tables
+        if get_alpha_word_count(src_toks, alpha_chars) / float(src_len) < RATIO_ALPHA_WORDS:
             return "RATIO_ALPHA_SRC"
 
-        char_alpha = len(re.findall(CHARS[src_lang], src, re.IGNORECASE))
+        char_alpha = get_alpha_char_count(src, alpha_table)
         if char_alpha / float(len(src.replace(" ", ""))) < RATIO_ALPHA_CHARS:
             return "RATIO_CHARS_SRC"
 
-    if trg_lang in CHARS:
-        num_alpha = sum(
-            [1 if re.match(CHARS[trg_lang], t, re.IGNORECASE) else 0 for t in trg_toks]
-        )
-        if num_alpha / float(trg_len) < RATIO_ALPHA_WORDS:
+    if trg_tables:
+        alpha_chars, alpha_table = trg_tables
+        if get_alpha_word_count(trg_toks, alpha_chars) / float(trg_len) < RATIO_ALPHA_WORDS:
             return "RATIO_ALPHA_TRG"
 
-        char_alpha = len(re.findall(CHARS[trg_lang], trg, re.IGNORECASE))
+        char_alpha = get_alpha_char_count(trg, alpha_table)
         if char_alpha / float(len(trg.replace(" ", ""))) < RATIO_ALPHA_CHARS:
             return "RATIO_CHARS_TRG"
 
@@ -129,6 +203,7 @@ def parse_user_args():
     parser.add_argument("-l1", "--src-lang", default="es")
     parser.add_argument("-l2", "--trg-lang", default="en")
     parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--processes", default=1, type=int, help="-1 for one per logical CPU")
     return parser.parse_args()
 
 
@@ -4,43 +4,325 @@
 # Usage:
 #   ./langid-fasttext.py < sents.txt > code-tab-sents.txt
 #
+# Label both sides of a parallel corpus in one pass, in 8 processes:
+#   ./langid-fasttext.py --fields 0 1 --processes 8 < src-tab-trg.txt > codes-tab-src-tab-trg.txt
+#
 # Installation:
 #   pip3 install pybind11 fasttext --user
 #
-# Parallelize:
-#   cat sents.txt | parallel --pipe -k -j16 --block 20M ./langid-fasttext.py > code-tab-sents.txt
+# Cache the predictions between runs, and merge the caches of several tasks:
+#   ./langid-fasttext.py --cache langid.cache < sents.txt > code-tab-sents.txt
+#   ./langid-fasttext.py --cache merged.cache --merge_caches task1.cache task2.cache
+#
+# The model is loaded once, and the worker processes are forked after it's loaded, so they share
+# its memory rather than each loading a copy. The lines are predicted in batches, and the
+# repository needs to be on the PYTHONPATH for pipeline.common.parallel.
 
 import argparse
+import fcntl
+import hashlib
 import os
 import sys
+import tempfile
+import urllib.request
+from functools import lru_cache, partial
+
+import numpy as np
 
-import fasttext
+from pipeline.common.parallel import BlockPool
 
 BIN = "lid.176.bin"
 URL = "https://dl.fbaipublicfiles.com/fasttext/supervised-models/{}".format(BIN)
 
+# How many lines are predicted at a time.
+BATCH_SIZE = 10_000
+
+# The model and the cache that are shared with the forked worker processes.
+_model = None
+_cache = None
+
+# The cache file starts with this magic and the SHA-256 digest of the model that predicted the
+# labels, followed by the entries sorted by the fingerprint of their text.
+CACHE_MAGIC = b"LANGID01"
+CACHE_HEADER_SIZE = len(CACHE_MAGIC) + hashlib.sha256().digest_size
+CACHE_DTYPE = np.dtype([("fingerprint", "<u8"), ("label", "S2")])
+
+
+def get_model_path(model_dir=None):
+    """
+    Get the path to the model, and download it if it's not already there. The download is
+    done under a lock and renamed into place when it's complete, so processes that start at
+    the same time wait for one download, and never load a partial file.
+    """
+    model_dir = model_dir or os.path.dirname(os.path.realpath(__file__))
+    mpath = os.path.join(model_dir, BIN)
+    if os.path.exists(mpath):
+        return mpath
+
+    with open(mpath + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # Another process may have downloaded the model while waiting for the lock.
+            if not os.path.exists(mpath):
+                sys.stderr.write("Downloading model {} ...\n".format(URL))
+                temp_path = "{}.{}.tmp".format(mpath, os.getpid())
+                try:
+                    urllib.request.urlretrieve(URL, temp_path)
+                    os.replace(temp_path, mpath)
+                finally:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return mpath
+
+
+@lru_cache
+def get_model_checksum(mpath):
+    """The SHA-256 digest of the model, which the cached labels are only valid for."""
+    sha256 = hashlib.sha256()
+    with open(mpath, "rb") as model_file:
+        while chunk := model_file.read(1 << 20):
+            sha256.update(chunk)
+    return sha256.digest()
+
+
+def get_text_fingerprints(texts):
+    """
+    The 64 bit fingerprints of the texts, which are the same in every process and task. The
+    texts aren't normalized, as fastText can predict a different label for a normalized text.
+    """
+    return np.fromiter(
+        (
+            int.from_bytes(
+                hashlib.blake2b(
+                    text.encode("utf-8", errors="surrogateescape"), digest_size=8
+                ).digest(),
+                "little",
+            )
+            for text in texts
+        ),
+        dtype=np.uint64,
+        count=len(texts),
+    )
+
+
+class LangIdCache:
+    """
+    The labels that the model predicted for texts, keyed by the fingerprints of the texts. The
+    saved entries are memory-mapped, so forked workers share them, and only the pages that are
+    looked up are read. The new entries are kept in memory until the cache is saved.
+
+    Usage:
+        cache = LangIdCache.load(Path("langid.cache"), get_model_checksum(model_path))
+        langs, new_entries = cache.predict(model, texts)
+        cache.add(new_entries)
+        cache.save(Path("langid.cache"))
+    """
+
+    def __init__(self, model_checksum, entries=None):
+        self.model_checksum = model_checksum
+        self.entries = entries if entries is not None else np.empty(0, dtype=CACHE_DTYPE)
+        self.new_entries = []
+
+    @staticmethod
+    def load(path, model_checksum):
+        """
+        Load a saved cache. The cache is empty if the file doesn't exist, or if its labels were
+        predicted by a different model.
+        """
+        if not os.path.exists(path):
+            return LangIdCache(model_checksum)
+
+        with open(path, "rb") as cache_file:
+            header = cache_file.read(CACHE_HEADER_SIZE)
+        if len(header) != CACHE_HEADER_SIZE or not header.startswith(CACHE_MAGIC):
+            raise ValueError("The file is not a language identification cache: {}".format(path))
+        if header[len(CACHE_MAGIC) :] != model_checksum:
+            sys.stderr.write("Ignoring the cache of a different model: {}\n".format(path))
+            return LangIdCache(model_checksum)
+
+        if (os.path.getsize(path) - CACHE_HEADER_SIZE) % CACHE_DTYPE.itemsize:
+            raise ValueError("The language identification cache is truncated: {}".format(path))
+        if os.path.getsize(path) == CACHE_HEADER_SIZE:
+            # An empty array can't be memory-mapped.
+            return LangIdCache(model_checksum)
+        entries = np.memmap(path, dtype=CACHE_DTYPE, mode="r", offset=CACHE_HEADER_SIZE)
+        return LangIdCache(model_checksum, entries)
+
+    def __len__(self):
+        return len(self.entries) + sum(len(entries) for entries in self.new_entries)
+
+    def lookup(self, fingerprints):
+        """
+        Look up the labels of the fingerprints in the saved entries. Returns the labels, and a
+        mask of the fingerprints that were found.
+        """
+        fingerprint_column = self.entries["fingerprint"]
+        indexes = np.searchsorted(fingerprint_column, fingerprints)
+        found = indexes < len(self.entries)
+        found[found] = fingerprint_column[indexes[found]] == fingerprints[found]
+        labels = np.zeros(len(fingerprints), dtype=CACHE_DTYPE["label"])
+        labels[found] = self.entries["label"][indexes[found]]
+        return labels, found
+
+    def predict(self, model, texts):
+        """
+        Get the languages of the texts, and only predict the ones that aren't in the cache.
+        Returns the languages, and the entries of the predicted texts, which can be added to
+        the cache by the process that saves it.
+        """
+        fingerprints = get_text_fingerprints(texts)
+        labels, found = self.lookup(fingerprints)
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            predicted = predict_languages(model, [texts[index] for index in missing])
+            labels[missing] = [lang.encode("utf-8") for lang in predicted]
+
+        new_entries = np.empty(len(missing), dtype=CACHE_DTYPE)
+        new_entries["fingerprint"] = fingerprints[missing]
+        new_entries["label"] = labels[missing]
+        return [label.decode("utf-8") for label in labels], new_entries
+
+    def add(self, new_entries):
+        if len(new_entries):
+            self.new_entries.append(new_entries)
+
+    def merge(self, other):
+        if other.model_checksum != self.model_checksum:
+            raise ValueError("The caches were predicted by different models")
+        self.add(np.asarray(other.entries))
+        self.new_entries.extend(other.new_entries)
+
+    def save(self, path):
+        """
+        Write the saved and new entries sorted and de-duplicated by their fingerprints. The file
+        is renamed into place, so the workers that memory-map the old file can still read it.
+        """
+        entries = np.concatenate([np.asarray(self.entries), *self.new_entries])
+        _, unique_indexes = np.unique(entries["fingerprint"], return_index=True)
+        entries = entries[unique_indexes]
+
+        cache_dir = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as cache_file:
+            try:
+                cache_file.write(CACHE_MAGIC + self.model_checksum)
+                entries.tofile(cache_file)
+                cache_file.close()
+                os.replace(cache_file.name, path)
+            except BaseException:
+                os.remove(cache_file.name)
+                raise
+        self.entries = entries
+        self.new_entries = []
+
+
+def load_model(mpath=None):
+    import fasttext
+
+    return fasttext.load_model(mpath or get_model_path())
+
+
+def predict_languages(model, texts):
+    """
+    Predict the languages of a batch of texts in a single call. The labels are like
+    "__label__en", and only their last two characters are returned.
+    """
+    labels, _ = model.predict(texts)
+    return [label[0][-2:] for label in labels]
+
+
+def label_lines(lines, fields, model=None, cache=None):
+    """
+    Prefix each line with the languages of its fields, in the order of the fields. Labelling the
+    fields [0, 1] of "src\\ttrg" lines gives "src_lang\\ttrg_lang\\tsrc\\ttrg" lines.
+
+    Returns the labelled lines, and the new cache entries when there is a cache.
+    """
+    model = model if model is not None else _model
+    # An empty cache is falsy, so it's compared to None.
+    cache = cache if cache is not None else _cache
+    split_lines = [line.strip().split("\t") for line in lines]
+    field_langs = []
+    new_entries = []
+    for field in fields:
+        texts = [split_line[field] for split_line in split_lines]
+        if cache is None:
+            field_langs.append(predict_languages(model, texts))
+        else:
+            langs, field_entries = cache.predict(model, texts)
+            field_langs.append(langs)
+            new_entries.append(field_entries)
+    labelled_lines = [
+        "".join(lang + "\t" for lang in langs) + line
+        for line, langs in zip(lines, zip(*field_langs))
+    ]
+    return labelled_lines, new_entries
+
 
 def main():
+    global _model, _cache
     args = parse_user_args()
+    mpath = get_model_path()
 
-    mpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), BIN)
-    if not os.path.exists(mpath):
-        sys.stderr.write("Downloading model {} ...\n".format(URL))
-        import urllib.request
+    if args.merge_caches:
+        if not args.cache:
+            raise ValueError("--merge_caches needs the --cache to write")
+        model_checksum = get_model_checksum(mpath)
+        cache = LangIdCache.load(args.cache, model_checksum)
+        for path in args.merge_caches:
+            cache.merge(LangIdCache.load(path, model_checksum))
+        cache.save(args.cache)
+        sys.stderr.write("Merged {:,} cached labels into {}\n".format(len(cache), args.cache))
+        return
 
-        urllib.request.urlretrieve(URL, mpath)
+    # Load the model and the cache before the workers are forked, so they share them.
+    _model = load_model(mpath)
+    if args.cache:
+        _cache = LangIdCache.load(args.cache, get_model_checksum(mpath))
 
-    model = fasttext.load_model(mpath)
+    lookups = 0
+    misses = 0
+    fields = args.fields or [args.field]
+    with BlockPool(args.processes) as pool:
+        results = pool.imap_lines(
+            partial(label_lines, fields=fields), sys.stdin, max_lines=BATCH_SIZE
+        )
+        for labelled_lines, new_entries in results:
+            sys.stdout.writelines(labelled_lines)
+            if _cache is not None:
+                lookups += len(labelled_lines) * len(fields)
+                for entries in new_entries:
+                    misses += len(entries)
+                    _cache.add(entries)
 
-    for line in sys.stdin:
-        fields = line.strip().split("\t")
-        lid = model.predict(fields[args.field])
-        sys.stdout.write("{}\t{}".format(lid[0][0][-2:], line))
+    if _cache is not None:
+        _cache.save(args.cache)
+        sys.stderr.write(
+            "Cache hits: {:,} of {:,} ({:.1%})\n".format(
+                lookups - misses, lookups, (lookups - misses) / lookups if lookups else 0
+            )
+        )
 
 
 def parse_user_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("-f", "--field", default=0, type=int, help="text field, default: 0")
+    parser.add_argument(
+        "--fields",
+        nargs="+",
+        type=int,
+        help="label several text fields in one pass, e.g. --fields 0 1",
+    )
+    parser.add_argument(
+        "--processes", default=1, type=int, help="how many processes predict the languages"
+    )
+    parser.add_argument(
+        "--cache", help="a file of the predicted labels, which is read and updated"
+    )
+    parser.add_argument(
+        "--merge_caches", nargs="+", help="merge these caches into the --cache, and exit"
+    )
     return parser.parse_args()
 
 
@@ -0,0 +1,141 @@
+"""
+A Bloom filter of uint64 fingerprints, for approximately de-duplicating billions of lines in a
+fixed amount of memory.
+
+Unlike the UInt64HashTable, the memory doesn't grow with the number of lines. The trade-off is
+that a fingerprint that was never added can be reported as present, so a few unique lines are
+dropped as duplicates. The rate of these false positives grows as the filter fills up.
+"""
+
+import math
+from typing import Iterable, Optional
+
+import numpy as np
+import numpy.typing as npt
+
+
+class UInt64BloomFilter:
+    """
+    A Bloom filter that sets `hash_count` bits per fingerprint. The bit positions are derived
+    from the fingerprint with double hashing, so the fingerprint is only computed once.
+
+    The filter is sized for `capacity` fingerprints at the `false_positive_rate`, unless that
+    would take more than `max_bytes`, in which case the false positive rate will be higher.
+
+    Usage:
+        bloom_filter = UInt64BloomFilter(capacity=1_000_000, false_positive_rate=0.001)
+        assert bloom_filter.add(1234)
+        assert not bloom_filter.add(1234)
+        assert 1234 in bloom_filter
+    """
+
+    def __init__(
+        self, capacity: int, false_positive_rate: float = 0.001, max_bytes: Optional[int] = None
+    ) -> None:
+        if not 0 < false_positive_rate < 1:
+            raise ValueError(
+                f"The false positive rate must be between 0 and 1: {false_positive_rate}"
+            )
+        capacity = max(capacity, 1)
+        bit_count = math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        if max_bytes:
+            bit_count = min(bit_count, max_bytes * 8)
+        # Store the bits in whole bytes, with at least one uint64 worth of bits.
+        bit_count = max(bit_count + (-bit_count % 8), 64)
+
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.bit_count = bit_count
+        # The optimal number of hashes for the size of the filter.
+        self.hash_count = max(1, round(bit_count / capacity * math.log(2)))
+        self.bits = np.zeros(bit_count // 8, dtype=np.uint8)
+        # Indexing a memoryview returns a Python int, which is much faster than a NumPy scalar.
+        self.bytes = memoryview(self.bits)
+        self.count = 0
+        self.estimated_false_positives = 0.0
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+    @property
+    def estimated_false_positive_rate(self) -> float:
+        """The chance that a fingerprint that wasn't added is reported as present."""
+        return (1 - math.exp(-self.hash_count * self.count / self.bit_count)) ** self.hash_count
+
+    def __len__(self) -> int:
+        """How many fingerprints were added, not counting the false positives."""
+        return self.count
+
+    def __contains__(self, fingerprint: int) -> bool:
+        return all(
+            self.bytes[position >> 3] & (1 << (position & 7))
+            for position in self._get_positions(fingerprint)
+        )
+
+    def add(self, fingerprint: int) -> bool:
+        """
+        Add a fingerprint, and return True if it wasn't already in the filter. This can be
+        False for a new fingerprint that is a false positive.
+        """
+        is_new = False
+        for position in self._get_positions(fingerprint):
+            mask = 1 << (position & 7)
+            value = self.bytes[position >> 3]
+            if not value & mask:
+                self.bytes[position >> 3] = value | mask
+                is_new = True
+        if is_new:
+            self._count_added(1)
+        return is_new
+
+    def add_many(self, fingerprints: npt.NDArray[np.uint64]) -> npt.NDArray[np.bool_]:
+        """
+        Add a batch of fingerprints. Returns a mask of the fingerprints that weren't already in
+        the filter. Only the first of any fingerprints repeated in the batch is marked as added.
+        """
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        added = np.zeros(len(fingerprints), dtype=bool)
+        if not len(fingerprints):
+            return added
+
+        unique_fingerprints, first_indexes = np.unique(fingerprints, return_index=True)
+        byte_indexes, masks = self._get_many_positions(unique_fingerprints)
+        is_new = ((self.bits[byte_indexes] & masks) == 0).any(axis=1)
+        # The positions can be repeated in the batch, so the bits are set with an unbuffered or.
+        np.bitwise_or.at(self.bits, byte_indexes[is_new].ravel(), masks[is_new].ravel())
+
+        added[first_indexes[is_new]] = True
+        self._count_added(int(is_new.sum()))
+        return added
+
+    def contains_many(self, fingerprints: npt.NDArray[np.uint64]) -> npt.NDArray[np.bool_]:
+        """Returns a mask of the fingerprints that are in the filter."""
+        byte_indexes, masks = self._get_many_positions(np.asarray(fingerprints, dtype=np.uint64))
+        return ((self.bits[byte_indexes] & masks) != 0).all(axis=1)
+
+    def _count_added(self, added: int) -> None:
+        # For every fingerprint that is added, about rate / (1 - rate) were false positives.
+        rate = self.estimated_false_positive_rate
+        self.estimated_false_positives += added * rate / (1 - rate)
+        self.count += added
+
+    def _get_positions(self, fingerprint: int) -> Iterable[int]:
+        # Double hashing: the positions are h1 + i * h2. The step is the fingerprint with its
+        # halves swapped, and is odd so that it's never 0.
+        step = ((fingerprint >> 32) | (fingerprint << 32)) & 0xFFFF_FFFF_FFFF_FFFF | 1
+        for i in range(self.hash_count):
+            yield ((fingerprint + i * step) & 0xFFFF_FFFF_FFFF_FFFF) % self.bit_count
+
+    def _get_many_positions(
+        self, fingerprints: npt.NDArray[np.uint64]
+    ) -> tuple[npt.NDArray[np.uint64], npt.NDArray[np.uint8]]:
+        """Returns the byte indexes and bit masks of each fingerprint, with a row per fingerprint."""
+        steps = ((fingerprints >> np.uint64(32)) | (fingerprints << np.uint64(32))) | np.uint64(1)
+        hashes = np.arange(self.hash_count, dtype=np.uint64)
+        # The uint64 operations wrap around like the masked Python ints.
+        positions = (fingerprints[:, None] + hashes[None, :] * steps[:, None]) % np.uint64(
+            self.bit_count
+        )
+        masks = np.left_shift(1, (positions & np.uint64(7)).astype(np.uint8)).astype(np.uint8)
+        return positions >> np.uint64(3), masks
@@ -1,20 +1,36 @@
-from collections.abc import Iterable
+from array import array
+from collections import deque
+from collections.abc import Iterable, Sequence
+from concurrent.futures import Future, ProcessPoolExecutor
 import hashlib
+from itertools import accumulate, islice
 import json
+import math
 import os
 import tempfile
 from dataclasses import dataclass
 from io import TextIOWrapper
 from pathlib import Path
 from random import Random
-from typing import Callable, Iterator, Optional, Set, Union
+from typing import Callable, Generator, Iterator, Optional, Union
 from urllib.parse import urlparse
 import unicodedata
 
+from pipeline.common.logging import get_logger
+
+logger = get_logger(__file__)
+
 # We keep this relatively short because these datasets end up in task labels,
 # which end up in task cache routes, which need to be <= 256 characters.
 DATASET_NAME_MAX_LENGTH = 50
 
+# How much of each bucket is buffered before it's compressed in `shuffle_in_compressed_buckets`.
+SHUFFLE_FRAME_BYTES = 1024 * 1024
+
+# How many times the size of a bucket is held in memory while it's shuffled: the decompressed
+# bytes, the lines with their object overhead, and the joined shuffled bytes.
+SHUFFLE_MEMORY_FACTOR = 4
+
 
 class Dataset:
     """
@@ -90,13 +106,142 @@ class Dataset:
         return Dataset._escape(self.name)
 
 
+class LineReservoir:
+    """
+    Stores lines compactly as UTF-8 bytes in a growable arena, with an array of the offsets
+    where each line ends. A Python str costs ~50 bytes of overhead per line, while this costs
+    8 bytes for the offset. A row of several columns, e.g. a (src, trg) pair, is stored as one
+    entry per column, so that it doesn't need to be joined and split again.
+
+    The rows are referred to by their index in the order that they were appended. The bytes
+    of rows that are no longer needed stay in the arena until it's compacted.
+
+    Usage:
+        reservoir = LineReservoir(columns=2)
+        reservoir.append(("Hello\n", "Hola\n"))
+        assert reservoir[0] == ("Hello\n", "Hola\n")
+    """
+
+    # How many rows are copied at a time when compacting.
+    compact_chunk_rows = 65_536
+
+    def __init__(self, columns: int = 1) -> None:
+        self.columns = columns
+        self.arena = bytearray()
+        self.offsets = array("Q", [0])
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> Union[str, tuple[str, ...]]:
+        offset_index = index * self.columns
+        if self.columns == 1:
+            start, end = self.offsets[offset_index], self.offsets[offset_index + 1]
+            return self.arena[start:end].decode("utf-8")
+        return tuple(
+            self.arena[self.offsets[i] : self.offsets[i + 1]].decode("utf-8")
+            for i in range(offset_index, offset_index + self.columns)
+        )
+
+    def append(self, row: Union[str, tuple[str, ...]]) -> int:
+        """
+        Append a line, or a tuple of lines with one per column. Returns the byte size of the
+        row, where the columns are measured as if they were joined by a tab.
+        """
+        if self.columns == 1:
+            encoded = row.encode("utf-8")
+            self.append_encoded(encoded)
+            return len(encoded)
+
+        encoded = [line.encode("utf-8") for line in row]
+        self.append_encoded(encoded)
+        return sum(map(len, encoded)) + self.columns - 1
+
+    def append_encoded(self, encoded: Union[bytes, list[bytes]]) -> None:
+        """Append a row that was already encoded, as bytes or a list of bytes per column."""
+        if self.columns == 1:
+            self.arena += encoded
+            self.offsets.append(len(self.arena))
+        else:
+            for column in encoded:
+                self.arena += column
+                self.offsets.append(len(self.arena))
+        self.count += 1
+
+    def get_byte_size(self, index: int) -> int:
+        offset_index = index * self.columns
+        return self.offsets[offset_index + self.columns] - self.offsets[offset_index]
+
+    def compact(self, indexes: array) -> array:
+        """
+        Only keep the rows at the `indexes`, and return their new indexes, which are in the
+        same order.
+        """
+        columns = self.columns
+        old_arena = self.arena
+        old_offsets = self.offsets
+        arena = bytearray()
+        offsets = array("Q", [0])
+        # Copy the rows in chunks, which is faster than one at a time, without holding a
+        # copy of every row at once.
+        for start in range(0, len(indexes), self.compact_chunk_rows):
+            chunk = indexes[start : start + self.compact_chunk_rows]
+            arena += b"".join(
+                [
+                    old_arena[old_offsets[i * columns] : old_offsets[(i + 1) * columns]]
+                    for i in chunk
+                ]
+            )
+            entries = (
+                chunk if columns == 1 else [i * columns + c for i in chunk for c in range(columns)]
+            )
+            lengths = (old_offsets[entry + 1] - old_offsets[entry] for entry in entries)
+            offsets.extend(islice(accumulate(lengths, initial=offsets[-1]), 1, None))
+
+        self.arena = arena
+        self.offsets = offsets
+        self.count = len(indexes)
+        return array("Q", range(len(indexes)))
+
+
+class ShuffledLines(Sequence):
+    """
+    The lines from `shuffle_with_max_lines`, which are stored in a LineReservoir and read in
+    the shuffled order of their indexes.
+    """
+
+    def __init__(self, reservoir: LineReservoir, indexes: array) -> None:
+        self.reservoir = reservoir
+        self.indexes = indexes
+
+    def __len__(self) -> int:
+        return len(self.indexes)
+
+    def __getitem__(self, index: int) -> Union[str, tuple[str, ...]]:
+        return self.reservoir[self.indexes[index]]
+
+    def __iter__(self) -> Iterator[Union[str, tuple[str, ...]]]:
+        if self.reservoir.columns != 1:
+            for index in self.indexes:
+                yield self.reservoir[index]
+            return
+
+        # This is the hot path when writing out the lines, so avoid the attribute lookups.
+        arena = self.reservoir.arena
+        offsets = self.reservoir.offsets
+        for index in self.indexes:
+            yield arena[offsets[index] : offsets[index + 1]].decode("utf-8")
+
+
 def shuffle_with_max_lines(
-    line_stream: Iterator[str],
+    line_stream: Iterator[Union[str, tuple[str, ...]]],
     seed: str,
     max_lines: int,
     total_byte_size: Optional[int] = None,
     estimate_total_byte_size: Optional[Callable[[float], int]] = None,
-) -> list[str]:
+    columns: int = 1,
+) -> ShuffledLines:
     """
     Shuffle a line stream, but only retain up to a maximum number of lines in memory.
     Note that the final ordering is determined by the seed and the contents of the file. So
@@ -104,18 +249,24 @@ def shuffle_with_max_lines(
     it with the same seed and different content will create a different ordering.
 
     Only run for monolingual data or where the parallel sentences are in the same line and
-    separated by a delimiter.
+    separated by a delimiter, or are provided as tuples with `columns` set to the tuple size.
+    The tuples are sampled as if their columns were joined by a tab.
 
     The distribution should be even unless the initial content is not representative of the
     general size of the sentences, in this case the distribution will be slightly biased. See
     the test cases for more in-depth examples.
 
+    The lines are stored as bytes in a LineReservoir, and only their indexes are shuffled, so
+    there isn't a Python object retained for every line.
+
     These options are mutually exclusive, and one must be provided:
     - total_byte_size - The byte size of the lines.
     - estimate_total_byte_size - An estimate of the size of the corpus after max_lines have been
                                  filled. The average bytes per line is provided
     """
-    lines: list[str] = []
+    reservoir = LineReservoir(columns)
+    # The bytes in the reservoir of lines that were rolled out of the ring buffer.
+    unused_bytes = 0
 
     random = Random(seed)  # Make this deterministic based on dataset key.
 
@@ -128,46 +279,59 @@ def shuffle_with_max_lines(
 
     # Fill up the lines up until the max, and measure the total bytes.
     for line in line_stream:
-        # Encoding returns the underlying byte representation which is then measured.
-        total_bytes = total_bytes + len(line.encode("utf-8"))
-
-        lines.append(line)
+        # The reservoir measures the underlying byte representation.
+        total_bytes = total_bytes + reservoir.append(line)
 
-        if len(lines) == max_lines:
+        if reservoir.count == max_lines:
             break
 
     if total_byte_size is None:
         total_byte_size = estimate_total_byte_size(float(total_bytes) / float(max_lines))
 
-    line_index = len(lines)
-    random.shuffle(lines)
+    # The reservoir index of each line, in the order that they are shuffled into.
+    indexes = array("Q", range(reservoir.count))
+    line_index = len(indexes)
+    # Shuffling the indexes makes the same calls to the random generator as shuffling the lines.
+    random.shuffle(indexes)
 
     # Consume the rest of the line stream, but sample based on the probability that adding
     # something to the collection will be representative.
 
     for i, line in enumerate(line_stream):
         # Continuously adjust this estimation in case the first sampled data is not representative.
-        total_bytes = total_bytes + len(line.encode("utf-8"))
+        # Encoding returns the underlying byte representation which is then measured.
+        if columns == 1:
+            encoded = line.encode("utf-8")
+            line_bytes = len(encoded)
+        else:
+            encoded = [column.encode("utf-8") for column in line]
+            line_bytes = sum(map(len, encoded)) + columns - 1
+        total_bytes = total_bytes + line_bytes
         average_bytes_per_line = total_bytes / (max_lines + i + 1)
         estimated_lines = total_byte_size / average_bytes_per_line
         line_sampling_probability = max_lines / estimated_lines
 
         if random.random() < line_sampling_probability:
-            if len(lines) == max_lines:
-                # Treat the `lines` list as a ring buffer since we've reached the max lines. As new
+            reservoir.append_encoded(encoded)
+            if len(indexes) == max_lines:
+                # Treat the `indexes` as a ring buffer since we've reached the max lines. As new
                 # lines are randomly sampled, old randomly sampled lines roll out of the buffer.
-                lines[line_index % max_lines] = line
+                unused_bytes += reservoir.get_byte_size(indexes[line_index % max_lines])
+                indexes[line_index % max_lines] = reservoir.count - 1
                 line_index += 1
+
+                # Reclaim the space of the lines that rolled out of the buffer.
+                if unused_bytes > len(reservoir.arena) // 4:
+                    indexes = reservoir.compact(indexes)
+                    unused_bytes = 0
             else:
-                # Python throws "IndexError: list assignment index out of range" if you attempt
-                # to assign outside the existing range, so use an append here.
-                lines.append(line)
+                indexes.append(reservoir.count - 1)
 
     # Do a final shuffle to ensure that the newly sampled lines are shuffled with the original
     # set of shuffled lines.
-    random.shuffle(lines)
+    random.shuffle(indexes)
 
-    return lines
+    return ShuffledLines(reservoir, indexes)
 
 
 def shuffle_in_temp_files(
@@ -278,6 +442,394 @@ def shuffle_in_temp_files(
     print(f"Shuffled with {bucket_count} buckets.")
 
 
+def _shuffle_bucket(
+    bucket_path: str, shuffled_path: str, seed: str, compression_level: int
+) -> None:
+    """
+    Shuffle a bucket from `shuffle_lines_on_disk` in memory, and write it compressed to the
+    `shuffled_path`. The bucket is removed before the shuffled bucket is written, so only one
+    copy of it is on the disk.
+    """
+    # Only import zstandard when shuffling, as the rest of this module doesn't need it.
+    from zstandard import ZstdCompressor, ZstdDecompressor
+
+    with open(bucket_path, "rb") as file:
+        with ZstdDecompressor().stream_reader(file, read_across_frames=True) as reader:
+            lines = reader.readall().split(b"\n")
+    os.remove(bucket_path)
+
+    # Every line was written with a newline, which leaves an empty string at the end.
+    lines.pop()
+    Random(seed).shuffle(lines)
+    lines.append(b"")
+    with open(shuffled_path, "wb") as file:
+        file.write(ZstdCompressor(level=compression_level).compress(b"\n".join(lines)))
+
+
+def shuffle_lines_on_disk(
+    line_stream: Iterable[str],
+    seed: str,
+    bucket_count: int,
+    bucket_dir: Optional[str] = None,
+    processes: int = -1,
+    compression_level: int = 3,
+    max_lines: Optional[int] = None,
+    frame_bytes: Optional[int] = None,
+    max_memory_bytes: Optional[int] = None,
+) -> Generator[str, None, None]:
+    """
+    Shuffle large datasets by partitioning them into zstd compressed buckets on the file system,
+    and shuffling the buckets in parallel. This is a faster variant of `shuffle_in_temp_files`
+    that needs about a third of the disk space. A line without a newline at the end, e.g. the
+    last line of a file from `read_lines`, gets one, as it can be shuffled anywhere.
+
+    Every line is sent to a random bucket, so that a line can end up anywhere in the output.
+    The buckets are chosen by a random number generator seeded with the `seed`, which only
+    depends on the position of the line. Two datasets of the same length, e.g. the parallel
+    sentences of `dataset.en.zst` and `dataset.ca.zst`, are partitioned and shuffled the same.
+
+    tmpdir
+    ├── bucket.0.zst
+    ├── bucket.1.zst
+    ├── ...
+    └── bucket.99.zst
+
+    Each bucket is appended to in frames of `frame_bytes`, which defaults to
+    `SHUFFLE_FRAME_BYTES`, so only that much of each bucket is buffered in memory while
+    partitioning. The lines are only encoded once.
+
+    Then the buckets are shuffled in memory by worker processes, with a seed per bucket, and
+    yielded in the order of the buckets. Each worker holds about `SHUFFLE_MEMORY_FACTOR` times
+    the uncompressed size of a bucket in memory, so choose the `bucket_count` so that a bucket
+    is a few hundred megabytes, e.g. 256 buckets for 100GB of text. At most `processes * 2`
+    shuffled buckets are waiting to be yielded. The processes are reduced so that the buckets
+    that are shuffled at the same time fit in the `max_memory_bytes`.
+
+    The buckets are in a random order, so the first `max_lines` of the output are a uniform
+    sample of the lines. Only the buckets that are needed for them are shuffled.
+
+    Use `processes=-1` for one process per logical CPU. With a single process the buckets are
+    shuffled in this process.
+    """
+    # Only import zstandard when shuffling, as the rest of this module doesn't need it.
+    from zstandard import ZstdCompressor, ZstdDecompressor
+
+    processes = os.cpu_count() or 1 if processes < 0 else processes
+    frame_bytes = frame_bytes or SHUFFLE_FRAME_BYTES
+    random = Random(seed)
+    buckets = range(bucket_count)
+    compressor = ZstdCompressor(level=compression_level)
+
+    with tempfile.TemporaryDirectory(dir=bucket_dir, prefix="shuffle.") as temp_dir:
+        bucket_paths = [os.path.join(temp_dir, f"bucket.{index}.zst") for index in buckets]
+        shuffled_paths = [os.path.join(temp_dir, f"shuffled.{index}.zst") for index in buckets]
+        for bucket_path in bucket_paths:
+            open(bucket_path, "wb").close()
+
+        # Partition the lines into the buckets.
+        frames = [bytearray() for _ in buckets]
+        bucket_bytes = [0] * bucket_count
+        bucket_lines = [0] * bucket_count
+
+        def write_frame(index: int) -> None:
+            # The frames are concatenated, which is still a valid zstd file. The bucket files
+            # are re-opened, as there can be more buckets than open files.
+            frame = frames[index]
+            with open(bucket_paths[index], "ab") as file:
+                file.write(compressor.compress(frame))
+            bucket_bytes[index] += len(frame)
+            bucket_lines[index] += frame.count(b"\n")
+            frame.clear()
+
+        lines = iter(line_stream)
+        while batch := list(islice(lines, 10_000)):
+            # Without weights `choices` draws one random number per line, so the buckets don't
+            # depend on how the lines are batched.
+            for line, index in zip(batch, random.choices(buckets, k=len(batch))):
+                frame = frames[index]
+                frame += line.encode("utf-8")
+                if not line.endswith("\n"):
+                    frame += b"\n"
+                if len(frame) >= frame_bytes:
+                    write_frame(index)
+
+        for index in buckets:
+            if frames[index]:
+                write_frame(index)
+
+        # Only the first buckets are needed for the first `max_lines`.
+        needed_buckets = bucket_count
+        if max_lines is not None:
+            needed_buckets = 0
+            for line_count in accumulate(bucket_lines):
+                if line_count - bucket_lines[needed_buckets] >= max_lines:
+                    break
+                needed_buckets += 1
+
+        if max_memory_bytes and needed_buckets:
+            largest_bucket = max(bucket_bytes[:needed_buckets]) * SHUFFLE_MEMORY_FACTOR
+            processes = max(1, min(processes, max_memory_bytes // max(largest_bucket, 1)))
+            if largest_bucket > max_memory_bytes:
+                logger.warning(
+                    f"A bucket needs {largest_bucket:,} bytes to shuffle, which is over the "
+                    f"budget of {max_memory_bytes:,} bytes. Use more buckets."
+                )
+
+        shuffle_args = [
+            (bucket_paths[index], shuffled_paths[index], f"{seed}.{index}", compression_level)
+            for index in range(needed_buckets)
+        ]
+        executor = ProcessPoolExecutor(processes) if processes > 1 else None
+
+        def shuffle_buckets() -> Generator[int, None, None]:
+            """Shuffle the buckets, and yield their indexes in order as they are shuffled."""
+            if not executor:
+                for index, args in enumerate(shuffle_args):
+                    _shuffle_bucket(*args)
+                    yield index
+                return
+
+            pending: deque[tuple[int, Future]] = deque()
+            for index, args in enumerate(shuffle_args):
+                pending.append((index, executor.submit(_shuffle_bucket, *args)))
+                if len(pending) >= processes * 2:
+                    done_index, future = pending.popleft()
+                    future.result()
+                    yield done_index
+            while pending:
+                done_index, future = pending.popleft()
+                future.result()
+                yield done_index
+
+        try:
+            remaining = math.inf if max_lines is None else max_lines
+            for index in shuffle_buckets():
+                with open(shuffled_paths[index], "rb") as file:
+                    with ZstdDecompressor().stream_reader(file, read_across_frames=True) as reader:
+                        # Only split on the newlines, as the lines can contain other line breaks.
+                        for line in islice(
+                            TextIOWrapper(reader, encoding="utf-8", newline="\n"),
+                            min(remaining, bucket_lines[index]),
+                        ):
+                            yield line
+                remaining -= bucket_lines[index]
+                os.remove(shuffled_paths[index])
+        finally:
+            # Wait for the running shuffles before the buckets are removed.
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+    logger.info(
+        f"Shuffled {sum(bucket_lines):,} lines with {needed_buckets} of {bucket_count} buckets."
+    )
+
+
+def shuffle_in_compressed_buckets(
+    line_stream: Iterable[str],
+    output: TextIOWrapper,
+    seed: str,
+    bucket_count: int,
+    bucket_dir: Optional[str] = None,
+    processes: int = -1,
+    compression_level: int = 3,
+) -> int:
+    """
+    Shuffle a line stream with `shuffle_lines_on_disk`, and write it to the `output`. Like
+    `shuffle_in_temp_files`, the lines don't have newlines. Returns how many lines were shuffled.
+    """
+    line_count = 0
+    for line in shuffle_lines_on_disk(
+        (line + "\n" for line in line_stream),
+        seed,
+        bucket_count,
+        bucket_dir=bucket_dir,
+        processes=processes,
+        compression_level=compression_level,
+    ):
+        output.write(line)
+        line_count += 1
+    return line_count
+
+
+class ReservoirSampler:
+    """
+    Keeps a uniform random sample of up to `sample_size` items from a stream of unknown length,
+    in a single pass. Unlike `shuffle_with_max_lines` it doesn't need to know the size of the
+    stream, and it's cheap enough to run alongside writing the stream out.
+
+    This uses Algorithm L, which computes how many items to skip before the next one replaces
+    a random item of the sample. Only the replaced items draw random numbers, so the cost per
+    skipped item is a comparison.
+    https://en.wikipedia.org/wiki/Reservoir_sampling#Optimal:_Algorithm_L
+
+    Usage:
+        sampler = ReservoirSampler(sample_size=10_000, seed=9834523434)
+        for line in lines:
+            sampler.add(line)
+        sample = sampler.get_sample()
+    """
+
+    def __init__(self, sample_size: int, seed: Union[int, str]) -> None:
+        self.sample_size = sample_size
+        self.random = Random(seed)
+        self.sample: list = []
+        # How many items have been added.
+        self.count = 0
+        self.weight = self._next_weight(1.0)
+        # The index of the next item that goes into the sample.
+        self.next_index = sample_size + self._get_skip()
+
+    def _uniform(self) -> float:
+        """A random number in the open interval (0, 1), so that its logarithm is defined."""
+        while True:
+            value = self.random.random()
+            if value:
+                return value
+
+    def _next_weight(self, weight: float) -> float:
+        if not self.sample_size:
+            return 1.0
+        return weight * math.exp(math.log(self._uniform()) / self.sample_size)
+
+    def _get_skip(self) -> int:
+        if self.weight >= 1.0:
+            # The sample is empty, so no items are kept.
+            return math.inf
+        return math.floor(math.log(self._uniform()) / math.log(1.0 - self.weight))
+
+    def _replace(self, item) -> None:
+        self.sample[self.random.randrange(self.sample_size)] = item
+        self.weight = self._next_weight(self.weight)
+        self.next_index += self._get_skip() + 1
+
+    def add(self, item) -> None:
+        index = self.count
+        self.count += 1
+        if index < self.sample_size:
+            self.sample.append(item)
+        elif index == self.next_index:
+            self._replace(item)
+
+    def add_many(self, items: Sequence) -> None:
+        """Add a batch of items. The sample is the same as adding them one at a time."""
+        start = self.count
+        self.count += len(items)
+        if start < self.sample_size:
+            self.sample.extend(items[: self.sample_size - start])
+        while self.next_index < self.count:
+            self._replace(items[self.next_index - start])
+
+    def get_sample(self) -> list:
+        """Returns the sample in a random order."""
+        sample = list(self.sample)
+        self.random.shuffle(sample)
+        return sample
+
+
+class TeeSampleWriter:
+    """
+    Writes rows of lines to parallel outputs, e.g. the src and trg files of a corpus, while
+    keeping a seeded reservoir sample of the rows. The sample is written to `sample_path` when
+    the writer is closed, so the outputs don't need to be read back to sample them.
+
+    The sample has a line per row for a single output. Otherwise the lines of a row are followed
+    by a blank line, to make for easy scanning of datasets:
+
+        Sentence 1 in source language
+        Sentence 1 in target language
+
+        Sentence 2 in source language
+        Sentence 2 in target language
+
+    Usage:
+        with write_lines(src_path) as src_outfile, write_lines(trg_path) as trg_outfile:
+            with TeeSampleWriter(
+                [src_outfile, trg_outfile], Path("corpus.sample.txt"), sample_size=10_000
+            ) as writer:
+                for src_line, trg_line in pairs:
+                    writer.write(src_line, trg_line)
+    """
+
+    def __init__(
+        self,
+        outfiles: list[TextIOWrapper],
+        sample_path: Path,
+        sample_size: int,
+        seed: Union[int, str] = 9834523434,
+    ) -> None:
+        self.outfiles = outfiles
+        self.sample_path = sample_path
+        self.sampler = ReservoirSampler(sample_size, seed)
+        self.previous_sample: list[tuple[str, ...]] = []
+        self.previous_row_count = 0
+
+    def __enter__(self) -> "TeeSampleWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # Don't write a sample of an incomplete output.
+        if not exc_type:
+            self.close()
+
+    def write(self, *lines: str) -> None:
+        """Write a line to each of the outputs. The lines include their newlines."""
+        for outfile, line in zip(self.outfiles, lines):
+            outfile.write(line)
+        self.sampler.add(lines)
+
+    def write_rows(self, rows: Sequence[tuple[str, ...]]) -> None:
+        """Write a batch of rows, which is faster than writing them one at a time."""
+        for outfile, lines in zip(self.outfiles, zip(*rows)):
+            outfile.writelines(lines)
+        self.sampler.add_many(rows)
+
+    def add_previous_sample(self, sample_path: Path, row_count: int) -> None:
+        """
+        The rows are being appended to outputs that already have `row_count` rows, which were
+        sampled to `sample_path` by a TeeSampleWriter. The samples are combined when the writer
+        is closed, so that the sample is still uniform over all of the rows.
+        """
+        columns = len(self.outfiles)
+        with open(sample_path, encoding="utf-8-sig") as infile:
+            lines = infile.readlines()
+        # Skip the blank line after each row of several columns.
+        step = columns + 1 if columns > 1 else 1
+        self.previous_sample = [
+            tuple(lines[start : start + columns]) for start in range(0, len(lines), step)
+        ]
+        self.previous_row_count = row_count
+
+    def get_sample(self) -> list[tuple[str, ...]]:
+        sample = self.sampler.get_sample()
+        if not self.previous_row_count:
+            return sample
+
+        # Draw the rows from all of the rows, and take as many of them from the previous sample
+        # as were drawn from the previous rows.
+        random = self.sampler.random
+        row_count = self.previous_row_count + self.sampler.count
+        sample_size = min(self.sampler.sample_size, row_count)
+        previous_size = sum(
+            index < self.previous_row_count
+            for index in random.sample(range(row_count), sample_size)
+        )
+        previous_size = min(previous_size, len(self.previous_sample))
+        sample = (
+            random.sample(self.previous_sample, previous_size)
+            + sample[: sample_size - previous_size]
+        )
+        random.shuffle(sample)
+        return sample
+
+    def close(self) -> None:
+        separator = "\n" if len(self.outfiles) > 1 else ""
+        # The browser won't know the encoding when viewing this sample without including a
+        # "byte order mark", which python can do via this encoding.
+        with open(self.sample_path, "w", encoding="utf-8-sig") as outfile:
+            for row in self.get_sample():
+                outfile.write("".join(row) + separator)
+
+
 class Statistics:
     """
     Base class for handling statistical data and JSON serialization in the pipeline. All
@@ -396,11 +948,24 @@ class CountingStep(Statistics):
         self.value = value
 
 
-class WeakStringSet(Set):
+def get_line_fingerprint(line: str) -> int:
+    """
+    Return a 64 bit fingerprint of a line, for de-duplication. The line has its whitespace
+    stripped and text representation normalized to ensure a consistent representation. Unlike
+    the builtin `hash`, the fingerprint is the same in every process, so it can be saved and
+    shared between tasks.
+    """
+    cleaned_line = unicodedata.normalize("NFC", line.strip())
+    digest = hashlib.blake2b(cleaned_line.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class WeakStringSet:
     """
     A Set that weakly holds on to strings by storing a hashed `int`. Using this class
     makes it easy to see if a string is duplicated across large datasets without holding
-    the entire set of strings in memory.
+    the entire set of strings in memory. The hashes are stored in a UInt64HashTable, which
+    costs 11-23 bytes per string rather than the 60-70 bytes of a set[int].
 
     Usage:
         unique_strings = WeakStringSet()
@@ -413,34 +978,148 @@ class WeakStringSet(Set):
     """
 
     def __init__(self, iter: Optional[Iterable[str]] = None) -> None:
+        # NumPy is not available everywhere this module is used, e.g. in the taskgraph.
+        from pipeline.common.hash_table import UInt64HashTable
+
+        self.hashes = UInt64HashTable()
         if iter:
-            super().__init__((WeakStringSet._hash_string(string) for string in iter))
-        else:
-            super().__init__()
+            self.update(iter)
 
     def __contains__(self, string: str) -> bool:
-        return super().__contains__(WeakStringSet._hash_string(string))
+        return WeakStringSet._hash_string(string) in self.hashes
 
-    def add(self, string: str) -> None:
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def add(self, string: str) -> bool:
         """
         Add a string to the weak set. The strings are stored uniquely based on their
-        contents with the whitespace surrounding them stripped.
+        contents with the whitespace surrounding them stripped. Returns True if the string
+        wasn't already in the set, which saves hashing the string twice to check it first.
         """
-        super().add(WeakStringSet._hash_string(string))
+        return self.hashes.add(WeakStringSet._hash_string(string))
 
     def update(self, iter: Iterable[str]):
-        super().update((WeakStringSet._hash_string(string) for string in iter))
+        for string in iter:
+            self.add(string)
 
     def remove(self, string: str):
-        super().remove(WeakStringSet._hash_string(string))
+        if not self.hashes.discard(WeakStringSet._hash_string(string)):
+            raise KeyError(string)
 
     def discard(self, string: str):
-        super().discard(WeakStringSet._hash_string(string))
+        self.hashes.discard(WeakStringSet._hash_string(string))
+
+    def add_many(self, strings: Iterable[str]):
+        """
+        Add a batch of strings with vectorized operations. Returns a boolean NumPy array of
+        the strings that weren't already in the set.
+        """
+        return self.hashes.add_many(WeakStringSet._hash_strings(strings))
+
+    def contains_many(self, strings: Iterable[str]):
+        """Returns a boolean NumPy array of the strings that are in the set."""
+        return self.hashes.contains_many(WeakStringSet._hash_strings(strings))
+
+    def add_fingerprints(self, fingerprints):
+        """
+        Add a NumPy array of fingerprints from `get_line_fingerprint`, for when they were
+        already computed. Returns a boolean NumPy array of the ones that weren't in the set.
+        """
+        return self.hashes.add_many(fingerprints)
 
     def _hash_string(string: str) -> int:
+        return get_line_fingerprint(string)
+
+    def _hash_strings(strings: Iterable[str]) -> list[int]:
+        return [get_line_fingerprint(string) for string in strings]
+
+
+class ApproximateStringSet:
+    """
+    A set of strings like WeakStringSet, but the hashes are stored in a Bloom filter, which
+    uses a fixed amount of memory however many strings are added. The trade-off is that a string
+    that was never added can be reported as present, so a few unique lines will be dropped as
+    duplicates. Strings can only be added and looked up, not removed.
+
+    The filter is sized for `capacity` strings at the `false_positive_rate`, and is capped at
+    `max_bytes`. If more strings are added, or the cap is hit, the false positive rate is higher.
+
+    Usage:
+        unique_strings = ApproximateStringSet(capacity=1_000_000, false_positive_rate=0.001)
+        unique_strings.add("string a")
+
+        assert "string a" in unique_strings
+        print(unique_strings.estimated_false_positive_rate)
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        false_positive_rate: float = 0.001,
+        max_bytes: Optional[int] = None,
+        iter: Optional[Iterable[str]] = None,
+    ) -> None:
+        # NumPy is not available everywhere this module is used, e.g. in the taskgraph.
+        from pipeline.common.bloom_filter import UInt64BloomFilter
+
+        self.hashes = UInt64BloomFilter(capacity, false_positive_rate, max_bytes)
+        if iter:
+            self.update(iter)
+
+    @property
+    def estimated_false_positive_rate(self) -> float:
+        return self.hashes.estimated_false_positive_rate
+
+    def __contains__(self, string: str) -> bool:
+        return get_line_fingerprint(string) in self.hashes
+
+    def add(self, string: str) -> bool:
         """
-        Return a hash of a line. The line has its whitespace stripped and text representation
-        normalized to ensure a consistent representation.
+        Add a string, with the whitespace surrounding it stripped. Returns True if the string
+        wasn't already in the set, or False if it was, or was a false positive.
         """
-        cleaned_line = unicodedata.normalize("NFC", string.strip())
-        return hash(cleaned_line)
+        return self.hashes.add(get_line_fingerprint(string))
+
+    def update(self, iter: Iterable[str]):
+        for string in iter:
+            self.add(string)
+
+    def add_fingerprints(self, fingerprints):
+        """
+        Add a NumPy array of fingerprints from `get_line_fingerprint`, for when they were
+        already computed. Returns a boolean NumPy array of the ones that weren't in the set.
+        """
+        return self.hashes.add_many(fingerprints)
+
+
+class ApproximateDeduplicationStep(Statistics):
+    """
+    Reports how the lines were de-duplicated with an ApproximateStringSet. Which of the dropped
+    lines were false positives isn't known, so the dropped lines are split into an estimate of
+    the real duplicates and of the unique lines that were dropped as false positives.
+    """
+
+    def __init__(self, string_set: ApproximateStringSet, dataset_path: Optional[Path] = None):
+        super().__init__(dataset_path)
+        self._string_set = string_set
+        self.description = (
+            "The lines were de-duplicated with a Bloom filter, which uses a fixed amount of "
+            "memory, but drops some unique lines as false positives."
+        )
+        self.memory_bytes = string_set.hashes.nbytes
+        self.target_false_positive_rate = string_set.hashes.false_positive_rate
+        self.estimated_false_positive_rate = 0.0
+        self.dropped_as_duplicates = 0
+        self.estimated_true_duplicates = 0
+        self.estimated_false_positive_drops = 0
+
+    def update_derived_data(self):
+        super().update_derived_data()
+        self.estimated_false_positive_rate = self._string_set.estimated_false_positive_rate
+        self.estimated_false_positive_drops = min(
+            round(self._string_set.hashes.estimated_false_positives), self.dropped_as_duplicates
+        )
+        self.estimated_true_duplicates = (
+            self.dropped_as_duplicates - self.estimated_false_positive_drops
+        )
@@ -1,12 +1,22 @@
+import fcntl
 import gzip
+import hashlib
 import io
+import itertools
 import json
 import os
+import shutil
+import tempfile
+import threading
 import time
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import ExitStack, contextmanager
+from dataclasses import asdict, dataclass
 from io import BufferedReader
 from pathlib import Path
-from typing import Callable, Generator, Literal, Optional, Union
+from typing import BinaryIO, Callable, Generator, Literal, Optional, Union
 from zipfile import ZipFile
 
 import requests
@@ -17,18 +27,51 @@ from pipeline.common.logging import get_logger
 
 logger = get_logger(__file__)
 
+# The default compression levels, which match the defaults of the zstd and gzip libraries.
+ZSTD_DEFAULT_LEVEL = 3
+GZIP_DEFAULT_LEVEL = 9
 
-def stream_download_to_file(url: str, destination: Union[str, Path]) -> None:
+# The size of the chunks when streaming a file through a compressor or decompressor.
+COPY_CHUNK_BYTES = 1024 * 1024
+
+# The buffer size for reading and writing lines as bytes.
+BINARY_BUFFER_BYTES = 1024 * 1024
+
+# How many of the following remote files to download in the background when reading lines
+# from a list of files.
+PREFETCH_FILES = 1
+
+# How much of each prefetched file is downloaded in the background into a temporary file. The
+# rest of the file is streamed from the open download once the reader gets to it.
+PREFETCH_BYTES = 64 * 1024 * 1024
+
+# How long closing a prefetched download waits for its thread, which can be in a read or a
+# retry. The thread stops and cleans up after its current read.
+PREFETCH_CLOSE_TIMEOUT_SEC = 1.0
+
+
+def stream_download_to_file(url: str, destination: Union[str, Path], connections: int = 1) -> None:
     """
     Streams a download to a file, and retries several times if there are any failures. The
     destination file must not already exist.
+
+    When more than one connection is requested, and the server supports "Range" requests,
+    the file is downloaded in parallel byte ranges. See DownloadChunkStreamer.
     """
     if os.path.exists(destination):
         raise Exception(f"That file already exists: {destination}")
 
     logger.info(f"Destination: {destination}")
 
-    with open(destination, "wb") as file, DownloadChunkStreamer(url) as chunk_streamer:
+    download_cache = get_download_cache()
+    if download_cache:
+        with open(destination, "wb") as file, download_cache.open(url, connections) as source:
+            shutil.copyfileobj(source, file, DownloadCache.copy_bytes)
+        return
+
+    with open(destination, "wb") as file, DownloadChunkStreamer(
+        url, connections=connections
+    ) as chunk_streamer:
         for chunk in chunk_streamer.download_chunks():
             file.write(chunk)
 
@@ -60,13 +103,45 @@ def get_mocked_downloads_file_path(url: str) -> Optional[str]:
     return source_file
 
 
+# The HTTP statuses that are usually temporary, so the request is retried.
+TRANSIENT_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+# How long to wait for a HEAD request, and how many times to try it.
+HEAD_TIMEOUT_SEC = 10.0
+HEAD_TOTAL_RETRIES = 3
+HEAD_WAIT_BEFORE_RETRY_SEC = 5.0
+
+
+class RangeNotHonoredError(Exception):
+    """The server responded to a range request with something other than the range."""
+
+
+def head_request(url: str, timeout_sec: float = HEAD_TIMEOUT_SEC) -> requests.Response:
+    """
+    Make a HEAD request, and retry it on timeouts, connection errors, and transient statuses.
+    The last response is returned even if it's not ok, so the callers can check the status.
+    """
+    for _ in range(HEAD_TOTAL_RETRIES - 1):
+        try:
+            response = requests.head(url, allow_redirects=True, timeout=timeout_sec)
+            if response.status_code not in TRANSIENT_STATUS_CODES:
+                return response
+            logger.error(f"The HEAD request returned the status {response.status_code}: {url}")
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as error:
+            logger.error(f"The HEAD request failed: {error}")
+
+        logger.info(f"Retrying in {HEAD_WAIT_BEFORE_RETRY_SEC} sec")
+        time.sleep(HEAD_WAIT_BEFORE_RETRY_SEC)
+
+    return requests.head(url, allow_redirects=True, timeout=timeout_sec)
+
+
 def location_exists(location: str):
     """
     Checks if a location (url or file path) exists.
     """
     if location.startswith("http://") or location.startswith("https://"):
-        response = requests.head(location, allow_redirects=True)
-        return response.ok
+        return head_request(location).ok
     return os.path.exists(location)
 
 
@@ -86,35 +161,65 @@ def get_download_size(url: str) -> int:
     if mocked_file_path:
         return os.path.getsize(mocked_file_path)
 
-    response = requests.head(url, allow_redirects=True)
+    download_cache = get_download_cache()
+    if download_cache:
+        return download_cache.get_file_info(url).size
+
+    response = head_request(url)
     size = response.headers.get("content-length", 0)
     return int(size)
 
 
+def get_content_type(url: str) -> Optional[str]:
+    """Get the Content-Type of a remote file."""
+    download_cache = get_download_cache()
+    if download_cache:
+        return download_cache.get_file_info(url).content_type
+
+    response = head_request(url)
+    return response.headers.get("Content-Type")
+
+
 class RemoteDecodingLineStreamer:
     """
-    Base class to stream lines directly from a remote file.
+    Base class to stream lines directly from a remote file. When `binary` is set, the lines
+    are streamed as bytes without being decoded.
     """
 
-    def __init__(self, url: str) -> None:
+    def __init__(
+        self, url: str, binary: bool = False, byte_stream: Optional[BinaryIO] = None
+    ) -> None:
         self.url = url
+        self.binary = binary
 
         self.decoding_stream = None
-        self.byte_chunk_stream = None
+        # The byte stream can be provided when the file was already opened, e.g. when it's
+        # downloaded in the background by _PrefetchedDownload.
+        self.byte_chunk_stream = byte_stream
         self.line_stream = None
+        self.stack = ExitStack()
 
     def __enter__(self):
-        mocked_request = attempt_mocked_request(self.url)
-        if mocked_request:
-            # We are in a test.
-            logger.info(f"Using a mocked download: {self.url}")
-            self.byte_chunk_stream = mocked_request
-            self.decoding_stream = self.decode(self.byte_chunk_stream)
+        download_cache = get_download_cache()
+        if self.byte_chunk_stream:
+            pass
+        elif download_cache:
+            # The download cache handles the mocked downloads as well.
+            self.byte_chunk_stream = self.stack.enter_context(download_cache.open(self.url))
         else:
-            self.byte_chunk_stream = DownloadChunkStreamer(self.url).__enter__()
-            self.decoding_stream = self.decode(self.byte_chunk_stream)
+            mocked_request = attempt_mocked_request(self.url)
+            if mocked_request:
+                # We are in a test.
+                logger.info(f"Using a mocked download: {self.url}")
+                self.byte_chunk_stream = mocked_request
+            else:
+                self.byte_chunk_stream = DownloadChunkStreamer(self.url).__enter__()
 
-        self.line_stream = io.TextIOWrapper(self.decoding_stream, encoding="utf-8")
+        self.decoding_stream = self.decode(self.byte_chunk_stream)
+        if self.binary:
+            self.line_stream = io.BufferedReader(self.decoding_stream, BINARY_BUFFER_BYTES)
+        else:
+            self.line_stream = io.TextIOWrapper(self.decoding_stream, encoding="utf-8")
 
         return self.line_stream
 
@@ -122,6 +227,7 @@ class RemoteDecodingLineStreamer:
         self.line_stream.close()
         self.decoding_stream.close()
         self.byte_chunk_stream.close()
+        self.stack.close()
 
     def decode(self, byte_stream: BufferedReader):
         # This byte stream requires no decoding, so just pass it on through.
@@ -173,9 +279,27 @@ class DownloadChunkStreamer(io.IOBase):
 
         with DownloadChunkStreamer(url) as f:
              gzip.GzipFile(fileobj=f)
+
+    When more than one connection is requested, and the server supports "Range" requests, the
+    file is split into byte ranges that are downloaded in parallel. The ranges are still
+    yielded in order, so the chunks are the same as with a single connection. At most
+    `ranges_in_flight` ranges are held in memory at a time.
+
+        with DownloadChunkStreamer(url, connections=8) as chunk_streamer:
+            for chunk in chunk_streamer.download_chunks():
+                f.write(chunk)
     """
 
-    def __init__(self, url: str, total_retries=3, timeout_sec=10.0, wait_before_retry_sec=60.0):
+    def __init__(
+        self,
+        url: str,
+        total_retries=3,
+        timeout_sec=10.0,
+        wait_before_retry_sec=60.0,
+        connections=1,
+        range_bytes=16 * 1024 * 1024,
+        ranges_in_flight: Optional[int] = None,
+    ):
         self.url = url
         self.response = None
 
@@ -192,8 +316,16 @@ class DownloadChunkStreamer(io.IOBase):
         self.downloaded_bytes = 0
         self.chunk_bytes = 8 * 1024
 
-        # The buffered `read` data.
-        self.buffer = b""
+        # How many connections to use for a parallel ranged download, and how big each range
+        # is. The memory is bounded by `ranges_in_flight * range_bytes`.
+        self.connections = connections
+        self.range_bytes = range_bytes
+        self.ranges_in_flight = ranges_in_flight or connections * 2
+
+        # The chunk that is partially consumed by `read`, and the offset into it. Only views into
+        # the chunks are taken, so the downloaded bytes are copied at most once when read.
+        self.chunk: Optional[bytes] = None
+        self.chunk_offset = 0
 
         # The Generator result of _download_chunks.
         self.chunk_iter: Optional[Generator[bytes, None, None]] = None
@@ -218,41 +350,70 @@ class DownloadChunkStreamer(io.IOBase):
             self.response.close()
 
         self.response = None
+        if self.chunk_iter:
+            # Closing the generator cancels any pending ranges of a parallel download.
+            self.chunk_iter.close()
         self.chunk_iter = None
 
     def read(self, size=-1) -> bytes:
         """
-        This method implements the io.IOBase read method. It buffers the chunks until the `size`
-        requirement is fulfilled. It is backed by the chunks_iter created by the download_chunks
-        method.
+        This method implements the io.IOBase read method. It takes slices of the chunks until the
+        `size` requirement is fulfilled. It is backed by the chunks_iter created by the
+        download_chunks method.
         """
         if not self.chunk_iter:
             # The chunk iterator was consumed. Return an empty byte object to indicate the download
             # is complete.
             return b""
 
-        if size < 0:
-            # Load everything into the buffer, and return it.
-            for chunk in self.chunk_iter:
-                self.buffer += chunk
-            result = self.buffer
-            self.buffer = b""
-            return result
-
-        # Load the buffer with requested amount of data to read. -1 indicates load everything.
-        while len(self.buffer) < size:
-            chunk = next(self.chunk_iter, None)
-            if chunk:
-                self.buffer += chunk
-            else:
-                # The stream ended.
-                break
+        if size is None or size < 0:
+            # Load everything, and return it.
+            remaining = len(self.chunk) - self.chunk_offset if self.chunk else 0
+            return b"".join([*self._take_chunks(remaining), *self.chunk_iter])
 
-        # Return the requested read amount, and divide up the remaining buffer.
-        result = self.buffer[:size]
-        self.buffer = self.buffer[size:]
+        # A single piece is returned without copying.
+        return b"".join(self._take_chunks(size))
 
-        return result
+    def readinto(self, buffer) -> int:
+        """
+        This method implements the io.RawIOBase readinto method, so that the chunks can be
+        copied directly into a caller owned buffer. It fills the entire buffer unless the
+        download ends.
+        """
+        if not self.chunk_iter:
+            return 0
+
+        target = memoryview(buffer).cast("B")
+        bytes_read = 0
+        for piece in self._take_chunks(len(target)):
+            target[bytes_read : bytes_read + len(piece)] = piece
+            bytes_read += len(piece)
+        return bytes_read
+
+    def _take_chunks(self, size: int) -> Generator[Union[bytes, memoryview], None, None]:
+        """
+        Take up to `size` bytes from the downloaded chunks. Whole chunks are yielded as is, and
+        partial chunks are yielded as a view into the chunk.
+        """
+        while size > 0:
+            if not self.chunk:
+                self.chunk = next(self.chunk_iter, None)
+                self.chunk_offset = 0
+                if not self.chunk:
+                    # The stream ended.
+                    return
+
+            chunk = self.chunk
+            if self.chunk_offset == 0 and len(chunk) <= size:
+                piece = chunk
+            else:
+                piece = memoryview(chunk)[self.chunk_offset : self.chunk_offset + size]
+
+            self.chunk_offset += len(piece)
+            if self.chunk_offset == len(chunk):
+                self.chunk = None
+            size -= len(piece)
+            yield piece
 
     def readable(self):
         return True
@@ -264,53 +425,204 @@ class DownloadChunkStreamer(io.IOBase):
         to be consumed. This generator can be used directly in a for loop, or the entire class
         can be passed in as a file handle.
         """
-        next_report_percent = self.report_every
+        start = 0
+        if self.connections > 1:
+            total_bytes = self._get_rangeable_size()
+            if total_bytes > self.range_bytes:
+                try:
+                    yield from self._download_ranges(total_bytes)
+                    return
+                except RangeNotHonoredError as error:
+                    # Continue after the ranges that were already yielded.
+                    start = self.downloaded_bytes
+                    logger.warning(f"{error} Falling back to a single connection.")
+            else:
+                logger.info("Downloading with a single connection.")
+
+        yield from self._download_byte_range(start)
+
+    def _get_rangeable_size(self) -> int:
+        """
+        Determine if the server supports byte ranges for this file. Returns the size of the
+        file, or 0 if the file can't be downloaded in ranges.
+        """
+        response = head_request(self.url, timeout_sec=self.timeout_sec)
+        if not response.ok:
+            return 0
+
+        if response.headers.get("accept-ranges") != "bytes":
+            logger.info("The server does not support range requests.")
+            return 0
+
+        if response.headers.get("content-encoding"):
+            # The ranges would be of the encoded bytes, which can't be decoded independently.
+            logger.info("The server encodes the content, so it can't be downloaded in ranges.")
+            return 0
+
+        return int(response.headers.get("content-length", 0))
+
+    def _download_ranges(self, total_bytes: int) -> Generator[bytes, None, None]:
+        """
+        Download the file in byte ranges over a pool of connections. The ranges are yielded
+        in order, and only `ranges_in_flight` ranges are requested ahead of the consumer.
+        """
+        ranges = (
+            (start, min(start + self.range_bytes, total_bytes) - 1)
+            for start in range(0, total_bytes, self.range_bytes)
+        )
+        range_count = (total_bytes + self.range_bytes - 1) // self.range_bytes
+        logger.info(f"Download size: {total_bytes:,} bytes")
+        logger.info(f"Downloading {range_count:,} ranges over {self.connections} connections")
+
+        # Each thread keeps its own session so that the connections are re-used across ranges.
+        thread_local = threading.local()
+        sessions: list[requests.Session] = []
+
+        def download_range(start: int, end: int) -> bytes:
+            session = getattr(thread_local, "session", None)
+            if not session:
+                session = requests.Session()
+                thread_local.session = session
+                sessions.append(session)
+            return b"".join(self._download_byte_range(start, end, session))
+
+        executor = ThreadPoolExecutor(max_workers=self.connections)
+        pending: deque[Future] = deque()
+
+        def request_next_range():
+            byte_range = next(ranges, None)
+            if byte_range:
+                pending.append(executor.submit(download_range, *byte_range))
+
+        try:
+            for _ in range(self.ranges_in_flight):
+                request_next_range()
+
+            while pending:
+                range_bytes = pending.popleft().result()
+                request_next_range()
+
+                self.downloaded_bytes += len(range_bytes)
+                self._report_progress(total_bytes)
+
+                # Keep yielding fixed size chunks, as with a single connection.
+                for offset in range(0, len(range_bytes), self.chunk_bytes):
+                    yield range_bytes[offset : offset + self.chunk_bytes]
+
+            logger.info("100% downloaded - Download finished.")
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            for session in sessions:
+                session.close()
+
+    def _report_progress(self, total_bytes: int) -> None:
+        """Report the percentage downloaded every `report_every` percentage."""
+        if total_bytes and self.downloaded_bytes >= self.next_report_percent * total_bytes:
+            logger.info(
+                f"{self.downloaded_bytes / total_bytes * 100.0:.0f}% downloaded "
+                f"({self.downloaded_bytes}/{total_bytes} bytes)"
+            )
+            self.next_report_percent += self.report_every
+
+    def _download_byte_range(
+        self,
+        start: int = 0,
+        end: Optional[int] = None,
+        session: Optional[requests.Session] = None,
+    ) -> Generator[bytes, None, None]:
+        """
+        Run the request for a byte range, and retry when there is a failure. A retry picks up
+        the download from where it was before. Without a session, this is the single connection
+        download of the file from `start`, and the progress is reported as it goes.
+
+        Only transient HTTP statuses are retried. When the server ignores the Range header and
+        sends the whole file, the single connection download skips the bytes it already has,
+        and a range download raises a RangeNotHonoredError.
+        """
+        is_range = session is not None
         total_bytes = 0
+        received_bytes = 0
 
         for retry in range(self.total_retries):
             if retry > 0:
                 logger.error(f"Remaining retries: {self.total_retries - retry}")
 
+            response = None
             try:
                 headers = {}
-                if self.downloaded_bytes > 0:
+                if is_range or start + received_bytes > 0:
                     # Pick up the download from where it was before.
-                    headers = {"Range": f"bytes={self.downloaded_bytes}-"}
+                    range_end = "" if end is None else end
+                    headers = {"Range": f"bytes={start + received_bytes}-{range_end}"}
 
-                self.response = requests.get(
+                response = (session or requests).get(
                     self.url, headers=headers, stream=True, timeout=self.timeout_sec
                 )
-                self.response.raise_for_status()
+                if not is_range:
+                    self.response = response
+                response.raise_for_status()
+
+                skip_bytes = 0
+                if headers and response.status_code != 206:
+                    if is_range:
+                        raise RangeNotHonoredError(
+                            f"The server did not honor the range request: {headers}"
+                        )
+                    # The whole file was sent, so skip the bytes that were already received.
+                    skip_bytes = start + received_bytes
 
                 # Report the download size.
-                if not total_bytes and "content-length" in self.response.headers:
-                    total_bytes = int(self.response.headers["content-length"])
+                if not is_range and not total_bytes and "content-length" in response.headers:
+                    total_bytes = int(response.headers["content-length"])
+                    if response.status_code == 206:
+                        total_bytes += start + received_bytes
                     logger.info(f"Download size: {total_bytes:,} bytes")
 
-                for chunk in self.response.iter_content(chunk_size=self.chunk_bytes):
+                for response_chunk in response.iter_content(chunk_size=self.chunk_bytes):
+                    chunk = response_chunk
+                    if skip_bytes:
+                        skipped = min(skip_bytes, len(chunk))
+                        chunk = chunk[skipped:]
+                        skip_bytes -= skipped
                     if not chunk:
                         continue
 
-                    self.downloaded_bytes += len(chunk)
+                    received_bytes += len(chunk)
 
-                    # Report the percentage downloaded every `report_every` percentage.
-                    if total_bytes and self.downloaded_bytes >= next_report_percent * total_bytes:
-                        logger.info(
-                            f"{self.downloaded_bytes / total_bytes * 100.0:.0f}% downloaded "
-                            f"({self.downloaded_bytes}/{total_bytes} bytes)"
-                        )
-                        next_report_percent += self.report_every
+                    if not is_range:
+                        self.downloaded_bytes += len(chunk)
+                        self._report_progress(total_bytes)
 
                     yield chunk
 
                 # The download is complete.
-                self.close()
-                logger.info("100% downloaded - Download finished.")
+                response.close()
+                if not is_range:
+                    self.response = None
+                    logger.info("100% downloaded - Download finished.")
                 return
 
+            except (GeneratorExit, RangeNotHonoredError):
+                # The consumer stopped reading, so don't leave the connection open.
+                if response:
+                    response.close()
+                if not is_range:
+                    self.response = None
+                raise
+
             except requests.exceptions.Timeout as error:
                 logger.error(f"The connection timed out: {error}.")
 
+            except requests.exceptions.HTTPError as error:
+                if error.response.status_code not in TRANSIENT_STATUS_CODES:
+                    response.close()
+                    if not is_range:
+                        self.response = None
+                    raise
+                logger.error(f"A transient HTTP error occurred: {error}")
+
             except requests.exceptions.RequestException as error:
                 # The RequestException is the generic error that catches all classes of "requests"
                 # errors. Don't attempt to be be smart about this, just attempt again until
@@ -318,14 +630,14 @@ class DownloadChunkStreamer(io.IOBase):
                 logger.error(f"A download error occurred: {error}")
 
             # Close out the response on an error. It will be recreated when retrying.
-            if self.response:
-                self.response.close()
+            if response:
+                response.close()
+            if not is_range:
                 self.response = None
 
             logger.info(f"Retrying in {self.wait_before_retry_sec} sec")
             time.sleep(self.wait_before_retry_sec)
 
-        self.close()
         raise Exception("The download failed.")
 
     def decode(self, byte_stream) -> Generator[bytes, None, None]:
@@ -333,22 +645,560 @@ class DownloadChunkStreamer(io.IOBase):
         return byte_stream
 
 
+class RemoteRangeReader(io.RawIOBase):
+    """
+    A seekable, read-only file of a remote file, which is read with HTTP range requests.
+    Sequential reads are streamed from a single request, and a read after seeking elsewhere
+    starts a new request from there. This allows ZipFile to read the central directory at the
+    end of an archive, and then stream a single member without downloading the whole file.
+
+    Usage:
+
+        with io.BufferedReader(RemoteRangeReader(url)) as file, ZipFile(file) as zip:
+            print(zip.namelist())
+    """
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.streamer = DownloadChunkStreamer(url)
+        self.size = self.streamer._get_rangeable_size()
+        if not self.size:
+            raise Exception(f"The file can't be read with range requests: {url}")
+
+        self.session = requests.Session()
+        self.position = 0
+        # The current request, and the position of the next byte it will return.
+        self.chunk_iter: Optional[Generator[bytes, None, None]] = None
+        self.chunk_iter_position = 0
+        self.chunk = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        self.position = max(self.position, 0)
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        if self.position >= self.size:
+            return 0
+
+        if not self.chunk_iter or self.chunk_iter_position != self.position:
+            # Start a new request from the current position.
+            self._close_request()
+            self.chunk_iter = self.streamer._download_byte_range(
+                start=self.position, session=self.session
+            )
+            self.chunk_iter_position = self.position
+
+        if not self.chunk:
+            self.chunk = memoryview(next(self.chunk_iter, b""))
+            if not self.chunk:
+                return 0
+
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        self.position += size
+        self.chunk_iter_position += size
+        return size
+
+    def _close_request(self) -> None:
+        if self.chunk_iter:
+            self.chunk_iter.close()
+        self.chunk_iter = None
+        self.chunk = memoryview(b"")
+
+    def close(self) -> None:
+        self._close_request()
+        self.session.close()
+        super().close()
+
+
+@dataclass
+class RemoteFileInfo:
+    """
+    The information from the HEAD request of a remote file. The ETag and Last-Modified headers
+    are used to determine if the contents of a URL changed.
+    """
+
+    url: str
+    size: int
+    content_type: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    # When the HEAD request was made.
+    checked_at: float
+
+    def cache_key(self) -> Optional[str]:
+        """
+        The key for the contents of the file, or None if the file can't be validated.
+        """
+        if not self.etag and not self.last_modified:
+            return None
+        key = json.dumps([self.url, self.etag, self.last_modified])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class DownloadCache:
+    """
+    An opt-in cache of downloads on the local disk. It can be shared by several processes on
+    the same worker, as files are only added through an atomic rename, and the index is updated
+    under a lock file. When the cache grows over `max_bytes`, the least recently used files
+    are evicted.
+
+    Enable it through the environment:
+
+        DOWNLOAD_CACHE_DIR=/path/to/cache
+        DOWNLOAD_CACHE_MAX_BYTES=20000000000
+
+    The cache is laid out as:
+
+    cache_dir
+    ├── cache.lock
+    ├── urls
+    │   └── {sha256 of url}.json   The HEAD information for a URL.
+    └── files
+        └── {sha256 of url, ETag and Last-Modified}
+    """
+
+    # How long the HEAD information for a URL is trusted before it's requested again.
+    revalidate_after_sec = 60.0 * 60.0
+    # The size of the buffers used when copying files out of the cache.
+    copy_bytes = 1024 * 1024
+
+    def __init__(self, cache_dir: Union[str, Path], max_bytes: int) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.urls_dir = self.cache_dir / "urls"
+        self.files_dir = self.cache_dir / "files"
+        self.urls_dir.mkdir(parents=True, exist_ok=True)
+        self.files_dir.mkdir(parents=True, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    @contextmanager
+    def lock(self):
+        """Hold an exclusive lock across all of the processes using the cache."""
+        with open(self.cache_dir / "cache.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_file_info(self, url: str) -> RemoteFileInfo:
+        """
+        Get the HEAD information for a URL, which is re-used for `revalidate_after_sec`.
+        """
+        url_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        info_path = self.urls_dir / f"{url_hash}.json"
+
+        try:
+            with open(info_path, "r", encoding="utf-8") as info_file:
+                info = RemoteFileInfo(**json.load(info_file))
+            if time.time() - info.checked_at < self.revalidate_after_sec:
+                return info
+        except FileNotFoundError:
+            pass
+
+        mocked_file_path = get_mocked_downloads_file_path(url)
+        if mocked_file_path:
+            stat = os.stat(mocked_file_path)
+            info = RemoteFileInfo(
+                url=url,
+                size=stat.st_size,
+                content_type=None,
+                etag=f"{stat.st_size}-{stat.st_mtime_ns}",
+                last_modified=None,
+                checked_at=time.time(),
+            )
+        else:
+            response = head_request(url)
+            response.raise_for_status()
+            info = RemoteFileInfo(
+                url=url,
+                size=int(response.headers.get("content-length", 0)),
+                content_type=response.headers.get("Content-Type"),
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+                checked_at=time.time(),
+            )
+
+        self._atomic_write(info_path, json.dumps(asdict(info)).encode("utf-8"))
+        return info
+
+    @contextmanager
+    def open(self, url: str, connections: int = 1) -> Generator[BinaryIO, None, None]:
+        """
+        Open a remote file as a binary stream. On a cache hit the file is read from disk,
+        otherwise the download is streamed, and is added to the cache once it's fully read.
+        """
+        info = self.get_file_info(url)
+        key = info.cache_key()
+
+        if key:
+            cached_path = self.files_dir / key
+            try:
+                cached_file = open(cached_path, "rb")
+            except FileNotFoundError:
+                pass
+            else:
+                # Mark the file as recently used. Another process may have evicted it after it
+                # was opened, but the open file handle can still be read.
+                try:
+                    os.utime(cached_path)
+                except FileNotFoundError:
+                    pass
+                self.hits += 1
+                self.bytes_saved += info.size
+                logger.info(f"Download cache hit: {url}")
+                self.log_stats()
+                with cached_file:
+                    yield cached_file
+                return
+        else:
+            logger.info(f"The download can't be cached without an ETag or Last-Modified: {url}")
+
+        self.misses += 1
+        logger.info(f"Download cache miss: {url}")
+        self.log_stats()
+
+        mocked_request = attempt_mocked_request(url)
+        if mocked_request:
+            source = mocked_request
+        else:
+            source = DownloadChunkStreamer(url, connections=connections).__enter__()
+
+        if not key:
+            with source:
+                yield source
+            return
+
+        with _CachingReader(source, self, info) as caching_reader:
+            yield caching_reader
+
+    def add_file(self, temp_path: Path, info: RemoteFileInfo) -> None:
+        """
+        Atomically move a fully downloaded file into the cache, and evict old files.
+        """
+        with self.lock():
+            os.replace(temp_path, self.files_dir / info.cache_key())
+            self._evict()
+
+    def _evict(self) -> None:
+        """
+        Remove the least recently used files until the cache fits in `max_bytes`. The lock must
+        be held.
+        """
+        entries = []
+        total_bytes = 0
+        for path in self.files_dir.iterdir():
+            if path.name.startswith("."):
+                # This is a temporary file that is still being downloaded.
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            logger.info(f"Evicting from the download cache: {path.name} ({format_bytes(size)})")
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+
+    def _atomic_write(self, path: Path, data: bytes) -> None:
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=".")
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+    def log_stats(self) -> None:
+        logger.info(
+            f"Download cache: {self.hits} hits, {self.misses} misses, "
+            f"{format_bytes(self.bytes_saved)} saved"
+        )
+
+
+class _CachingReader(io.IOBase):
+    """
+    Passes through a download stream, while writing it to a temporary file. Once the stream is
+    fully read, the file is added to the download cache. If the stream is closed before then,
+    the temporary file is discarded.
+    """
+
+    def __init__(self, source: BinaryIO, cache: DownloadCache, info: RemoteFileInfo) -> None:
+        self.source = source
+        self.cache = cache
+        self.info = info
+        fd, temp_path = tempfile.mkstemp(dir=cache.files_dir, prefix=".")
+        self.temp_path = Path(temp_path)
+        self.temp_file: Optional[BinaryIO] = os.fdopen(fd, "wb")
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1) -> bytes:
+        data = self.source.read(size)
+        if not self.temp_file:
+            return data
+
+        if data:
+            self.temp_file.write(data)
+            self.bytes_read += len(data)
+        else:
+            # The download is complete.
+            self.temp_file.close()
+            self.temp_file = None
+            if self.info.size and self.bytes_read != self.info.size:
+                logger.error(
+                    f"Not caching the download, expected {self.info.size:,} bytes but "
+                    f"received {self.bytes_read:,}"
+                )
+                self.temp_path.unlink(missing_ok=True)
+            else:
+                self.cache.add_file(self.temp_path, self.info)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def close(self):
+        if self.temp_file:
+            # The stream was not fully read, so don't cache it.
+            self.temp_file.close()
+            self.temp_file = None
+            self.temp_path.unlink(missing_ok=True)
+        self.source.close()
+        super().close()
+
+
+_download_caches: dict[tuple[str, int], DownloadCache] = {}
+
+
+def get_download_cache() -> Optional[DownloadCache]:
+    """
+    Get the download cache if it was enabled through DOWNLOAD_CACHE_DIR. The cache defaults
+    to 20 GB, which can be changed with DOWNLOAD_CACHE_MAX_BYTES.
+    """
+    cache_dir = os.environ.get("DOWNLOAD_CACHE_DIR")
+    if not cache_dir:
+        return None
+
+    max_bytes = int(os.environ.get("DOWNLOAD_CACHE_MAX_BYTES", 20_000_000_000))
+    key = (cache_dir, max_bytes)
+    if key not in _download_caches:
+        logger.info(f"Using the download cache: {cache_dir} ({format_bytes(max_bytes)})")
+        _download_caches[key] = DownloadCache(cache_dir, max_bytes)
+    return _download_caches[key]
+
+
+class _PrefetchedDownload:
+    """
+    Downloads the start of a remote file on a background thread into an anonymous temporary
+    file, so that the connection setup and the time to the first byte overlap with reading the
+    previous file. Only the first `prefetch_bytes` are written to the disk, and the rest of the
+    file is streamed from the open download. The file can be read with `open()` while it is
+    still downloading.
+    """
+
+    def __init__(self, url: str, prefetch_bytes: int = PREFETCH_BYTES) -> None:
+        self.url = url
+        self.prefetch_bytes = prefetch_bytes
+        self.content_type: Optional[str] = None
+        self.file = tempfile.TemporaryFile()
+        # The download, which is read by the reader once the prefetch is done. It's None when
+        # the file was fully downloaded.
+        self.source: Optional[BinaryIO] = None
+        self.source_stack = ExitStack()
+        self.downloaded_bytes = 0
+        self.started = False
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.cancelled = threading.Event()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._download, name=f"prefetch {url}", daemon=True)
+        self.thread.start()
+
+    def _download(self) -> None:
+        try:
+            content_type = get_content_type(self.url)
+            with self.condition:
+                self.content_type = content_type
+                self.started = True
+                self.condition.notify_all()
+
+            if content_type == "application/zip" or self.cancelled.is_set():
+                # Only part of a remote zip file is read, with range requests.
+                return
+
+            download_cache = get_download_cache()
+            self.source = self.source_stack.enter_context(
+                download_cache.open(self.url)
+                if download_cache
+                else DownloadChunkStreamer(self.url)
+            )
+            while self.downloaded_bytes < self.prefetch_bytes and not self.cancelled.is_set():
+                chunk = self.source.read(COPY_CHUNK_BYTES)
+                if not chunk:
+                    self.source = None
+                    self.source_stack.close()
+                    break
+                self.file.write(chunk)
+                self.file.flush()
+                with self.condition:
+                    self.downloaded_bytes += len(chunk)
+                    self.condition.notify_all()
+        except BaseException as exception:
+            self.error = exception
+            self.source = None
+            self.source_stack.close()
+        finally:
+            with self.condition:
+                self.started = True
+                self.done = True
+                # When the download was closed while it was running, it's cleaned up here.
+                is_cancelled = self.cancelled.is_set()
+                self.condition.notify_all()
+            if is_cancelled:
+                self._close_files()
+
+    def get_content_type(self) -> Optional[str]:
+        with self.condition:
+            self.condition.wait_for(lambda: self.started)
+        if self.error and self.content_type is None:
+            raise self.error
+        return self.content_type
+
+    def wait_for_bytes(self, offset: int) -> int:
+        """Wait until there are bytes past the offset, and return how many are available."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.downloaded_bytes > offset or self.done)
+            if self.downloaded_bytes > offset:
+                return self.downloaded_bytes - offset
+        if self.error:
+            raise self.error
+        return 0
+
+    def open(self) -> BinaryIO:
+        return io.BufferedReader(_PrefetchReader(self), COPY_CHUNK_BYTES)
+
+    def close(self) -> None:
+        """
+        Stop the download if it's still running, and remove the temporary file. This doesn't
+        wait on a read that is in progress, as the thread cleans up after it.
+        """
+        with self.condition:
+            self.cancelled.set()
+            is_done = self.done
+        if is_done:
+            self._close_files()
+        else:
+            self.thread.join(PREFETCH_CLOSE_TIMEOUT_SEC)
+
+    def _close_files(self) -> None:
+        self.source = None
+        self.source_stack.close()
+        self.file.close()
+
+
+class _PrefetchReader(io.RawIOBase):
+    """
+    Reads a _PrefetchedDownload, waiting on the download when the reader catches up to it.
+    After the prefetched bytes, the rest of the file is read from the download.
+    """
+
+    def __init__(self, prefetch: _PrefetchedDownload) -> None:
+        self.prefetch = prefetch
+        self.offset = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        available_bytes = self.prefetch.wait_for_bytes(self.offset)
+        if available_bytes:
+            data = os.pread(
+                self.prefetch.file.fileno(), min(len(buffer), available_bytes), self.offset
+            )
+        elif self.prefetch.source:
+            # The prefetch is done, so the download is only read here.
+            data = self.prefetch.source.read(len(buffer))
+        else:
+            return 0
+        buffer[: len(data)] = data
+        self.offset += len(data)
+        return len(data)
+
+
+def _should_prefetch(location: Union[str, Path]) -> bool:
+    location = str(location)
+    if not location.startswith("http://") and not location.startswith("https://"):
+        return False
+    # Mocked downloads are read from the local file system.
+    return not get_mocked_downloads_file_path(location)
+
+
 @contextmanager
 def _read_lines_multiple_files(
     files: list[Union[str, Path]],
     encoding: str,
     path_in_archive: Optional[str],
     on_enter_location: Optional[Callable[[str], None]] = None,
-) -> Generator[str, None, None]:
+    binary: bool = False,
+    prefetch_files: int = PREFETCH_FILES,
+) -> Generator[Union[str, bytes], None, None]:
     """
     Iterates through each line in multiple files, combining it into a single stream.
+    While a file is read, the next `prefetch_files` remote files are downloaded in the
+    background.
     """
+    # The prefetched downloads for the files that haven't been read yet, in order.
+    prefetches: deque[Optional[_PrefetchedDownload]] = deque()
+
+    def start_prefetches(next_index: int):
+        while len(prefetches) < prefetch_files and next_index + len(prefetches) < len(files):
+            file_path = files[next_index + len(prefetches)]
+            prefetches.append(
+                _PrefetchedDownload(str(file_path)) if _should_prefetch(file_path) else None
+            )
 
     def iter(stack: ExitStack):
-        for file_path in files:
+        for index, file_path in enumerate(files):
+            prefetched = prefetches.popleft() if prefetches else None
+            if prefetched:
+                stack.callback(prefetched.close)
+            start_prefetches(index + 1)
+
             logger.info(f"Reading lines from: {file_path}")
             lines = stack.enter_context(
-                read_lines(file_path, path_in_archive, on_enter_location, encoding=encoding)
+                _read_lines_single_file(
+                    file_path, encoding, path_in_archive, on_enter_location, binary, prefetched
+                )
             )
             yield from lines
             stack.close()
@@ -358,6 +1208,11 @@ def _read_lines_multiple_files(
         yield iter(stack)
     finally:
         stack.close()
+        # The consumer may stop early, so cancel any downloads that are still running.
+        while prefetches:
+            prefetched = prefetches.popleft()
+            if prefetched:
+                prefetched.close()
 
 
 @contextmanager
@@ -366,6 +1221,8 @@ def _read_lines_single_file(
     encoding: str,
     path_in_archive: Optional[str] = None,
     on_enter_location: Optional[Callable[[str], None]] = None,
+    binary: bool = False,
+    prefetched: Optional[_PrefetchedDownload] = None,
 ):
     """
     A smart function to efficiently stream lines from a local or remote file.
@@ -376,6 +1233,8 @@ def _read_lines_single_file(
         location - URL or file path
         path_in_archive  - The path to a file in a zip archive
         on_enter_location - A lambda for when a new location is entered
+        binary - Stream the lines as bytes
+        prefetched - A remote file that is already being downloaded in the background
     """
     location = str(location)
     if on_enter_location:
@@ -393,47 +1252,62 @@ def _read_lines_single_file(
         if location.startswith("http://") or location.startswith("https://"):
             # This is a remote file.
 
-            response = requests.head(location, allow_redirects=True)
-            content_type = response.headers.get("Content-Type")
+            if prefetched:
+                content_type = prefetched.get_content_type()
+            else:
+                content_type = get_content_type(location)
+
             if content_type == "application/gzip":
-                yield stack.enter_context(RemoteGzipLineStreamer(location))
+                streamer = RemoteGzipLineStreamer
 
             elif content_type == "application/zstd":
-                yield stack.enter_context(RemoteZstdLineStreamer(location))
-
-            elif content_type == "application/zip":
-                raise Exception("Streaming a zip from a remote location is supported.")
+                streamer = RemoteZstdLineStreamer
+
+            elif content_type == "application/zip" or (
+                content_type != "text/plain" and location.endswith(".zip")
+            ):
+                # Only the central directory and the member are read with range requests.
+                zip_file = stack.enter_context(
+                    io.BufferedReader(RemoteRangeReader(location), BINARY_BUFFER_BYTES)
+                )
+                yield _open_zip_member(stack, zip_file, path_in_archive, encoding, binary)
+                return
 
             elif content_type == "text/plain":
-                yield stack.enter_context(RemoteDecodingLineStreamer(location))
+                streamer = RemoteDecodingLineStreamer
 
             elif location.endswith(".gz") or location.endswith(".gzip"):
-                yield stack.enter_context(RemoteGzipLineStreamer(location))
+                streamer = RemoteGzipLineStreamer
 
             elif location.endswith(".zst"):
-                yield stack.enter_context(RemoteZstdLineStreamer(location))
+                streamer = RemoteZstdLineStreamer
             else:
                 # Treat as plain text.
-                yield stack.enter_context(RemoteDecodingLineStreamer(location))
+                streamer = RemoteDecodingLineStreamer
+
+            byte_stream = prefetched.open() if prefetched else None
+            yield stack.enter_context(streamer(location, binary, byte_stream))
 
         else:  # noqa: PLR5501
             # This is a local file.
             if location.endswith(".gz") or location.endswith(".gzip"):
-                yield stack.enter_context(gzip.open(location, "rt", encoding=encoding))
+                if binary:
+                    yield stack.enter_context(gzip.open(location, "rb"))
+                else:
+                    yield stack.enter_context(gzip.open(location, "rt", encoding=encoding))
 
             elif location.endswith(".zst"):
                 input_file = stack.enter_context(open(location, "rb"))
                 zst_reader = stack.enter_context(ZstdDecompressor().stream_reader(input_file))
-                yield stack.enter_context(io.TextIOWrapper(zst_reader, encoding=encoding))
+                if binary:
+                    yield stack.enter_context(io.BufferedReader(zst_reader, BINARY_BUFFER_BYTES))
+                else:
+                    yield stack.enter_context(io.TextIOWrapper(zst_reader, encoding=encoding))
 
             elif location.endswith(".zip"):
-                if not path_in_archive:
-                    raise Exception("Expected a path into the zip file.")
-                zip = stack.enter_context(ZipFile(location, "r"))
-                if path_in_archive not in zip.namelist():
-                    raise Exception(f"Path did not exist in the zip file: {path_in_archive}")
-                file = stack.enter_context(zip.open(path_in_archive, "r", encoding=encoding))
-                yield stack.enter_context(io.TextIOWrapper(file, encoding=encoding))
+                yield _open_zip_member(stack, location, path_in_archive, encoding, binary)
+            elif binary:
+                yield stack.enter_context(open(location, "rb", buffering=BINARY_BUFFER_BYTES))
             else:
                 # Treat as plain text.
                 yield stack.enter_context(open(location, "rt", encoding=encoding))
@@ -441,21 +1315,54 @@ def _read_lines_single_file(
         stack.close()
 
 
+def _open_zip_member(
+    stack: ExitStack,
+    zip_file: Union[str, BinaryIO],
+    path_in_archive: Optional[str],
+    encoding: str,
+    binary: bool,
+):
+    """Open a file in a zip archive as a line stream."""
+    if not path_in_archive:
+        raise Exception("Expected a path into the zip file.")
+    zip = stack.enter_context(ZipFile(zip_file, "r"))
+    if path_in_archive not in zip.namelist():
+        raise Exception(f"Path did not exist in the zip file: {path_in_archive}")
+    file = stack.enter_context(zip.open(path_in_archive, "r"))
+    if binary:
+        return file
+    return stack.enter_context(io.TextIOWrapper(file, encoding=encoding))
+
+
 def read_lines(
     location_or_locations: Union[Path, str, list[Union[str, Path]]],
     path_in_archive: Optional[str] = None,
     on_enter_location: Optional[Callable[[str], None]] = None,
     encoding="utf-8",
-) -> Generator[str, None, None]:
+    binary: bool = False,
+    start_line: Optional[int] = None,
+    end_line: Optional[int] = None,
+    decompression_threads: int = 0,
+) -> Generator[Union[str, bytes], None, None]:
     """
     A smart function to efficiently stream lines from a local or remote file.
     The location can either be a URL or a local file system path.
-    It handles gzip, zst, and plain text files.
+    It handles gzip, zst, zip, and plain text files.
     It can also handle a list of files.
 
     Args:
         location_or_locations - A single URL or file path, or a list
-        path_in_archive  - The path to a file in a zip archive
+        path_in_archive  - The path to a file in a zip archive. A remote zip archive is read
+                           with range requests, so it's never fully downloaded.
+        binary - Stream the lines as bytes, which skips decoding the text. This is faster
+                 when the lines are only copied, hashed or counted.
+        start_line - The first line to read, counting from 0.
+        end_line - The line to stop reading at, which is excluded.
+        decompression_threads - How many threads decompress a seekable zstd file. 0 reads on
+                                the calling thread, and -1 uses one thread per logical CPU.
+
+    The line range and parallel decompression use the frame index of a seekable zstd file,
+    see write_lines(seekable=True). Otherwise the lines before the start line are skipped.
 
     Usage:
         with read_lines("output.txt.gz") as lines:
@@ -472,17 +1379,38 @@ def read_lines(
     """
 
     if isinstance(location_or_locations, list):
-        return _read_lines_multiple_files(
-            location_or_locations, encoding, path_in_archive, on_enter_location
+        lines_context = _read_lines_multiple_files(
+            location_or_locations, encoding, path_in_archive, on_enter_location, binary
         )
+    else:
+        location = str(location_or_locations)
+        index = _load_seekable_index(location)
+        if index:
+            if on_enter_location:
+                on_enter_location(location)
+            return _read_lines_seekable_zst(
+                location, index, encoding, binary, start_line, end_line, decompression_threads
+            )
 
-    return _read_lines_single_file(
-        location_or_locations, encoding, path_in_archive, on_enter_location
-    )
+        lines_context = _read_lines_single_file(
+            location_or_locations, encoding, path_in_archive, on_enter_location, binary
+        )
+
+    if start_line is None and end_line is None:
+        return lines_context
+    return _slice_lines(lines_context, start_line, end_line)
 
 
 @contextmanager
-def write_lines(path: Path | str, encoding="utf-8"):
+def write_lines(
+    path: Path | str,
+    encoding="utf-8",
+    compression_level: Optional[int] = None,
+    compression_threads: int = 0,
+    binary: bool = False,
+    seekable: bool = False,
+    append: bool = False,
+):
     """
     A smart function to create a context to write lines to a file. It works on .zst, .gz, and
     raw text files. It reads the extension to determine the file type. If writing out a raw
@@ -492,18 +1420,57 @@ def write_lines(path: Path | str, encoding="utf-8"):
     with write_lines("output.txt.gz") as output:
         output.write("writing a line\n")
         output.write("writing a second lines\n")
+
+    Args:
+        compression_level - The zstd (default 3) or gzip (default 9) compression level.
+        compression_threads - How many worker threads zstd compresses with. 0 compresses on
+                              the calling thread, and -1 uses one thread per logical CPU.
+        binary - Write the lines as bytes, e.g. the lines from read_lines(path, binary=True).
+        seekable - Write a .zst file as independent frames with a sidecar index, so that it
+                   can be read from any line, and decompressed in parallel. See
+                   read_lines(start_line, end_line, decompression_threads).
+        append - Append the lines to an existing seekable .zst file, and extend its index.
     """
 
+    if append and not (seekable and str(path).endswith(".zst")):
+        raise ValueError(f"Only seekable .zst files can be appended to: {path}")
+
     try:
         path = str(path)
         stack = ExitStack()
 
-        if path.endswith(".zst"):
+        if path.endswith(".zst") and seekable:
+            writer = stack.enter_context(
+                _SeekableZstdWriter(path, compression_level, compression_threads, append)
+            )
+            if binary:
+                yield stack.enter_context(io.BufferedWriter(writer, BINARY_BUFFER_BYTES))
+            else:
+                yield stack.enter_context(io.TextIOWrapper(writer, encoding=encoding))
+        elif path.endswith(".zst"):
+            # Don't leave behind the index of a previous seekable file.
+            get_seekable_index_path(path).unlink(missing_ok=True)
             file = stack.enter_context(open(path, "wb"))
-            compressor = stack.enter_context(ZstdCompressor().stream_writer(file))
-            yield stack.enter_context(io.TextIOWrapper(compressor, encoding=encoding))
+            cctx = get_zstd_compressor(compression_level, compression_threads)
+            compressor = stack.enter_context(cctx.stream_writer(file))
+            if binary:
+                yield stack.enter_context(io.BufferedWriter(compressor, BINARY_BUFFER_BYTES))
+            else:
+                yield stack.enter_context(io.TextIOWrapper(compressor, encoding=encoding))
         elif path.endswith(".gz"):
-            yield stack.enter_context(gzip.open(path, "wt", encoding=encoding))
+            if compression_level is None:
+                compression_level = GZIP_DEFAULT_LEVEL
+            if binary:
+                compressor = stack.enter_context(
+                    gzip.open(path, "wb", compresslevel=compression_level)
+                )
+                yield stack.enter_context(io.BufferedWriter(compressor, BINARY_BUFFER_BYTES))
+            else:
+                yield stack.enter_context(
+                    gzip.open(path, "wt", encoding=encoding, compresslevel=compression_level)
+                )
+        elif binary:
+            yield stack.enter_context(open(path, "wb", buffering=BINARY_BUFFER_BYTES))
         else:
             yield stack.enter_context(open(path, "wt", encoding=encoding))
 
@@ -511,13 +1478,307 @@ def write_lines(path: Path | str, encoding="utf-8"):
         stack.close()
 
 
-def count_lines(path: Path | str) -> int:
+def get_zstd_compressor(
+    compression_level: Optional[int] = None, compression_threads: int = 0
+) -> ZstdCompressor:
+    """
+    Get a zstd compressor. Multi-threaded compression writes the same zstd format, which can be
+    decompressed as usual.
+    """
+    return ZstdCompressor(
+        level=ZSTD_DEFAULT_LEVEL if compression_level is None else compression_level,
+        threads=compression_threads,
+    )
+
+
+def get_seekable_index_path(path: Union[str, Path]) -> Path:
+    """The sidecar index of a seekable zstd file, e.g. corpus.en.zst.frames.json"""
+    return Path(f"{path}.frames.json")
+
+
+def _get_worker_count(threads: int) -> int:
+    """Match the zstd convention, where -1 means one thread per logical CPU."""
+    return os.cpu_count() or 1 if threads < 0 else threads
+
+
+class _SeekableZstdWriter(io.RawIOBase):
+    """
+    Writes a zstd file as independent frames that only contain whole lines. The compressed
+    offset and the first line of each frame is written to a sidecar index. The frames are
+    concatenated, so the file can still be decompressed as usual, e.g. with `zstd -d`.
+
+    The index looks like:
+    {
+        "size": 12345,            # The compressed size of the file.
+        "lines": 100000,
+        "last_frame_sha256": "9f86d08...",  # The checksum of the last compressed frame.
+        "frames": [[0, 0], [4321, 51234]],  # [compressed offset, first line]
+    }
+    """
+
+    # The uncompressed size of each frame.
+    frame_bytes = 4 * 1024 * 1024
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        compression_level: Optional[int] = None,
+        compression_threads: int = 0,
+        append: bool = False,
+    ) -> None:
+        self.path = Path(path)
+        index = None
+        if append:
+            index = _load_seekable_index(str(path))
+            if index is None:
+                raise ValueError(
+                    f"Only a seekable zstd file with an up to date index can be appended to: {path}"
+                )
+        self.file = open(path, "ab" if append else "wb")
+        self.compression_level = (
+            ZSTD_DEFAULT_LEVEL if compression_level is None else compression_level
+        )
+        self.buffer = bytearray()
+        self.frames: list[tuple[int, int]] = []
+        self.compressed_bytes = 0
+        self.line_count = 0
+        self.last_frame_sha256 = hashlib.sha256().hexdigest()
+        if index:
+            # Continue the index after the frames that are already in the file.
+            self.frames = [(offset, first_line) for offset, first_line in index["frames"]]
+            self.compressed_bytes = index["size"]
+            self.line_count = index["lines"]
+            self.last_frame_sha256 = index["last_frame_sha256"]
+
+        # Each frame is compressed independently, so the frames are compressed in parallel
+        # rather than with zstd's own worker threads.
+        workers = _get_worker_count(compression_threads)
+        self.executor = ThreadPoolExecutor(workers) if workers else None
+        self.frames_in_flight = workers * 2
+        self.pending_frames: deque[Future] = deque()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.buffer += data
+        while len(self.buffer) >= self.frame_bytes:
+            # End the frame on the first line boundary after the frame size.
+            end = self.buffer.find(b"\n", self.frame_bytes - 1) + 1
+            if not end:
+                break
+            with memoryview(self.buffer) as view:
+                self._add_frame(bytes(view[:end]))
+            del self.buffer[:end]
+        return len(data)
+
+    def _compress(self, data: bytes) -> tuple[bytes, int]:
+        """Compress a frame, and count its lines."""
+        compressed = ZstdCompressor(level=self.compression_level).compress(data)
+        return compressed, data.count(b"\n")
+
+    def _add_frame(self, data: bytes) -> None:
+        if not self.executor:
+            self._write_frame(*self._compress(data))
+            return
+
+        self.pending_frames.append(self.executor.submit(self._compress, data))
+        while len(self.pending_frames) > self.frames_in_flight:
+            self._write_frame(*self.pending_frames.popleft().result())
+
+    def _write_frame(self, compressed: bytes, line_count: int) -> None:
+        self.frames.append((self.compressed_bytes, self.line_count))
+        self.file.write(compressed)
+        self.compressed_bytes += len(compressed)
+        self.line_count += line_count
+        self.last_frame_sha256 = hashlib.sha256(compressed).hexdigest()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            ends_with_partial_line = self.buffer and not self.buffer.endswith(b"\n")
+            if self.buffer:
+                self._add_frame(bytes(self.buffer))
+                self.buffer.clear()
+            while self.pending_frames:
+                self._write_frame(*self.pending_frames.popleft().result())
+            if ends_with_partial_line:
+                # Count the final line without a newline.
+                self.line_count += 1
+        finally:
+            if self.executor:
+                self.executor.shutdown(cancel_futures=True)
+            self.file.close()
+            super().close()
+
+        index = {
+            "size": self.compressed_bytes,
+            "lines": self.line_count,
+            "last_frame_sha256": self.last_frame_sha256,
+            "frames": self.frames,
+        }
+        get_seekable_index_path(self.path).write_text(json.dumps(index))
+
+
+def _get_last_frame_sha256(location: str, index: dict) -> str:
+    """The checksum of the compressed bytes from the start of the last frame to the end."""
+    offset = index["frames"][-1][0] if index["frames"] else 0
+    with open(location, "rb") as file:
+        return hashlib.sha256(os.pread(file.fileno(), index["size"] - offset, offset)).hexdigest()
+
+
+def _load_seekable_index(location: str) -> Optional[dict]:
+    """
+    Load the index of a local seekable zstd file, if it has one that is up to date. The index is
+    checked against the size of the file and a checksum of its last frame, rather than its mtime,
+    as a fetched file gets a new mtime, and a rewritten file can have the same size.
+    """
+    if not location.endswith(".zst") or location.startswith(("http://", "https://")):
+        return None
+    index_path = get_seekable_index_path(location)
+    if not index_path.exists():
+        return None
+    try:
+        index = json.loads(index_path.read_text())
+        is_up_to_date = index["size"] == os.path.getsize(location) and index.get(
+            "last_frame_sha256"
+        ) == _get_last_frame_sha256(location, index)
+    except (OSError, ValueError, KeyError, IndexError, TypeError) as exception:
+        logger.warning(f"Ignoring the frame index that can't be read: {location} {exception}")
+        return None
+    if not is_up_to_date:
+        logger.warning(f"Ignoring the frame index that is out of date: {location}")
+        return None
+    return index
+
+
+@contextmanager
+def _read_lines_seekable_zst(
+    location: str,
+    index: dict,
+    encoding: str,
+    binary: bool,
+    start_line: Optional[int],
+    end_line: Optional[int],
+    decompression_threads: int,
+):
+    """
+    Read a range of lines from a seekable zstd file. Only the frames that contain the lines
+    are decompressed, and they can be decompressed on multiple threads. The lines are
+    yielded in order.
+    """
+    start_line = start_line or 0
+    end_line = index["lines"] if end_line is None else min(end_line, index["lines"])
+    offsets = [offset for offset, _ in index["frames"]] + [index["size"]]
+    first_lines = [first_line for _, first_line in index["frames"]]
+    first_frame = max(bisect_right(first_lines, start_line) - 1, 0)
+    frames = [
+        frame for frame in range(first_frame, len(first_lines)) if first_lines[frame] < end_line
+    ]
+
+    def decode_frame(file, frame: int) -> list:
+        size = offsets[frame + 1] - offsets[frame]
+        data = ZstdDecompressor().decompress(os.pread(file.fileno(), size, offsets[frame]))
+        # The index counts the lines by "\n", so select the lines before decoding them.
+        first_line = first_lines[frame]
+        lines = io.BytesIO(data).readlines()[
+            max(start_line - first_line, 0) : end_line - first_line
+        ]
+        if binary:
+            return lines
+        # Decode with the same newline handling as the other text streams of read_lines.
+        return io.TextIOWrapper(io.BytesIO(b"".join(lines)), encoding=encoding).readlines()
+
+    def iter_frames(file, executor: Optional[ThreadPoolExecutor], workers: int):
+        if not executor:
+            for frame in frames:
+                yield frame, decode_frame(file, frame)
+            return
+
+        # Keep a window of frames decoding, and yield them in order.
+        frames_in_flight = workers * 2
+        pending: deque[tuple[int, Future]] = deque()
+        for frame in frames:
+            pending.append((frame, executor.submit(decode_frame, file, frame)))
+            if len(pending) >= frames_in_flight:
+                decoded_frame, future = pending.popleft()
+                yield decoded_frame, future.result()
+        while pending:
+            decoded_frame, future = pending.popleft()
+            yield decoded_frame, future.result()
+
+    def iter_lines(file, executor: Optional[ThreadPoolExecutor], workers: int):
+        for _, lines in iter_frames(file, executor, workers):
+            yield from lines
+
+    workers = _get_worker_count(decompression_threads)
+    with ExitStack() as stack:
+        file = stack.enter_context(open(location, "rb"))
+        executor = stack.enter_context(ThreadPoolExecutor(workers)) if workers else None
+        if executor:
+            # Don't wait on the frames that are no longer needed if the reader stops early.
+            stack.callback(executor.shutdown, cancel_futures=True)
+        yield iter_lines(file, executor, workers)
+
+
+@contextmanager
+def _slice_lines(lines_context, start_line: Optional[int], end_line: Optional[int]):
+    """Skip to the lines in the range when the file can't be seeked."""
+    with lines_context as lines:
+        yield itertools.islice(lines, start_line or 0, end_line)
+
+
+def get_line_count_path(path: Union[str, Path]) -> Path:
+    """The sidecar that caches the line count of a file, e.g. corpus.en.zst.lines.json"""
+    return Path(f"{path}.lines.json")
+
+
+def count_lines(path: Path | str, cache: bool = False) -> int:
     """
     Similar to wc -l, this counts the lines in a file. However, this command does so regardless
-    of the compression strategy used on the file.
+    of the compression strategy used on the file. A final line without a newline is counted.
+
+    The count of a local file is read from a `<path>.lines.json` sidecar file when there is one
+    that matches the file's size and modification time. Set `cache` to write the sidecar, so
+    counting the same file again is instant. Don't set it for files in an artifacts directory,
+    as the sidecar would be published with them.
     """
-    with read_lines(path) as lines:
-        return sum(1 for _ in lines)
+    location = str(path)
+    index = _load_seekable_index(location)
+    if index:
+        return index["lines"]
+
+    is_local = not location.startswith(("http://", "https://"))
+    if is_local:
+        stat = os.stat(location)
+        try:
+            cached = json.loads(get_line_count_path(location).read_text())
+            if cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+                return cached["lines"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    line_count = 0
+    last_byte = b"\n"
+    # The binary line stream is a file object, so count the newlines in large blocks rather
+    # than iterating over the lines.
+    with read_lines(location, binary=True) as stream:
+        while block := stream.read(COPY_CHUNK_BYTES):
+            line_count += block.count(b"\n")
+            last_byte = block[-1:]
+    if last_byte != b"\n":
+        line_count += 1
+
+    if is_local and cache:
+        cached = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "lines": line_count}
+        try:
+            get_line_count_path(location).write_text(json.dumps(cached))
+        except OSError as exception:
+            # The cache is optional, e.g. the directory could be read-only.
+            logger.warning(f"The line count could not be cached: {exception}")
+
+    return line_count
 
 
 def get_file_size(location: Union[Path, str]) -> int:
@@ -534,26 +1795,33 @@ def get_human_readable_file_size(location: Union[Path, str]) -> tuple[int, str]:
 
 
 def compress_file(
-    path: Union[str, Path], keep_original: bool = True, compression: Literal["zst", "gz"] = "zst"
+    path: Union[str, Path],
+    keep_original: bool = True,
+    compression: Literal["zst", "gz"] = "zst",
+    compression_level: Optional[int] = None,
+    compression_threads: int = 0,
 ) -> Path:
     """
     Compresses a file to .zst or .gz format. It returns the path of the compressed file.
-    "zst" is the preferred compression scheme.
+    "zst" is the preferred compression scheme. The file is streamed through the compressor,
+    so it is never fully loaded into memory. See write_lines for the compression arguments.
     """
     path = Path(path)
 
     if compression == "zst":
         compressed_path = Path(str(path) + ".zst")
-        cctx = ZstdCompressor()
+        cctx = get_zstd_compressor(compression_level, compression_threads)
         with open(path, "rb") as infile:
             with open(compressed_path, "wb") as outfile:
-                outfile.write(cctx.compress(infile.read()))
+                cctx.copy_stream(infile, outfile, read_size=COPY_CHUNK_BYTES)
 
     elif compression == "gz":
         compressed_path = Path(str(path) + ".gz")
+        if compression_level is None:
+            compression_level = GZIP_DEFAULT_LEVEL
         with open(path, "rb") as infile:
-            with gzip.open(compressed_path, "wb") as outfile:
-                outfile.write(infile.read())
+            with gzip.open(compressed_path, "wb", compresslevel=compression_level) as outfile:
+                shutil.copyfileobj(infile, outfile, COPY_CHUNK_BYTES)
 
     else:
         raise ValueError(f"Unsupported compression format: {compression}")
@@ -586,14 +1854,9 @@ def decompress_file(
 
         if path.suffix == ".gz":
             compressed_file = stack.enter_context(gzip.open(str(path), "rb"))
-            decompressed_file.write(compressed_file.read())
-            while True:
-                # Write the data out in chunks so that all of the it doesn't need to be
-                # into memory.
-                chunk = compressed_file.read(10_240)
-                if not chunk:
-                    break
-                decompressed_file.write(chunk)
+            # Write the data out in chunks so that all of the it doesn't need to be
+            # into memory.
+            shutil.copyfileobj(compressed_file, decompressed_file, COPY_CHUNK_BYTES)
 
         elif path.suffix == ".zst":
             compressed_file = stack.enter_context(open(path, "rb"))
@@ -0,0 +1,367 @@
+"""
+A sorted file of line fingerprints, so that one task can de-duplicate its lines against a corpus
+that was merged by another task without re-reading and re-hashing the corpus.
+
+The file contains the unique fingerprints from `get_line_fingerprint` in ascending order, stored
+as little endian uint64 values with no header. It's memory-mapped and binary searched, so only
+the pages that are looked up are read into memory.
+"""
+
+import os
+import tempfile
+from collections import deque
+from itertools import islice
+from multiprocessing import Process, Queue
+from pathlib import Path
+from typing import Callable, Generator, Iterable, Optional, TypeVar
+
+import numpy as np
+import numpy.typing as npt
+
+from pipeline.common.datasets import get_line_fingerprint
+from pipeline.common.hash_table import UInt64HashTable
+from pipeline.common.parallel import BlockPool
+
+FINGERPRINT_DTYPE = np.dtype("<u8")
+
+# How many fingerprints are de-duplicated and written at a time.
+WRITE_CHUNK_SIZE = 1 << 22
+
+# How many lines are sent to a FingerprintPool worker at a time.
+FINGERPRINT_BATCH_SIZE = 10_000
+
+T = TypeVar("T")
+
+
+def get_line_fingerprints(lines: Iterable[str]) -> npt.NDArray[np.uint64]:
+    """Compute the fingerprints of a batch of lines."""
+    return np.fromiter(map(get_line_fingerprint, lines), dtype=np.uint64)
+
+
+def batch_lines(
+    lines: Iterable[T], batch_size: int = FINGERPRINT_BATCH_SIZE
+) -> Generator[list[T], None, None]:
+    """Split a stream of lines into batches, e.g. for a FingerprintPool."""
+    lines = iter(lines)
+    while batch := list(islice(lines, batch_size)):
+        yield batch
+
+
+def get_column_fingerprints(rows: list[tuple[str, ...]]) -> npt.NDArray[np.uint64]:
+    """
+    Compute the fingerprints of each column of a batch of rows, e.g. of (src, trg) pairs.
+    Returns an array with a row of fingerprints per column.
+    """
+    return np.array([get_line_fingerprints(column) for column in zip(*rows)], dtype=np.uint64)
+
+
+class FingerprintPool:
+    """
+    Computes the fingerprints of batches of lines in a pool of processes. Normalizing and hashing
+    the lines is CPU bound, so it's spread across the cores, while the caller only does the
+    membership checks and writes. The fingerprints are yielded in the order of the batches, so
+    the results are identical to computing them serially. Only a few batches per process are
+    read ahead, so the memory is bounded.
+
+    Usage:
+        with FingerprintPool(processes=-1) as pool:
+            for lines, fingerprints in pool.imap(batch_lines(lines)):
+                ...
+    """
+
+    def __init__(self, processes: int = -1) -> None:
+        # With a single process, the batches are fingerprinted in this process, which saves
+        # sending the lines to another process.
+        self.pool = BlockPool(processes)
+        self.processes = self.pool.processes
+
+    def __enter__(self) -> "FingerprintPool":
+        return self
+
+    def __exit__(self, *_args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.pool.close()
+
+    def imap(
+        self,
+        batches: Iterable[T],
+        fingerprint_batch: Callable[[list], npt.NDArray[np.uint64]] = get_line_fingerprints,
+        get_lines: Optional[Callable[[T], list]] = None,
+    ) -> Generator[tuple[T, npt.NDArray[np.uint64]], None, None]:
+        """
+        Yields each batch with its fingerprints from `fingerprint_batch`, which must be a
+        module level function so that it can be sent to the workers. Use `get_lines` to send
+        only part of a batch to the workers, e.g. when the batch also holds state for the caller.
+        """
+        get_lines = get_lines or (lambda batch: batch)
+        # The results are in the order of the batches, so the batches are kept in the same order
+        # as they're sent to the pool.
+        pending: deque[T] = deque()
+
+        def send_lines() -> Generator[list, None, None]:
+            for batch in batches:
+                pending.append(batch)
+                yield get_lines(batch)
+
+        for fingerprints in self.pool.imap(fingerprint_batch, send_lines()):
+            yield pending.popleft(), fingerprints
+
+
+def _deduplicate_partition(fingerprint_queue: Queue, result_queue: Queue) -> None:
+    """
+    The worker of a partition of a PartitionedFingerprintSet. It adds each batch of fingerprints
+    to its own table, and sends back which ones were new, until it receives None.
+    """
+    table = UInt64HashTable()
+    while (fingerprints := fingerprint_queue.get()) is not None:
+        result_queue.put(table.add_many(fingerprints))
+
+
+class PartitionedFingerprintSet:
+    """
+    De-duplicates fingerprints across a process per partition. The fingerprints are partitioned
+    by their value, so every occurrence of a fingerprint goes to the same partition, and each
+    partition only holds its own slice of the fingerprints in memory. The partitions add their
+    slice of each batch in the order of the batches, so the results are identical to adding
+    them to a single WeakStringSet: only the first occurrence of a fingerprint is new.
+
+    The queues are written by background threads, so the batches can be sent ahead of the
+    results being read without the processes blocking each other. The results that were never
+    read, e.g. when the caller stops early, are drained before the workers are joined, as a
+    worker can't exit until its results are read. On an error the workers are terminated.
+
+    Usage:
+        with PartitionedFingerprintSet(partitions=8) as fingerprints_seen:
+            for batch, is_new in fingerprints_seen.imap_add_fingerprints(
+                batches, get_fingerprints=lambda batch: batch.fingerprints
+            ):
+                ...
+    """
+
+    def __init__(self, partitions: int = -1) -> None:
+        # Match the zstd convention, where -1 means one process per logical CPU.
+        self.partitions = os.cpu_count() or 1 if partitions < 0 else partitions
+        self.count = 0
+        # How many batches were sent to the partitions without their results being read.
+        self.batches_in_flight = 0
+        self.fingerprint_queues: list[Queue] = []
+        self.result_queues: list[Queue] = []
+        self.processes: list[Process] = []
+        for _ in range(self.partitions):
+            fingerprint_queue, result_queue = Queue(), Queue()
+            process = Process(
+                target=_deduplicate_partition, args=(fingerprint_queue, result_queue), daemon=True
+            )
+            process.start()
+            self.fingerprint_queues.append(fingerprint_queue)
+            self.result_queues.append(result_queue)
+            self.processes.append(process)
+
+    def __enter__(self) -> "PartitionedFingerprintSet":
+        return self
+
+    def __exit__(self, exc_type, _exc_value, _traceback) -> None:
+        if exc_type:
+            self.terminate()
+        else:
+            self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self) -> None:
+        for fingerprint_queue in self.fingerprint_queues:
+            fingerprint_queue.put(None)
+        # Drain the unread results, so the workers can flush their queues and exit.
+        for _ in range(self.batches_in_flight):
+            for result_queue in self.result_queues:
+                result_queue.get()
+        self.batches_in_flight = 0
+        for process in self.processes:
+            process.join()
+        self.processes = []
+
+    def terminate(self) -> None:
+        """Stop the workers without waiting for the batches in flight, e.g. after an error."""
+        for fingerprint_queue in self.fingerprint_queues:
+            # Don't wait on exit for the batches that the workers will never read.
+            fingerprint_queue.cancel_join_thread()
+        for process in self.processes:
+            process.terminate()
+            process.join()
+        self.batches_in_flight = 0
+        self.processes = []
+
+    def _send(
+        self, fingerprints: npt.NDArray[np.uint64]
+    ) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+        """
+        Send the slice of a batch to each partition. Returns the order of the fingerprints by
+        partition, and the bounds of each partition in that order.
+        """
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        # The hash table slots use the low bits, so partition on the high bits. The ids are
+        # narrowed to the smallest type, which numpy sorts with a radix sort.
+        partition_ids = ((fingerprints >> np.uint64(32)) % np.uint64(self.partitions)).astype(
+            np.min_scalar_type(self.partitions - 1)
+        )
+        # A stable sort keeps the fingerprints of a partition in the order of the batch.
+        order = np.argsort(partition_ids, kind="stable")
+        bounds = np.searchsorted(partition_ids[order], np.arange(self.partitions + 1))
+        for partition, fingerprint_queue in enumerate(self.fingerprint_queues):
+            fingerprint_queue.put(fingerprints[order[bounds[partition] : bounds[partition + 1]]])
+        self.batches_in_flight += 1
+        return order, bounds
+
+    def _receive(
+        self, order: npt.NDArray[np.int64], bounds: npt.NDArray[np.int64]
+    ) -> npt.NDArray[np.bool_]:
+        is_new = np.empty(len(order), dtype=bool)
+        for partition, result_queue in enumerate(self.result_queues):
+            is_new[order[bounds[partition] : bounds[partition + 1]]] = result_queue.get()
+        self.batches_in_flight -= 1
+        self.count += int(is_new.sum())
+        return is_new
+
+    def add_fingerprints(self, fingerprints: npt.NDArray[np.uint64]) -> npt.NDArray[np.bool_]:
+        """
+        Add a batch of fingerprints. Returns a mask of the fingerprints that weren't already in
+        the set, like WeakStringSet.add_fingerprints.
+        """
+        return self._receive(*self._send(fingerprints))
+
+    def imap_add_fingerprints(
+        self,
+        batches: Iterable[T],
+        get_fingerprints: Callable[[T], npt.NDArray[np.uint64]],
+    ) -> Generator[tuple[T, npt.NDArray[np.bool_]], None, None]:
+        """
+        Add the fingerprints of each batch, and yield the batch with the mask of its new
+        fingerprints. The next batches are sent while the caller handles a batch, so that the
+        partitions keep working. When the caller stops early, the batches that were sent ahead
+        are still added to the set.
+        """
+        pending: deque[tuple[T, tuple]] = deque()
+        try:
+            for batch in batches:
+                pending.append((batch, self._send(get_fingerprints(batch))))
+                if len(pending) >= 2:
+                    done_batch, sent = pending.popleft()
+                    yield done_batch, self._receive(*sent)
+
+            while pending:
+                done_batch, sent = pending.popleft()
+                yield done_batch, self._receive(*sent)
+        except GeneratorExit:
+            if self.processes:
+                # Read the results of the batches that were sent ahead, so that the results of
+                # any later batches aren't out of step with them.
+                for _, sent in pending:
+                    self._receive(*sent)
+            raise
+
+
+class FingerprintIndexWriter:
+    """
+    Writes the fingerprints of lines to a fingerprint index. The fingerprints are appended to a
+    temporary file as the lines are added, and are sorted and de-duplicated when the writer is
+    closed. Sorting needs 8 bytes of memory per line.
+
+    Usage:
+        with FingerprintIndexWriter(Path("corpus.en.hashes")) as index_writer:
+            for line in lines:
+                index_writer.add(line)
+    """
+
+    batch_size = 1_000_000
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.batch: list[int] = []
+        self.unsorted_file = tempfile.TemporaryFile(dir=path.parent, prefix=f"{path.name}.")
+
+    def __enter__(self) -> "FingerprintIndexWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type:
+            # Don't leave an incomplete index behind.
+            self.unsorted_file.close()
+        else:
+            self.close()
+
+    def add(self, line: str) -> None:
+        self.batch.append(get_line_fingerprint(line))
+        if len(self.batch) >= self.batch_size:
+            self._flush()
+
+    def add_fingerprints(self, fingerprints: npt.NDArray[np.uint64]) -> None:
+        """Add the fingerprints from `get_line_fingerprints`, for when they were computed."""
+        self._flush()
+        np.asarray(fingerprints, dtype=FINGERPRINT_DTYPE).tofile(self.unsorted_file)
+
+    def _flush(self) -> None:
+        np.array(self.batch, dtype=FINGERPRINT_DTYPE).tofile(self.unsorted_file)
+        self.batch.clear()
+
+    def close(self) -> None:
+        self._flush()
+        self.unsorted_file.seek(0)
+        fingerprints = np.fromfile(self.unsorted_file, dtype=FINGERPRINT_DTYPE)
+        self.unsorted_file.close()
+        fingerprints.sort()
+
+        with open(self.path, "wb") as outfile:
+            # De-duplicate and write the fingerprints in chunks, so that they aren't all copied
+            # at once. The repeated fingerprints are next to each other once sorted.
+            previous = None
+            for start in range(0, len(fingerprints), WRITE_CHUNK_SIZE):
+                chunk = fingerprints[start : start + WRITE_CHUNK_SIZE]
+                is_unique = np.empty(len(chunk), dtype=bool)
+                is_unique[0] = previous is None or chunk[0] != previous
+                np.not_equal(chunk[1:], chunk[:-1], out=is_unique[1:])
+                chunk[is_unique].tofile(outfile)
+                previous = chunk[-1]
+
+
+class FingerprintIndex:
+    """
+    Looks up lines in a fingerprint index written by FingerprintIndexWriter.
+
+    Usage:
+        parallel_index = FingerprintIndex(Path("corpus.en.hashes"))
+        assert "A line from the corpus" in parallel_index
+        is_in_corpus = parallel_index.contains_many(["A line", "Another line"])
+    """
+
+    def __init__(self, path: Path) -> None:
+        size = os.path.getsize(path)
+        if size % FINGERPRINT_DTYPE.itemsize:
+            raise ValueError(
+                f"The fingerprint index is not a whole number of fingerprints: {path}"
+            )
+
+        if size:
+            self.fingerprints = np.memmap(path, dtype=FINGERPRINT_DTYPE, mode="r")
+        else:
+            # An empty file can't be memory-mapped.
+            self.fingerprints = np.empty(0, dtype=FINGERPRINT_DTYPE)
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    def __contains__(self, line: str) -> bool:
+        return bool(self.contains_fingerprints(get_line_fingerprints([line]))[0])
+
+    def contains_many(self, lines: Iterable[str]) -> npt.NDArray[np.bool_]:
+        """Returns a mask of the lines that are in the index."""
+        return self.contains_fingerprints(get_line_fingerprints(lines))
+
+    def contains_fingerprints(self, fingerprints: npt.NDArray[np.uint64]) -> npt.NDArray[np.bool_]:
+        """Returns a mask of the fingerprints that are in the index."""
+        indexes = np.searchsorted(self.fingerprints, fingerprints)
+        found = indexes < len(self.fingerprints)
+        found[found] = self.fingerprints[indexes[found]] == fingerprints[found]
+        return found
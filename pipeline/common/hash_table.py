@@ -0,0 +1,211 @@
+"""
+A compact hash set of uint64 fingerprints, for de-duplicating hundreds of millions of lines.
+
+A Python set[int] costs 60-70 bytes per entry, as each hash is a separate int object, and the
+set stores a pointer and the hash for each slot. This table stores the fingerprints directly
+in a NumPy array, which costs 8 bytes per slot. With a load factor between 0.35 and 0.7 this is
+11-23 bytes per entry.
+"""
+
+from typing import Iterable
+
+import numpy as np
+import numpy.typing as npt
+
+# The slots with this value are empty. A fingerprint of 0 is stored as 1 instead.
+EMPTY = 0
+
+# How many slots of the old table are re-inserted at a time when the table grows.
+RESIZE_CHUNK_SLOTS = 1 << 22
+
+
+class UInt64HashTable:
+    """
+    An open-addressing hash set of uint64 fingerprints that uses linear probing. The table
+    doubles in size when it is more than `max_load_factor` full.
+
+    Single values are added and looked up with Python ints through a memoryview, and batches
+    are added and looked up with vectorized NumPy operations.
+
+    Usage:
+        table = UInt64HashTable()
+        assert table.add(1234)
+        assert not table.add(1234)
+        assert 1234 in table
+        table.add_many(np.array([1, 2, 3], dtype=np.uint64))
+    """
+
+    max_load_factor = 0.7
+
+    def __init__(self, capacity: int = 1024) -> None:
+        # The capacity is a power of 2, so that the slot is the fingerprint masked.
+        capacity = max(1 << (max(capacity, 1) - 1).bit_length(), 8)
+        self._allocate(capacity)
+        self.count = 0
+
+    def _allocate(self, capacity: int) -> None:
+        # np.zeros doesn't touch the memory until it's written to.
+        self.table = np.zeros(capacity, dtype=np.uint64)
+        # Indexing a memoryview returns a Python int, which is much faster than a NumPy scalar.
+        self.slots = memoryview(self.table)
+        self.mask = capacity - 1
+        self.max_count = int(capacity * self.max_load_factor)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.table)
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, fingerprint: int) -> bool:
+        fingerprint = fingerprint or 1
+        slots = self.slots
+        mask = self.mask
+        slot = fingerprint & mask
+        while True:
+            value = slots[slot]
+            if value == fingerprint:
+                return True
+            if value == EMPTY:
+                return False
+            slot = (slot + 1) & mask
+
+    def add(self, fingerprint: int) -> bool:
+        """Add a fingerprint, and return True if it wasn't already in the table."""
+        fingerprint = fingerprint or 1
+        slots = self.slots
+        mask = self.mask
+        slot = fingerprint & mask
+        while True:
+            value = slots[slot]
+            if value == fingerprint:
+                return False
+            if value == EMPTY:
+                slots[slot] = fingerprint
+                self.count += 1
+                if self.count > self.max_count:
+                    self._resize(self.capacity * 2)
+                return True
+            slot = (slot + 1) & mask
+
+    def discard(self, fingerprint: int) -> bool:
+        """Remove a fingerprint, and return True if it was in the table."""
+        fingerprint = fingerprint or 1
+        slots = self.slots
+        mask = self.mask
+        slot = fingerprint & mask
+        while True:
+            value = slots[slot]
+            if value == EMPTY:
+                return False
+            if value == fingerprint:
+                break
+            slot = (slot + 1) & mask
+
+        # Shift the following values back, so that no value is separated from its home slot
+        # by an empty slot.
+        empty_slot = slot
+        while True:
+            slot = (slot + 1) & mask
+            value = slots[slot]
+            if value == EMPTY:
+                break
+            home_slot = value & mask
+            # Only move the value if its home slot isn't between the empty slot and the slot.
+            if (slot - home_slot) & mask >= (slot - empty_slot) & mask:
+                slots[empty_slot] = value
+                empty_slot = slot
+        slots[empty_slot] = EMPTY
+        self.count -= 1
+        return True
+
+    def add_many(self, fingerprints: npt.NDArray[np.uint64]) -> npt.NDArray[np.bool_]:
+        """
+        Add a batch of fingerprints. Returns a mask of the fingerprints that weren't already in
+        the table. Only the first of any fingerprints repeated in the batch is marked as added.
+        """
+        fingerprints = self._prepare(fingerprints)
+        added = np.zeros(len(fingerprints), dtype=bool)
+        if not len(fingerprints):
+            return added
+
+        # Sort the fingerprints by their slot, which makes the table accesses more sequential,
+        # and find the repeated fingerprints so that they are only inserted once. Rotating the
+        # slot bits to the top of the fingerprints sorts them by slot, and keeps them unique.
+        slot_bits = self.mask.bit_length()
+        rotated = (fingerprints >> np.uint64(slot_bits)) | (
+            fingerprints << np.uint64(64 - slot_bits)
+        )
+        unique_rotated, first_indexes = np.unique(rotated, return_index=True)
+        unique_fingerprints = (unique_rotated << np.uint64(slot_bits)) | (
+            unique_rotated >> np.uint64(64 - slot_bits)
+        )
+
+        while self.count + len(unique_fingerprints) > self.max_count:
+            self._resize(self.capacity * 2)
+
+        is_new = self._insert(unique_fingerprints)
+        added[first_indexes[is_new]] = True
+        self.count += int(is_new.sum())
+        return added
+
+    def contains_many(self, fingerprints: npt.NDArray[np.uint64]) -> npt.NDArray[np.bool_]:
+        """Returns a mask of the fingerprints that are in the table."""
+        fingerprints = self._prepare(fingerprints)
+        found = np.zeros(len(fingerprints), dtype=bool)
+        pending = np.arange(len(fingerprints))
+        slots = fingerprints & np.uint64(self.mask)
+        while len(pending):
+            values = self.table[slots[pending]]
+            is_match = values == fingerprints[pending]
+            found[pending[is_match]] = True
+            # Keep probing the fingerprints that landed on another value.
+            pending = pending[~is_match & (values != EMPTY)]
+            slots[pending] = (slots[pending] + np.uint64(1)) & np.uint64(self.mask)
+        return found
+
+    def _prepare(self, fingerprints: Iterable[int]) -> npt.NDArray[np.uint64]:
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        return np.where(fingerprints == EMPTY, np.uint64(1), fingerprints)
+
+    def _insert(self, fingerprints: npt.NDArray[np.uint64]) -> npt.NDArray[np.bool_]:
+        """
+        Insert unique fingerprints with vectorized linear probing, and return a mask of the
+        ones that weren't already in the table. The table must have room for all of them.
+        """
+        mask = np.uint64(self.mask)
+        is_new = np.zeros(len(fingerprints), dtype=bool)
+        slots = fingerprints & mask
+        pending = np.arange(len(fingerprints))
+        while len(pending):
+            values = self.table[slots[pending]]
+            is_match = values == fingerprints[pending]
+
+            # Several fingerprints can probe the same empty slot, and only one of the writes
+            # wins. The others will see the claimed slot on the next iteration.
+            is_empty = values == EMPTY
+            empty = pending[is_empty]
+            self.table[slots[empty]] = fingerprints[empty]
+            is_claimed = self.table[slots[empty]] == fingerprints[empty]
+            is_new[empty[is_claimed]] = True
+
+            is_done = is_match
+            is_done[np.flatnonzero(is_empty)[is_claimed]] = True
+            # Move the fingerprints that landed on another value to the next slot.
+            is_occupied = ~is_done & (values != EMPTY)
+            slots[pending[is_occupied]] = (slots[pending[is_occupied]] + np.uint64(1)) & mask
+            pending = pending[~is_done]
+        return is_new
+
+    def _resize(self, capacity: int) -> None:
+        old_table = self.table
+        self._allocate(capacity)
+        # Re-insert the fingerprints in chunks, so that they aren't all copied at once.
+        for start in range(0, len(old_table), RESIZE_CHUNK_SLOTS):
+            chunk = old_table[start : start + RESIZE_CHUNK_SLOTS]
+            self._insert(chunk[chunk != EMPTY])
@@ -0,0 +1,132 @@
+"""
+An ordered block-parallel map over streams of lines, to replace `parallel --pipe -k`.
+
+GNU parallel starts a new interpreter for every block, so each block pays for the imports, and
+for loading any models or tokenizers again. A BlockPool keeps the same worker processes for
+every block, and its initializer loads the models once per worker. The results are yielded in
+the order of the blocks, and only `processes * 2` blocks are in flight, so a slow consumer holds
+back the reading rather than the whole stream being buffered in memory. An error in a worker is
+raised in the caller, and the pending blocks are cancelled.
+
+The workers are forked, so anything that is loaded before the pool is created is shared with
+them copy-on-write, rather than being pickled.
+
+Usage:
+    with BlockPool(processes=-1, initializer=load_tokenizer, initargs=("en",)) as pool:
+        for tokenized_lines in pool.imap_lines(tokenize_lines, read_lines(path)):
+            outfile.writelines(tokenized_lines)
+"""
+
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from multiprocessing import get_context
+from typing import Any, Callable, Generator, Iterable, Optional, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# The size of a block in characters, or in bytes for binary lines, like `--block` of GNU parallel.
+BLOCK_SIZE = 1 << 20
+
+
+def get_line_size(line: Any) -> int:
+    """The size of a line, or the sum of the sizes of a tuple of lines, e.g. from `zip`."""
+    if isinstance(line, tuple):
+        return sum(len(item) for item in line)
+    return len(line)
+
+
+def read_blocks(
+    lines: Iterable[T], block_size: int = BLOCK_SIZE, max_lines: Optional[int] = None
+) -> Generator[list[T], None, None]:
+    """
+    Split a stream of lines into blocks of whole lines, which are about `block_size` characters,
+    and have at most `max_lines` lines. A line that is longer than a block is a block on its own.
+    """
+    lines = iter(lines)
+    while True:
+        block = []
+        size = 0
+        for line in islice(lines, max_lines):
+            block.append(line)
+            size += get_line_size(line)
+            if size >= block_size:
+                break
+        if not block:
+            return
+        yield block
+
+
+class BlockPool:
+    """
+    A persistent pool of processes that maps a function over blocks of lines, and yields the
+    results in order. The function must be defined at the module level so that it can be sent
+    to the workers, e.g. a `functools.partial` of a module function.
+
+    With a single process, the blocks are mapped in this process, which saves sending them to
+    another process, and the initializer is called in this process.
+    """
+
+    def __init__(
+        self,
+        processes: int = -1,
+        initializer: Optional[Callable[..., None]] = None,
+        initargs: tuple = (),
+    ) -> None:
+        # Match the zstd convention, where -1 means one process per logical CPU.
+        self.processes = os.cpu_count() or 1 if processes < 0 else processes
+        self.executor = None
+        if self.processes > 1:
+            self.executor = ProcessPoolExecutor(
+                self.processes,
+                mp_context=get_context("fork"),
+                initializer=initializer,
+                initargs=initargs,
+            )
+        elif initializer:
+            initializer(*initargs)
+
+    def __enter__(self) -> "BlockPool":
+        return self
+
+    def __exit__(self, *_args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.executor:
+            self.executor.shutdown(cancel_futures=True)
+
+    def imap(self, func: Callable[[T], R], blocks: Iterable[T]) -> Generator[R, None, None]:
+        """
+        Yield the result of `func` for each block, in the order of the blocks. The blocks are
+        only read while fewer than `processes * 2` of them are in flight.
+        """
+        if not self.executor:
+            for block in blocks:
+                yield func(block)
+            return
+
+        pending: deque[Future] = deque()
+        try:
+            for block in blocks:
+                pending.append(self.executor.submit(func, block))
+                if len(pending) >= self.processes * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # Don't map the rest of the blocks after an error, or when the caller stops early.
+            for future in pending:
+                future.cancel()
+
+    def imap_lines(
+        self,
+        func: Callable[[list[T]], R],
+        lines: Iterable[T],
+        block_size: int = BLOCK_SIZE,
+        max_lines: Optional[int] = None,
+    ) -> Generator[R, None, None]:
+        """Split the lines into blocks with `read_blocks`, and yield the result of each block."""
+        return self.imap(func, read_blocks(lines, block_size, max_lines))
@@ -69,6 +69,25 @@ def main(args_list: Optional[list[str]] = None) -> None:
         "0 - preserve original lines of HPLT dataset",
         default=0,
     )
+    parser.add_argument(
+        "--hplt_dedup",
+        choices=["exact", "approximate"],
+        default="exact",
+        help="How to de-duplicate the HPLT lines. The approximate de-duplication uses a Bloom "
+        "filter with a fixed amount of memory, but drops a few unique lines as false positives.",
+    )
+    parser.add_argument(
+        "--hplt_dedup_false_positive_rate",
+        type=float,
+        default=0.001,
+        help="The target rate of unique lines dropped by the approximate de-duplication.",
+    )
+    parser.add_argument(
+        "--hplt_dedup_max_megabytes",
+        type=int,
+        default=None,
+        help="The memory cap for the approximate de-duplication.",
+    )
     parser.add_argument(
         "--artifacts", type=Path, help="The location where the dataset will be saved"
     )
@@ -95,6 +114,13 @@ def main(args_list: Optional[list[str]] = None) -> None:
             max_characters=args.hlpt_max_characters,
             max_lines=args.max_sentences,
             file_destination=file_destination,
+            dedup=args.hplt_dedup,
+            dedup_false_positive_rate=args.hplt_dedup_false_positive_rate,
+            dedup_max_bytes=(
+                args.hplt_dedup_max_megabytes * 1_000_000
+                if args.hplt_dedup_max_megabytes
+                else None
+            ),
         )
 
         return
@@ -18,6 +18,9 @@ from pipeline.common.logging import get_logger
 
 logger = get_logger(__file__)
 
+# Download the files in parallel byte ranges when the server supports it.
+DOWNLOAD_CONNECTIONS = 4
+
 
 def main() -> None:
     parser = argparse.ArgumentParser(
@@ -42,8 +45,8 @@ def main() -> None:
     logger.info(f"src_dest:      {src_dest}")
     logger.info(f"trg_dest:      {trg_dest}")
 
-    stream_download_to_file(src_file, src_dest)
-    stream_download_to_file(trg_file, trg_dest)
+    stream_download_to_file(src_file, src_dest, connections=DOWNLOAD_CONNECTIONS)
+    stream_download_to_file(trg_file, trg_dest, connections=DOWNLOAD_CONNECTIONS)
 
 
 if __name__ == "__main__":
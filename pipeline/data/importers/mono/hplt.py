@@ -3,8 +3,11 @@ import random
 from contextlib import ExitStack
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 
 from pipeline.common.datasets import (
+    ApproximateDeduplicationStep,
+    ApproximateStringSet,
     CountingStep,
     FilteringStep,
     Statistics,
@@ -71,6 +74,13 @@ class FilteringStatistics(Statistics):
             "How many lines were actually written.",
         )
 
+    def add_approximate_deduplication(
+        self, strings_seen: ApproximateStringSet
+    ) -> ApproximateDeduplicationStep:
+        # This is only reported when the lines are de-duplicated approximately.
+        self.approximate_deduplication = ApproximateDeduplicationStep(strings_seen)
+        return self.approximate_deduplication
+
     def count_shards_visited(self, *_args):
         self.shards.filtered -= 1
         self.shards.kept += 1
@@ -117,6 +127,9 @@ def download_hplt(
     max_characters: int,
     max_lines: int,
     file_destination: Path,
+    dedup: str = "exact",
+    dedup_false_positive_rate: float = 0.001,
+    dedup_max_bytes: Optional[int] = None,
 ):
     """
     Downloads and filters the HPLT dataset.
@@ -132,6 +145,10 @@ def download_hplt(
      - max_characters: The maximum number of characters to merge sentences in the document before writing. 0 - preserve the lines as in the dataset
      - max_lines: The maximum number of lines to include in the final dataset.
      - file_destination: The destination path where the final dataset will be written.
+     - dedup: "exact" or "approximate". The approximate de-duplication uses a Bloom filter
+       with a fixed amount of memory, but drops a few unique lines as false positives.
+     - dedup_false_positive_rate: The target false positive rate of the approximate dedup.
+     - dedup_max_bytes: The memory cap of the approximate dedup.
     """
 
     with ExitStack() as stack:
@@ -152,7 +169,16 @@ def download_hplt(
             read_lines(shuffled_shard_urls, on_enter_location=stats.count_shards_visited)
         )
 
-        strings_seen = WeakStringSet()
+        if dedup == "approximate":
+            # At most max_lines are kept, so this is the capacity of the filter.
+            strings_seen = ApproximateStringSet(
+                capacity=max_lines,
+                false_positive_rate=dedup_false_positive_rate,
+                max_bytes=dedup_max_bytes,
+            )
+            stats.add_approximate_deduplication(strings_seen)
+        else:
+            strings_seen = WeakStringSet()
         accumulated_text: str = ""
         cumulative_char_count = 0
         visited_lines = 0
@@ -167,12 +193,11 @@ def download_hplt(
             nonlocal cumulative_char_count
             cumulative_char_count = 0
             if accumulated_text:
-                if accumulated_text in strings_seen:
+                if not strings_seen.add(accumulated_text):
                     stats.duplicate_lines.value += 1
                 else:
                     outfile.write(accumulated_text + "\n")
                     stats.final_lines.value += 1
-                    strings_seen.add(accumulated_text)
                 accumulated_text = ""
 
         for document_json in document_stream:
@@ -226,6 +251,8 @@ def download_hplt(
             maybe_write_accumulated_text()
 
         stats.visited_lines.filtered = visited_lines - stats.visited_lines.kept
+        if dedup == "approximate":
+            stats.approximate_deduplication.dropped_as_duplicates = stats.duplicate_lines.value
         logger.info(f"Wrote {stats.final_lines.value:,} lines to: {file_destination}")
         stat_path = stats.save_json()
         logger.info(f"Saved filtering stats to: {stat_path}")
@@ -98,8 +98,9 @@ def build_dataset_tsv(
         if alignments_file:
             logger.info(f"Using alignments file: {alignments_file}")
 
-            aln_lines: Generator[str, Any, Any] = stack.enter_context(
-                read_lines(f"{alignments_file}")
+            # The alignments are ASCII and are only copied, so don't decode them.
+            aln_lines: Generator[bytes, Any, Any] = stack.enter_context(
+                read_lines(f"{alignments_file}", binary=True)
             )
             empty_alignments = []
 
@@ -107,7 +108,9 @@ def build_dataset_tsv(
                 if not aln_line:
                     empty_alignments.append((src_line, trg_line))
                     continue
-                tsv_outfile.write(f"{src_line.strip()}\t{trg_line.strip()}\t{aln_line.strip()}\n")
+                tsv_outfile.write(
+                    f"{src_line.strip()}\t{trg_line.strip()}\t{aln_line.strip().decode()}\n"
+                )
 
             if empty_alignments:
                 logger.info(f"Number of empty alignments for {len(alignments_file)}")
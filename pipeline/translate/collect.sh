@@ -43,8 +43,17 @@ find "${chunks_dir}" -name '*.out' |  # For example, finds "fetches/file.1.out",
 
 echo "### Comparing number of sentences in source and artificial target files"
 
-src_len=$(zstdmt -dc "${mono_path}" | wc -l)
-trg_len=$(zstdmt -dc "${output_path}" | wc -l)
+export PYTHONPATH="${PYTHONPATH:-}:$(realpath "$(dirname "${BASH_SOURCE[0]}")/../..")"
+
+count_lines() {
+  # The count is read from the frame index of a seekable zstd file, e.g. the merged mono data.
+  # This needs the requirements in pipeline/translate/requirements/splitter.txt.
+  python3 -c 'import sys; from pipeline.common.downloads import count_lines; print(count_lines(sys.argv[1]))' "$1"
+}
+
+# Both files are counted the same way, so a final line without a newline is counted in both.
+src_len=$(count_lines "${mono_path}")
+trg_len=$(count_lines "${output_path}")
 
 if [ "${src_len}" != "${trg_len}" ]; then
   echo "### Error: length of ${mono_path} ${src_len} is different from ${output_path} ${trg_len}"
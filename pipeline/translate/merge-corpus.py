@@ -0,0 +1,236 @@
+"""
+Merges the original parallel corpus with the translated monolingual data into a single shuffled
+and de-duplicated corpus, e.g. for the teacher's translations of mono.en.zst:
+
+  corpus.en.zst  mono.en.zst
+  corpus.ru.zst  mono.ru.zst
+
+  Gets merged into:
+
+  artifacts/corpus.en.zst
+  artifacts/corpus.ru.zst
+
+The datasets are streamed once. The sentence pairs are de-duplicated as they are read, then
+shuffled in zstd compressed buckets on disk, and both sides are written at the same time. The
+outputs are seekable zstd files, whose indexes record how many lines were written, so they don't
+need to be re-read to check that the sides have the same length.
+"""
+
+import argparse
+import math
+from itertools import zip_longest
+from pathlib import Path
+from typing import Generator
+
+from pipeline.common.datasets import (
+    FilteringStep,
+    Statistics,
+    WeakStringSet,
+    shuffle_lines_on_disk,
+)
+from pipeline.common.downloads import (
+    count_lines,
+    format_bytes,
+    get_human_readable_file_size,
+    read_lines,
+    write_lines,
+)
+from pipeline.common.fingerprint_index import FingerprintPool, batch_lines
+from pipeline.common.logging import get_logger
+
+logger = get_logger(__file__)
+
+# Text usually compresses 3-5 times with zstd. The upper end is assumed when sizing the buckets
+# of the shuffle on disk.
+MAX_COMPRESSION_RATIO = 5
+
+
+class FilteringStatistics(Statistics):
+    """
+    Gather statistics about the filtering process.
+    """
+
+    def __init__(self, dataset_path: Path) -> None:
+        super().__init__(dataset_path)
+        self.merged_corpus = FilteringStep(
+            "The parallel corpus and the translated monolingual data are merged and deduplicated"
+        )
+        self.lines_with_tabs = FilteringStep(
+            "Sentence pairs are removed when a line contains a tab, as they can't be shuffled"
+        )
+
+
+def deduplicate_pairs(
+    src_lines: Generator[str, None, None],
+    trg_lines: Generator[str, None, None],
+    pool: FingerprintPool,
+    stats: FilteringStatistics,
+) -> Generator[str, None, None]:
+    """
+    Yield the unique sentence pairs as "src\\ttrg\\n" lines, keeping the first occurrence of a
+    pair. The fingerprints of the pairs are computed on all of the cores by the pool, and only
+    the fingerprints are held in memory.
+    """
+    pairs_seen = WeakStringSet()
+
+    def read_pairs() -> Generator[tuple[str, str], None, None]:
+        for src_line, trg_line in zip_longest(src_lines, trg_lines):
+            if src_line is None or trg_line is None:
+                raise ValueError("The source and target datasets have different lengths")
+            yield src_line, trg_line
+
+    for batch, fingerprints in pool.imap(
+        batch_lines(read_pairs()),
+        # No separator is needed as the newline is included.
+        get_lines=lambda batch: [src_line + trg_line for src_line, trg_line in batch],
+    ):
+        is_new = pairs_seen.add_fingerprints(fingerprints)
+        stats.merged_corpus.kept += int(is_new.sum())
+        stats.merged_corpus.filtered += len(batch) - int(is_new.sum())
+        for (src_line, trg_line), keep in zip(batch, is_new):
+            if not keep:
+                continue
+            # The pairs are shuffled as single lines, joined by a tab.
+            if "\t" in src_line or "\t" in trg_line:
+                logger.error("A line contained a tab character, skipping:")
+                logger.error(f" src: {src_line}")
+                logger.error(f" trg: {trg_line}")
+                stats.lines_with_tabs.filtered += 1
+                continue
+            stats.lines_with_tabs.kept += 1
+            # The final line of a dataset may not have a newline.
+            src_text = src_line.removesuffix("\n")
+            trg_text = trg_line.removesuffix("\n")
+            yield f"{src_text}\t{trg_text}\n"
+
+
+def merge_corpus(
+    src_datasets: list[str],
+    trg_datasets: list[str],
+    src_output: Path,
+    trg_output: Path,
+    seed: str,
+    bucket_bytes: int,
+    processes: int,
+) -> None:
+    stats = FilteringStatistics(src_output.parent / "corpus")
+
+    dataset_bytes = 0
+    logger.info("Datasets:")
+    for path in src_datasets + trg_datasets:
+        formatted_size, size = get_human_readable_file_size(path)
+        logger.info(f" - {path} ({formatted_size})")
+        dataset_bytes += size
+
+    # Size the buckets for the uncompressed size of all of the pairs, before de-duplication.
+    bucket_count = max(1, math.ceil(dataset_bytes * MAX_COMPRESSION_RATIO / bucket_bytes))
+    logger.info(
+        f"Deduplicate the sentence pairs and shuffle them on disk in {bucket_count:,} buckets of "
+        f"up to {format_bytes(bucket_bytes)}"
+    )
+
+    with (
+        FingerprintPool(processes=processes) as pool,
+        read_lines(src_datasets) as src_lines,
+        read_lines(trg_datasets) as trg_lines,
+        # Both sides are compressed on all of the cores as they are written.
+        write_lines(src_output, compression_threads=-1, seekable=True) as src_outfile,
+        write_lines(trg_output, compression_threads=-1, seekable=True) as trg_outfile,
+    ):
+        line_count = 0
+        for line in shuffle_lines_on_disk(
+            deduplicate_pairs(src_lines, trg_lines, pool, stats),
+            seed=seed,
+            bucket_count=bucket_count,
+            bucket_dir=str(src_output.parent),
+            processes=processes,
+        ):
+            src_line, trg_line = line.split("\t")
+            src_outfile.write(src_line + "\n")
+            trg_outfile.write(trg_line)
+            line_count += 1
+            if line_count % 1_000_000 == 0:
+                logger.info(f"Wrote line {line_count:,}")
+
+    # The line counts are read from the indexes of the seekable files.
+    src_count = count_lines(src_output)
+    trg_count = count_lines(trg_output)
+    if not src_count == trg_count == line_count:
+        raise ValueError(
+            f"The merged corpus has mismatched lengths: {src_output} has {src_count:,} lines, "
+            f"{trg_output} has {trg_count:,} lines, and {line_count:,} pairs were written"
+        )
+
+    stats_path = stats.save_json()
+    logger.info(f"Saved the stats: {stats_path}")
+    logger.info(f"Merged {line_count:,} sentence pairs")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--src_datasets",
+        type=str,
+        nargs="+",
+        required=True,
+        help="The source side of the datasets, in order, e.g. corpus.en.zst mono.en.zst",
+    )
+    parser.add_argument(
+        "--trg_datasets",
+        type=str,
+        nargs="+",
+        required=True,
+        help="The target side of the datasets, in the same order, e.g. corpus.ru.zst mono.ru.zst",
+    )
+    parser.add_argument(
+        "--src_output",
+        type=Path,
+        required=True,
+        help="The merged source side, e.g. /builds/worker/artifacts/corpus.en.zst",
+    )
+    parser.add_argument(
+        "--trg_output",
+        type=Path,
+        required=True,
+        help="The merged target side, e.g. /builds/worker/artifacts/corpus.ru.zst",
+    )
+    parser.add_argument(
+        "--seed", type=str, default="42", help="The seed for shuffling the sentence pairs."
+    )
+    parser.add_argument(
+        "--bucket_megabytes",
+        type=int,
+        default=256,
+        help="The uncompressed size of a shuffle bucket. A bucket is shuffled in memory by each "
+        "process, which takes a few times its size.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=-1,
+        help="How many processes fingerprint and shuffle the sentence pairs. -1 uses a process "
+        "per logical CPU.",
+    )
+    args = parser.parse_args()
+
+    if len(args.src_datasets) != len(args.trg_datasets):
+        raise ValueError("There must be as many source datasets as target datasets.")
+
+    args.src_output.parent.mkdir(parents=True, exist_ok=True)
+    merge_corpus(
+        src_datasets=args.src_datasets,
+        trg_datasets=args.trg_datasets,
+        src_output=args.src_output,
+        trg_output=args.trg_output,
+        seed=args.seed,
+        bucket_bytes=args.bucket_megabytes * 1_000_000,
+        processes=args.processes,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -52,7 +52,8 @@ def split_file(mono_path: str, output_dir: str, num_parts: int, output_suffix: s
     line_count = 0
     file_index = 1
 
-    with read_lines(mono_path) as lines:
+    # The lines are only copied, so don't decode them.
+    with read_lines(mono_path, binary=True, decompression_threads=-1) as lines:
         with ExitStack() as chunk_stack:
             for line in lines:
                 if not line_writer or line_count >= lines_per_part:
@@ -62,7 +63,7 @@ def split_file(mono_path: str, output_dir: str, num_parts: int, output_suffix: s
 
                     chunk_name = f"{output_dir}/file.{file_index}{output_suffix}.zst"
                     logger.info(f"Writing to file chunk: {chunk_name}")
-                    line_writer = chunk_stack.enter_context(write_lines(chunk_name))
+                    line_writer = chunk_stack.enter_context(write_lines(chunk_name, binary=True))
                     file_index += 1
                     line_count = 0
 
@@ -0,0 +1,107 @@
+"""
+The tokenization and the remapping of the alignments are mapped over blocks of lines in a
+BlockPool. With several processes, the outputs must be the same as the serial path.
+"""
+
+import re
+from pathlib import Path
+from random import Random
+
+import pytest
+
+pytest.importorskip("tqdm")
+
+from pipeline.alignments.align import remap  # noqa: E402
+from pipeline.alignments.tokenizer import tokenize_moses  # noqa: E402
+
+SENTENCES = [
+    "The little girl, seeing she had lost one of her pretty shoes, grew angry!",
+    "“I will not,” retorted the Witch, “for it is now my shoe, and not yours.”",
+    "Instantly the wicked woman gave a loud cry of fear... and then (in wonder) she shrank.",
+    "It's 3.5 km away; isn't it?",
+]
+
+
+def generate_lines(count: int, seed: int) -> list[str]:
+    random = Random(seed)
+    return [
+        " ".join(random.choice(SENTENCES).split()[: random.randrange(1, 20)]) + "\n"
+        for _ in range(count)
+    ]
+
+
+def split_punctuation(line: str) -> str:
+    """A simple tokenization, which splits more tokens than the whitespace does."""
+    return " ".join(re.sub(r"([,.!?;:“”()])", r" \1 ", line).split()) + "\n"
+
+
+def generate_alignments(tok_src: str, tok_trg: str, random: Random) -> str:
+    src_count = len(tok_src.split())
+    trg_count = len(tok_trg.split())
+    pairs = {
+        (random.randrange(src_count), random.randrange(trg_count))
+        for _ in range(max(src_count, trg_count))
+    }
+    return " ".join(f"{src}-{trg}" for src, trg in sorted(pairs)) + "\n"
+
+
+@pytest.mark.parametrize("processes", [2, 3])
+def test_tokenize_moses_processes(tmp_path: Path, processes: int):
+    pytest.importorskip("mosestokenizer")
+    input_path = tmp_path / "corpus.en"
+    input_path.write_text("".join(generate_lines(1_000, seed=1)), encoding="utf-8")
+
+    serial_path = tmp_path / "serial.tok-moses.en"
+    parallel_path = tmp_path / "parallel.tok-moses.en"
+    # Small chunks, so the lines are split across many blocks.
+    tokenize_moses(str(input_path), str(serial_path), "en", sentences_per_chunk=7, processes=1)
+    tokenize_moses(
+        str(input_path), str(parallel_path), "en", sentences_per_chunk=7, processes=processes
+    )
+
+    serial_lines = serial_path.read_text(encoding="utf-8").splitlines()
+    assert len(serial_lines) == 1_000
+    # The punctuation was split into its own tokens.
+    assert any(" , " in line for line in serial_lines)
+    assert parallel_path.read_text(encoding="utf-8").splitlines() == serial_lines
+
+
+@pytest.mark.parametrize("processes", [2, 3])
+def test_remap_processes(tmp_path: Path, processes: int):
+    # More lines than a block of remap, so the lines are split across several blocks.
+    src_lines = generate_lines(25_000, seed=1)
+    trg_lines = generate_lines(25_000, seed=2)
+    tok_src_lines = [split_punctuation(line) for line in src_lines]
+    tok_trg_lines = [split_punctuation(line) for line in trg_lines]
+    random = Random(3)
+    aln_lines = [
+        generate_alignments(tok_src, tok_trg, random)
+        for tok_src, tok_trg in zip(tok_src_lines, tok_trg_lines)
+    ]
+
+    paths = {}
+    for name, lines in [
+        ("src", src_lines),
+        ("trg", trg_lines),
+        ("tok_src", tok_src_lines),
+        ("tok_trg", tok_trg_lines),
+        ("aln", aln_lines),
+    ]:
+        paths[name] = tmp_path / f"corpus.{name}"
+        paths[name].write_text("".join(lines), encoding="utf-8")
+
+    def run_remap(output_path: Path, remap_processes: int) -> list[str]:
+        remap(
+            str(paths["src"]),
+            str(paths["trg"]),
+            str(paths["tok_src"]),
+            str(paths["tok_trg"]),
+            str(paths["aln"]),
+            str(output_path),
+            processes=remap_processes,
+        )
+        return output_path.read_text(encoding="utf-8").splitlines()
+
+    serial_lines = run_remap(tmp_path / "serial.aln", 1)
+    assert len(serial_lines) == 25_000
+    assert run_remap(tmp_path / "parallel.aln", processes) == serial_lines
@@ -0,0 +1,178 @@
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+import zstandard
+
+from pipeline.clean.clean_corpus import (
+    CLEAN_DIR,
+    CleaningStatistics,
+    DetokenizeStage,
+    FixStage,
+    LangIdStage,
+    NormalizeStage,
+    WhitespaceStage,
+    clean_corpus,
+    get_stages,
+)
+from pipeline.clean.tools.langid_fasttext import LangIdCache
+from pipeline.common.datasets import Statistics
+from pipeline.common.downloads import read_lines
+
+src_lines = [
+    "The cat &amp; the dog.",
+    "Same line",
+    "\u200b  A   leading  space\r",
+    "12 34 56",
+    "A sentence with a zero width\u200bspace.",
+]
+
+trg_lines = [
+    "Кошка &amp; собака.",
+    "same LINE",
+    "  Ведущий   пробел",
+    "Это моё предложение.",
+    "Предложение с шириной ноль\x00в пробеле.",
+]
+
+
+def write_zst(path: Path, lines: list[str]) -> None:
+    path.write_bytes(zstandard.ZstdCompressor().compress(("\n".join(lines) + "\n").encode()))
+
+
+def test_normalize_and_whitespace():
+    # The escapes are replaced in order, so "&amp;lt;" becomes "&lt;".
+    assert NormalizeStage.normalize("&lt;b&gt; &amp;lt; &#124;") == "<b> &lt; |"
+    # The control and format characters are replaced with spaces, like \p{C} in Perl.
+    assert NormalizeStage.normalize("a\tb\rc\x00d\u200be\U000e0001f") == "a b c d e f"
+    assert NormalizeStage.normalize("é…") == "é…"
+    assert WhitespaceStage.squeeze(" \t  a  b　 c ") == "a b　 c "
+
+
+def test_clean_corpus(tmp_path: Path):
+    write_zst(tmp_path / "dataset.en.zst", src_lines)
+    write_zst(tmp_path / "dataset.ru.zst", trg_lines)
+    # The fastText model isn't available in the tests.
+    stages = [
+        stage
+        for stage in get_stages("en", "ru", "dataset", tmp_path / "lid.176.bin")
+        if not isinstance(stage, LangIdStage)
+    ]
+
+    clean_corpus(
+        input_prefix=str(tmp_path / "dataset"),
+        output_prefix=str(tmp_path / "artifacts/dataset"),
+        src="en",
+        trg="ru",
+        stages=stages,
+        processes=1,
+    )
+
+    with read_lines(tmp_path / "artifacts/dataset.en.zst") as lines:
+        assert list(lines) == [
+            "The cat & the dog.\n",
+            "A leading space \n",
+            "A sentence with a zero width space.\n",
+        ]
+    with read_lines(tmp_path / "artifacts/dataset.ru.zst") as lines:
+        assert list(lines) == [
+            "Кошка & собака.\n",
+            "Ведущий пробел\n",
+            "Предложение с шириной ноль в пробеле.\n",
+        ]
+    assert (tmp_path / "artifacts/dataset.enru.clean.debug.txt").read_text().splitlines() == [
+        "IDENTICAL\tSame line\tsame LINE",
+        "RATIO_ALPHA_SRC\t12 34 56\tЭто моё предложение.",
+    ]
+
+    stats = json.loads((tmp_path / "artifacts/dataset.enru.stats.json").read_text())
+    assert stats["rule_based_reasons"] == {"IDENTICAL": 1, "RATIO_ALPHA_SRC": 1}
+    assert {name: (step["kept"], step["filtered"]) for name, step in stats["stages"].items()} == {
+        "normalize": (5, 0),
+        "rule_based": (3, 2),
+        "whitespace": (3, 0),
+    }
+
+
+def test_get_stages_fixes():
+    def get_fix_stages(dataset: str, src: str, trg: str) -> list:
+        stages = get_stages(src, trg, dataset, Path("lid.176.bin"))
+        return [stage for stage in stages if "fixes" in stage.name]
+
+    # The bilingual fixes that only run fixes/detok.sh are detokenized in-process.
+    for dataset in ["mtdata_OPUS_SETIMES_v2", "mtdata_JW300", "mtdata_OPUS_ECB_v1"]:
+        [stage] = get_fix_stages(dataset, "en", "ro")
+        assert isinstance(stage, DetokenizeStage)
+        assert stage.name == "bilingual_fixes"
+
+    # The sed fixes are still run as scripts.
+    [stage] = get_fix_stages("mtdata_OPUS_UNPC_v1_0", "en", "fr")
+    assert isinstance(stage, FixStage)
+    assert stage.name == "monolingual_fixes"
+    assert stage.src_fix and stage.trg_fix
+
+
+def test_detokenize_stage():
+    pytest.importorskip("sacremoses")
+    pairs = [
+        ("Hello , world !", "Bonjour , le monde !"),
+        ("The cat &amp; the dog 's toy .", "Le chat &amp; le chien ."),
+        ("  a   b  ", "c\td"),
+        ('" Quote " here .', "( paren ) ok"),
+    ]
+    expected = [
+        ("Hello, world!", "Bonjour, le monde !"),
+        ("The cat & the dog's toy.", "Le chat & le chien."),
+        ("a b", "c"),
+        ('"Quote" here.', "(paren) ok"),
+    ]
+    assert DetokenizeStage("en", "fr", Path("detok.sh")).clean(pairs, []) == expected
+
+    if shutil.which("sacremoses"):
+        # The same lines as running the script.
+        script_stage = FixStage(pair_fix=[str(CLEAN_DIR / "fixes/detok.sh"), "en", "fr", "1"])
+        assert script_stage.clean(pairs, []) == expected
+
+
+def test_langid_stage():
+    class FakeModel:
+        def predict(self, texts):
+            labels = [("__label__ru",) if "Привет" in text else ("__label__en",) for text in texts]
+            return labels, [(1.0,) for _ in texts]
+
+    stage = LangIdStage("en", "ru", Path("lid.176.bin"))
+    stage.model = FakeModel()
+    pairs = [("Hello", "Привет"), ("Привет", "Привет"), ("Hello", "Hello")]
+    assert stage.clean(pairs, []) == [("Hello", "Привет")]
+    # The model isn't pickled to the processes that aren't forked.
+    assert stage.__getstate__()["model"] is None
+
+
+def test_langid_stage_cache(tmp_path: Path):
+    class FakeModel:
+        def __init__(self):
+            self.texts = 0
+
+        def predict(self, texts):
+            self.texts += len(texts)
+            labels = [("__label__ru",) if "Привет" in text else ("__label__en",) for text in texts]
+            return labels, [(1.0,) for _ in texts]
+
+    cache_path = tmp_path / "langid.cache"
+    pairs = [("Hello", "Привет"), ("Hello", "Hello"), ("Hello", "Привет")]
+    for expected_texts, expected_hits in ((6, 0), (0, 6)):
+        stage = LangIdStage("en", "ru", tmp_path / "lid.176.bin", cache_path)
+        stage.model = FakeModel()
+        stage.cache = LangIdCache.load(cache_path, b"0" * 32)
+        assert stage.clean(pairs, []) == [("Hello", "Привет"), ("Hello", "Привет")]
+        stage.add_results(stage.take_results())
+        stats = CleaningStatistics(tmp_path / "dataset.enru.zst", [stage])
+        stage.finish(stats)
+        assert stage.model.texts == expected_texts
+        assert Statistics.as_json(stats)["langid_cache"] == {
+            "path": str(cache_path),
+            "lookups": 6,
+            "hits": expected_hits,
+            "hit_rate": expected_hits / 6,
+        }
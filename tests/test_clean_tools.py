@@ -0,0 +1,163 @@
+import re
+import sys
+from pathlib import Path
+from random import Random
+
+import pytest
+
+from pipeline.clean.tools.clean_parallel import (
+    CHARS,
+    clean_batch,
+    clean_parallel,
+    get_alpha_char_count,
+    get_alpha_tables,
+    get_alpha_word_count,
+)
+from pipeline.clean.tools.langid_fasttext import (
+    LangIdCache,
+    get_model_path,
+    get_text_fingerprints,
+    label_lines,
+)
+
+# clean_mono.py imports clean_parallel.py from the tools directory.
+sys.path.append(str(Path(__file__).parent.parent / "pipeline/clean/tools"))
+import clean_mono  # noqa: E402
+
+
+def generate_text(random: Random, length: int) -> str:
+    # Mix in the characters that only match ignoring the case, e.g. the Kelvin sign "K" and the
+    # long s "ſ", and characters past the end of the lookup tables.
+    alphabet = "abcxyzABCXYZàÀéÉßẞçÇаяАЯёЁαΑςΣ K ſ İı 123,.!?-'\"中文😀"
+    return "".join(random.choice(alphabet) for _ in range(length))
+
+
+@pytest.mark.parametrize("lang", ["en", "ru", "fr", "de", "el", "bg"])
+def test_alpha_tables_match_regex(lang: str):
+    random = Random(lang)
+    alpha_chars, alpha_table = get_alpha_tables(lang)
+    for _ in range(1_000):
+        text = generate_text(random, random.randrange(1, 40))
+        tokens = text.split()
+        assert get_alpha_word_count(tokens, alpha_chars) == sum(
+            1 if re.match(CHARS[lang], token, re.IGNORECASE) else 0 for token in tokens
+        ), text
+        assert get_alpha_char_count(text, alpha_table) == len(
+            re.findall(CHARS[lang], text, re.IGNORECASE)
+        ), text
+
+
+def test_clean_batch():
+    pairs = [
+        ("Hello world", "hello WORLD"),
+        ("Hello", "Привет мир и все остальные"),
+        ("Hello world", "Привет мир"),
+        ("123 456 789", "Привет мир !"),
+        ("Hello world", "Hello 123 456"),
+        ("Hello there, the world", "Привет, 1,2,3,4,5,6,7,8 мир"),
+    ]
+    assert clean_batch(pairs, "en", "ru") == [
+        "IDENTICAL",
+        "RATIO_LENGTH",
+        None,
+        "RATIO_ALPHA_SRC",
+        "RATIO_ALPHA_TRG",
+        "RATIO_CHARS_TRG",
+    ]
+    assert clean_batch(pairs, "en", "ru") == [
+        clean_parallel(src, trg, "en", "ru") for src, trg in pairs
+    ]
+    # The languages without characters defined are only checked by the length rules.
+    assert clean_batch(pairs, "en", "zz")[4] is None
+
+
+def test_clean_mono_batch():
+    lines = ["Hello world", "Hello", "123 456", "中文"]
+    assert clean_mono.clean_batch(lines, "en") == [None, "TOO_SHORT", "RATIO_ALPHA", "TOO_SHORT"]
+    # The characters are the tokens of CJK languages.
+    assert clean_mono.clean_batch(lines, "zh") == [None, None, None, None]
+    assert clean_mono.clean_batch(lines, "en") == [
+        clean_mono.clean_mono(line, "en") for line in lines
+    ]
+
+
+class FakeLangIdModel:
+    """Labels the texts with Cyrillic letters as Russian, like the fastText model."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, texts):
+        assert isinstance(texts, list), "The texts are predicted in batches"
+        self.calls += 1
+        labels = [
+            ("__label__ru",) if re.search("[а-я]", text) else ("__label__en",) for text in texts
+        ]
+        return labels, [(1.0,) for _ in texts]
+
+
+def test_label_lines():
+    model = FakeLangIdModel()
+    lines = ["Hello\tПривет\n", "Привет\tHello\n", " Hello\tworld \n"]
+    assert label_lines(lines, [0], model) == (
+        [
+            "en\tHello\tПривет\n",
+            "ru\tПривет\tHello\n",
+            "en\t Hello\tworld \n",
+        ],
+        [],
+    )
+    # Both sides are labelled in one pass, with a single prediction per side.
+    model.calls = 0
+    assert label_lines(lines, [0, 1], model)[0] == [
+        "en\tru\tHello\tПривет\n",
+        "ru\ten\tПривет\tHello\n",
+        "en\ten\t Hello\tworld \n",
+    ]
+    assert model.calls == 2
+
+
+def test_get_model_path_reuses_the_model(tmp_path: Path):
+    (tmp_path / "lid.176.bin").write_bytes(b"model")
+    assert get_model_path(str(tmp_path)) == str(tmp_path / "lid.176.bin")
+    assert not (tmp_path / "lid.176.bin.lock").exists()
+
+
+def test_langid_cache(tmp_path: Path):
+    model = FakeLangIdModel()
+    cache_path = tmp_path / "langid.cache"
+    cache = LangIdCache.load(cache_path, b"1" * 32)
+    lines = ["Hello\tПривет\n", "Привет\tHello\n", "Hello\tПривет\n"]
+    labelled_lines, new_entries = label_lines(lines, [0, 1], model, cache)
+    assert [len(entries) for entries in new_entries] == [3, 3]
+    for entries in new_entries:
+        cache.add(entries)
+    cache.save(cache_path)
+    # The repeated texts are only saved once.
+    assert len(LangIdCache.load(cache_path, b"1" * 32)) == 2
+
+    # The cached texts aren't predicted again.
+    model.calls = 0
+    cache = LangIdCache.load(cache_path, b"1" * 32)
+    assert label_lines(lines, [0, 1], model, cache)[0] == labelled_lines
+    assert model.calls == 0
+    langs, new_entries = cache.predict(model, ["Hello", "Новый", "Hello world"])
+    assert langs == ["en", "ru", "en"]
+    assert list(new_entries["fingerprint"]) == list(
+        get_text_fingerprints(["Новый", "Hello world"])
+    )
+    assert model.calls == 1
+
+    # The caches of different tasks are merged.
+    other = LangIdCache(b"1" * 32)
+    other.add(new_entries)
+    other_path = tmp_path / "other.cache"
+    other.save(other_path)
+    cache.merge(LangIdCache.load(other_path, b"1" * 32))
+    cache.save(cache_path)
+    assert len(LangIdCache.load(cache_path, b"1" * 32)) == 4
+
+    # The labels of a different model aren't used.
+    assert len(LangIdCache.load(cache_path, b"2" * 32)) == 0
+    with pytest.raises(ValueError):
+        cache.merge(LangIdCache(b"2" * 32))
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from pipeline.common.bloom_filter import UInt64BloomFilter
+
+
+def random_fingerprints(seed: int, count: int):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 2**64, size=count, dtype=np.uint64, endpoint=False)
+
+
+@pytest.mark.parametrize("false_positive_rate", [0.1, 0.01, 0.001])
+def test_bloom_filter_false_positive_rate(false_positive_rate: float):
+    added = random_fingerprints(1, 20_000)
+    bloom_filter = UInt64BloomFilter(capacity=len(added), false_positive_rate=false_positive_rate)
+    bloom_filter.add_many(added)
+
+    assert bloom_filter.contains_many(added).all(), "There are no false negatives."
+
+    false_positives = bloom_filter.contains_many(random_fingerprints(2, 200_000)).mean()
+    assert false_positives < false_positive_rate * 1.5
+    assert bloom_filter.estimated_false_positive_rate == pytest.approx(
+        false_positive_rate, rel=0.1
+    )
+
+
+def test_bloom_filter_max_bytes():
+    added = random_fingerprints(1, 20_000)
+    bloom_filter = UInt64BloomFilter(
+        capacity=len(added), false_positive_rate=0.001, max_bytes=10_000
+    )
+    assert bloom_filter.nbytes == 10_000
+    bloom_filter.add_many(added)
+
+    # The memory is capped, so the false positive rate is higher than the target.
+    false_positives = bloom_filter.contains_many(random_fingerprints(2, 200_000)).mean()
+    assert bloom_filter.estimated_false_positive_rate > 0.01
+    assert false_positives == pytest.approx(bloom_filter.estimated_false_positive_rate, rel=0.2)
+
+
+def test_bloom_filter_add():
+    fingerprints = random_fingerprints(1, 1_000)
+    scalar_filter = UInt64BloomFilter(capacity=1_000)
+    batch_filter = UInt64BloomFilter(capacity=1_000)
+
+    for fingerprint in fingerprints.tolist():
+        assert scalar_filter.add(fingerprint)
+        assert not scalar_filter.add(fingerprint)
+        assert fingerprint in scalar_filter
+
+    # The batch is added twice, and the first of the repeated fingerprints is marked as added.
+    batch = np.concatenate([fingerprints, fingerprints])
+    assert batch_filter.add_many(batch).tolist() == [True] * 1_000 + [False] * 1_000
+    assert not batch_filter.add_many(fingerprints).any()
+
+    assert (scalar_filter.bits == batch_filter.bits).all(), "The same bits are set."
+    assert len(scalar_filter) == len(batch_filter) == 1_000
@@ -1,10 +1,28 @@
 import io
+import os
+from array import array
+from itertools import islice
+from pathlib import Path
 from typing import Iterator
 
+import numpy as np
 import pytest
 from fixtures import DataDir
 
-from pipeline.common.datasets import WeakStringSet, shuffle_in_temp_files, shuffle_with_max_lines
+from pipeline.common import datasets
+from pipeline.common.datasets import (
+    ApproximateDeduplicationStep,
+    ApproximateStringSet,
+    LineReservoir,
+    ReservoirSampler,
+    TeeSampleWriter,
+    WeakStringSet,
+    get_line_fingerprint,
+    shuffle_in_compressed_buckets,
+    shuffle_in_temp_files,
+    shuffle_lines_on_disk,
+    shuffle_with_max_lines,
+)
 
 ITEMS = 100_000
 # ITEMS = 1_000
@@ -155,6 +173,174 @@ def test_shuffle_in_temp_files():
         ]
 
 
+@pytest.mark.parametrize("processes", [1, 3])
+def test_shuffle_in_compressed_buckets(tmp_path: Path, monkeypatch, processes: int):
+    # Write the buckets in many small frames.
+    monkeypatch.setattr(datasets, "SHUFFLE_FRAME_BYTES", 1_000)
+    src_lines = [f"{line:09d}\t" * 10 for line in range(ITEMS)]
+    trg_lines = [f"{line:09d}\tcafé" for line in range(ITEMS)]
+
+    outputs = []
+    for line_stream in (src_lines, trg_lines):
+        with io.StringIO() as output:
+            line_count = shuffle_in_compressed_buckets(
+                line_stream,
+                output=output,
+                seed="test",
+                bucket_count=7,
+                bucket_dir=str(tmp_path),
+                processes=processes,
+            )
+            assert line_count == ITEMS
+            outputs.append(output.getvalue().splitlines())
+
+    assert os.listdir(tmp_path) == [], "The buckets are removed."
+    src_output, trg_output = outputs
+    assert sorted(src_output) == src_lines
+    assert src_output != src_lines
+    assert compute_distribution(src_output[:MAX_LINES]) == [
+        pytest.approx(0.1, abs=0.01) for _ in range(10)
+    ]
+    # The parallel lines are shuffled the same.
+    assert [line.split("\t")[0] for line in src_output] == [
+        line.split("\t")[0] for line in trg_output
+    ]
+
+
+def test_shuffle_in_compressed_buckets_processes(monkeypatch):
+    """The shuffle doesn't depend on the processes, or on the size of the frames."""
+    line_stream = [f"line {line}" for line in range(1_000)]
+    outputs = []
+    for processes, frame_bytes in [(1, 1024 * 1024), (2, 10)]:
+        monkeypatch.setattr(datasets, "SHUFFLE_FRAME_BYTES", frame_bytes)
+        with io.StringIO() as output:
+            shuffle_in_compressed_buckets(
+                line_stream, output, seed="test", bucket_count=3, processes=processes
+            )
+            outputs.append(output.getvalue())
+    assert outputs[0] == outputs[1]
+
+    with io.StringIO() as output:
+        shuffle_in_compressed_buckets([], output, seed="test", bucket_count=3, processes=1)
+        assert output.getvalue() == ""
+
+
+def test_shuffle_lines_on_disk_max_lines(tmp_path: Path):
+    # The lines can contain other line breaks.
+    line_stream = [f"{line:09d}\tline\r\n" for line in range(ITEMS)]
+    output = list(
+        shuffle_lines_on_disk(
+            line_stream,
+            seed="test",
+            bucket_count=20,
+            bucket_dir=str(tmp_path),
+            processes=2,
+            max_lines=MAX_LINES,
+        )
+    )
+    assert os.listdir(tmp_path) == [], "The buckets are removed."
+    assert len(output) == MAX_LINES
+    assert len(set(output)) == MAX_LINES
+    assert all(line in line_stream for line in output[:100])
+    # The first lines are a uniform sample.
+    assert compute_distribution(output) == [pytest.approx(0.1, abs=0.01) for _ in range(10)]
+
+    # The sample is the start of the full shuffle.
+    full_output = shuffle_lines_on_disk(line_stream, seed="test", bucket_count=20, processes=1)
+    assert list(islice(full_output, MAX_LINES)) == output
+    full_output.close()
+
+
+@pytest.mark.parametrize("bucket_count", [1, 3])
+def test_shuffle_lines_on_disk_unterminated_line(tmp_path: Path, bucket_count: int):
+    # The last line of a file can be read without a newline.
+    line_stream = ["a\n", "b\n", "c"]
+    output = shuffle_lines_on_disk(
+        line_stream, seed="test", bucket_count=bucket_count, bucket_dir=str(tmp_path), processes=1
+    )
+    assert sorted(output) == ["a\n", "b\n", "c\n"]
+
+
+def test_reservoir_sampler():
+    # Every item is equally likely to be in the sample.
+    histogram = [0] * 10
+    for seed in range(1_000):
+        sampler = ReservoirSampler(sample_size=10, seed=seed)
+        for item in range(100):
+            sampler.add(item)
+        for item in sampler.get_sample():
+            histogram[item // 10] += 1
+    assert histogram == [pytest.approx(1_000, rel=0.1) for _ in range(10)]
+
+    # Adding batches samples the same items as adding them one at a time.
+    items = list(range(10_000))
+    sampler = ReservoirSampler(sample_size=100, seed="test")
+    batch_sampler = ReservoirSampler(sample_size=100, seed="test")
+    for item in items:
+        sampler.add(item)
+    for start in range(0, len(items), 77):
+        batch_sampler.add_many(items[start : start + 77])
+    assert sampler.get_sample() == batch_sampler.get_sample()
+
+    # A short stream is kept in full, but shuffled.
+    sampler = ReservoirSampler(sample_size=100, seed="test")
+    sampler.add_many(items[:50])
+    sample = sampler.get_sample()
+    assert sorted(sample) == items[:50]
+    assert sample != items[:50]
+
+    sampler = ReservoirSampler(sample_size=0, seed="test")
+    sampler.add_many(items)
+    assert sampler.get_sample() == []
+
+
+def test_tee_sample_writer(tmp_path: Path):
+    sample_path = tmp_path / "corpus.sample.txt"
+    with io.StringIO() as src_outfile, io.StringIO() as trg_outfile:
+        with TeeSampleWriter([src_outfile, trg_outfile], sample_path, sample_size=3) as writer:
+            writer.write("src 0\n", "trg 0\n")
+            writer.write_rows([(f"src {i}\n", f"trg {i}\n") for i in range(1, 10)])
+        assert src_outfile.getvalue() == "".join(f"src {i}\n" for i in range(10))
+        assert trg_outfile.getvalue() == "".join(f"trg {i}\n" for i in range(10))
+
+    sample = sample_path.read_text(encoding="utf-8-sig").split("\n\n")
+    assert sample.pop() == ""
+    assert len(sample) == 3
+    for pair in sample:
+        src_line, trg_line = pair.split("\n")
+        assert src_line.replace("src", "trg") == trg_line
+
+    # A sample isn't written for an output that failed.
+    sample_path.unlink()
+    with pytest.raises(RuntimeError):
+        with TeeSampleWriter([io.StringIO()], sample_path, sample_size=3) as writer:
+            writer.write("line\n")
+            raise RuntimeError("Failed to write")
+    assert not sample_path.exists()
+
+
+def test_tee_sample_writer_previous_sample(tmp_path: Path):
+    previous_path = tmp_path / "previous.sample.txt"
+    with TeeSampleWriter([io.StringIO(), io.StringIO()], previous_path, sample_size=4) as writer:
+        writer.write_rows([(f"src {i}\n", f"trg {i}\n") for i in range(100)])
+
+    sample_path = tmp_path / "corpus.sample.txt"
+    with TeeSampleWriter([io.StringIO(), io.StringIO()], sample_path, sample_size=4) as writer:
+        writer.add_previous_sample(previous_path, row_count=100)
+        assert len(writer.previous_sample) == 4
+        writer.write_rows([(f"src {i}\n", f"trg {i}\n") for i in range(100, 110)])
+
+    previous_rows = previous_path.read_text(encoding="utf-8-sig").split("\n\n")
+    rows = sample_path.read_text(encoding="utf-8-sig").split("\n\n")
+    assert rows.pop() == ""
+    assert len(rows) == 4
+    for row in rows:
+        src_line, trg_line = row.split("\n")
+        assert src_line.replace("src", "trg") == trg_line
+        # The rows come from the previous sample, or from the new rows.
+        assert row in previous_rows or int(src_line.split()[1]) >= 100
+
+
 def test_weak_string_set():
     """
     Test all of the Set operations that take an "elem" per:
@@ -190,3 +376,92 @@ def test_weak_string_set():
     assert "string b" in unique_strings2
     assert "string c" not in unique_strings2
     assert len(unique_strings2) == 2
+
+    with pytest.raises(KeyError):
+        unique_strings2.remove("string c")
+
+
+def test_weak_string_set_add_many():
+    unique_strings = WeakStringSet()
+    # Adding returns if the string is new. The surrounding whitespace is ignored.
+    assert unique_strings.add("string a")
+    assert not unique_strings.add("  string a\n")
+
+    added = unique_strings.add_many(["string a", "string b", "string c", "string b"])
+    assert added.tolist() == [False, True, True, False]
+    assert len(unique_strings) == 3
+
+    found = unique_strings.contains_many(["string c", "string d", "string a\n"])
+    assert found.tolist() == [True, False, True]
+
+
+def test_approximate_string_set():
+    unique_strings = ApproximateStringSet(capacity=1_000, false_positive_rate=0.01)
+    assert unique_strings.add("string a")
+    assert not unique_strings.add("  string a\n")
+
+    unique_strings.update(["string b", "string c"])
+    added = unique_strings.add_fingerprints(
+        np.array([get_line_fingerprint(line) for line in ["string a", "string d"]], np.uint64)
+    )
+    assert added.tolist() == [False, True]
+    assert "string c" in unique_strings
+    assert "string e" not in unique_strings
+    assert unique_strings.estimated_false_positive_rate < 0.01
+    # It's not a WeakStringSet, as strings can't be removed from it.
+    assert not isinstance(unique_strings, WeakStringSet)
+
+    stats = ApproximateDeduplicationStep(unique_strings)
+    stats.dropped_as_duplicates = 2
+    obj = stats.as_json()
+    assert obj["memory_bytes"] == unique_strings.hashes.nbytes
+    assert obj["target_false_positive_rate"] == 0.01
+    assert obj["estimated_false_positive_rate"] == unique_strings.estimated_false_positive_rate
+    assert obj["dropped_as_duplicates"] == 2
+    assert obj["estimated_true_duplicates"] + obj["estimated_false_positive_drops"] == 2
+
+
+def test_line_reservoir():
+    reservoir = LineReservoir(columns=2)
+    # The byte size is measured as if the columns were joined with a tab.
+    assert reservoir.append(("Hello\n", "Hola\n")) == 12
+    assert reservoir.append(("Café\n", "Café\n")) == 13
+    reservoir.append(("Bye\n", "Adiós\n"))
+    assert len(reservoir) == 3
+    assert reservoir[1] == ("Café\n", "Café\n")
+    assert reservoir.get_byte_size(1) == 12
+
+    # Only keep the given rows, in the given order.
+    new_indexes = reservoir.compact(array("Q", [2, 0]))
+    assert list(new_indexes) == [0, 1]
+    assert [reservoir[i] for i in new_indexes] == [("Bye\n", "Adiós\n"), ("Hello\n", "Hola\n")]
+    assert len(reservoir.arena) == len("Bye\nAdiós\nHello\nHola\n".encode())
+
+
+@pytest.mark.parametrize("compact_chunk_rows", [3, 65_536])
+def test_shuffle_with_max_lines_columns(monkeypatch, compact_chunk_rows: int):
+    """
+    Shuffling pairs as columns gives the same result as shuffling them joined by a tab,
+    including when the reservoir is compacted.
+    """
+    monkeypatch.setattr(LineReservoir, "compact_chunk_rows", compact_chunk_rows)
+    pairs = [(f"{i} src ünïcode\n", f"{i} trg\n") for i in range(5_000)]
+    total_byte_size = get_total_byte_size([f"{src}\t{trg}" for src, trg in pairs])
+
+    joined = shuffle_with_max_lines(
+        (f"{src}\t{trg}" for src, trg in pairs),
+        seed="test",
+        max_lines=500,
+        total_byte_size=total_byte_size,
+    )
+    columns = shuffle_with_max_lines(
+        iter(pairs),
+        seed="test",
+        max_lines=500,
+        total_byte_size=total_byte_size,
+        columns=2,
+    )
+
+    assert len(columns) == 500
+    assert [f"{src}\t{trg}" for src, trg in columns] == list(joined)
+    assert columns[0] == tuple(joined[0].split("\t"))
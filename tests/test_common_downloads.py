@@ -1,14 +1,36 @@
 import gzip
 import io
+import json
+import os
+import re
+import threading
+import time
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 from pathlib import Path
+from random import Random
 from threading import Thread
+from typing import Optional
+from zipfile import ZIP_DEFLATED, ZipFile
 
 import pytest
 import zstandard
 from fixtures import DataDir
 
-from pipeline.common.downloads import compress_file, decompress_file, read_lines, write_lines
+from pipeline.common import downloads
+from pipeline.common.downloads import (
+    DownloadChunkStreamer,
+    RemoteGzipLineStreamer,
+    compress_file,
+    count_lines,
+    decompress_file,
+    get_download_cache,
+    get_download_size,
+    get_line_count_path,
+    get_seekable_index_path,
+    read_lines,
+    stream_download_to_file,
+    write_lines,
+)
 
 # Content to serve
 line_fixtures = [
@@ -36,6 +58,38 @@ class CustomHTTPRequestHandler(SimpleHTTPRequestHandler):
     gz_path: str
     zst_path: str
     txt_path: str
+    bin_path: str
+    zip_path: str
+
+    # Which byte ranges were requested, e.g. [(0, 99), (100, 199)]
+    requested_ranges: list[tuple[int, int]] = []
+    # Simulate a dropped connection by only sending half of the next N range requests.
+    truncate_ranges: int = 0
+    # Which paths were requested with a GET.
+    get_requests: list[str] = []
+    # Ignore the Range header after this many range requests, and send the whole file.
+    ignore_ranges_after: Optional[int] = None
+    # Respond with a transient 503 error to the next N HEAD or GET requests.
+    fail_heads: int = 0
+    fail_gets: int = 0
+
+    def fail_request(self, counter: str) -> bool:
+        if getattr(self, counter) <= 0:
+            return False
+        setattr(CustomHTTPRequestHandler, counter, getattr(self, counter) - 1)
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return True
+
+    def send_file_headers(self, file_path: str, mime_type: Optional[str], content_length: int):
+        if mime_type:
+            self.send_header("Content-type", mime_type)
+        stat = os.stat(file_path)
+        self.send_header("ETag", f'"{stat.st_size}-{stat.st_mtime_ns}"')
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(content_length))
+        self.end_headers()
 
     def determine_file(self):
         """
@@ -62,6 +116,12 @@ class CustomHTTPRequestHandler(SimpleHTTPRequestHandler):
         elif path == "/lines.txt":
             mime_type = "text/plain"
             file_path = self.txt_path
+        elif path == "/random.bin":
+            mime_type = "application/octet-stream"
+            file_path = self.bin_path
+        elif path == "/lines.zip":
+            mime_type = "application/zip"
+            file_path = self.zip_path
 
         if query == "no_mime_type":
             mime_type = None
@@ -73,26 +133,52 @@ class CustomHTTPRequestHandler(SimpleHTTPRequestHandler):
         if not file_path:
             self.send_response(404)
             return
+        if self.fail_request("fail_gets"):
+            return
 
-        self.send_response(200)
-        if mime_type:
-            self.send_header("Content-type", mime_type)
-
-        self.end_headers()
-
+        self.get_requests.append(self.path)
         with open(file_path, "rb") as file:
-            self.wfile.write(file.read())
+            content = file.read()
+
+        # Support "Range: bytes=start-end" requests.
+        range_match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if range_match and self.ignore_ranges_after is not None:
+            if len(self.requested_ranges) >= self.ignore_ranges_after:
+                range_match = None
+        if range_match:
+            start = int(range_match.group(1))
+            end = int(range_match.group(2)) if range_match.group(2) else len(content) - 1
+            self.requested_ranges.append((start, end))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+            content = content[start : end + 1]
+        else:
+            self.send_response(200)
+
+        self.send_file_headers(file_path, mime_type, len(content))
+
+        if range_match and self.truncate_ranges > 0:
+            CustomHTTPRequestHandler.truncate_ranges -= 1
+            self.wfile.write(content[: len(content) // 2])
+            self.close_connection = True
+            return
+
+        try:
+            self.wfile.write(content)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, e.g. after it read part of a range.
+            pass
 
     def do_HEAD(self):
         mime_type, file_path = self.determine_file()
         if not file_path:
             self.send_response(404)
             return
+        if self.fail_request("fail_heads"):
+            return
 
         self.send_response(200)
-        if mime_type:
-            self.send_header("Content-type", mime_type)
-        self.end_headers()
+        self.send_file_headers(file_path, mime_type, os.path.getsize(file_path))
 
 
 @pytest.fixture(scope="function")
@@ -114,6 +200,20 @@ def http_server():
     handler.gz_path = write_test_content(data_dir.join("lines.txt.gz"))
     handler.zst_path = write_test_content(data_dir.join("lines.txt.zst"))
     handler.txt_path = write_test_content(data_dir.join("lines.txt"))
+    handler.bin_path = data_dir.join("random.bin")
+    handler.requested_ranges = []
+    handler.truncate_ranges = 0
+    handler.get_requests = []
+    handler.ignore_ranges_after = None
+    handler.fail_heads = 0
+    handler.fail_gets = 0
+    with open(handler.bin_path, "wb") as file:
+        file.write(os.urandom(100_000))
+    handler.zip_path = data_dir.join("lines.zip")
+    with ZipFile(handler.zip_path, "w", compression=ZIP_DEFLATED) as zip_file:
+        # The archive starts with a large file that shouldn't be downloaded.
+        zip_file.writestr("other.bin", os.urandom(500_000))
+        zip_file.writestr("corpus/lines.txt", line_fixtures_bytes)
 
     httpd = HTTPServer(("localhost", 0), handler)  # Bind to port 0 to find a free port
     port = httpd.server_address[1]  # Get the actual port assigned
@@ -143,6 +243,421 @@ def test_read_lines_remote(filename, query_param, http_server):
         assert list(lines) == line_fixtures
 
 
+@pytest.mark.parametrize(
+    "filename",
+    ["lines.txt.gz", "lines.txt.zst", "lines.txt"],
+)
+def test_read_lines_remote_binary(filename, http_server):
+    url = f"http://localhost:{http_server}/{filename}"
+    with read_lines(url, binary=True) as lines:
+        assert list(lines) == [line.encode("utf-8") for line in line_fixtures]
+
+
+def test_read_lines_remote_binary_cached(http_server, download_cache_dir):
+    url = f"http://localhost:{http_server}/lines.txt.zst"
+    for _ in range(2):
+        with read_lines(url, binary=True) as lines:
+            assert list(lines) == [line.encode("utf-8") for line in line_fixtures]
+    assert get_download_cache().hits == 1
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_read_lines_remote_multiple_prefetch(binary, http_server):
+    """
+    The next remote file is downloaded in the background while the current one is read, and
+    on_enter_location is still called as each file is entered.
+    """
+    filenames = ["lines.txt.gz", "lines.txt.zst", "lines.txt"]
+    urls = [f"http://localhost:{http_server}/{filename}" for filename in filenames]
+    entered_locations = []
+    lines_read = []
+
+    with read_lines(urls, on_enter_location=entered_locations.append, binary=binary) as lines:
+        for line in lines:
+            lines_read.append(line)
+            if len(lines_read) == 1:
+                assert entered_locations == urls[:1]
+                # Wait for the second file to be requested before the first one is done.
+                for _ in range(100):
+                    if "/lines.txt.zst" in CustomHTTPRequestHandler.get_requests:
+                        break
+                    time.sleep(0.05)
+                assert sorted(CustomHTTPRequestHandler.get_requests) == [
+                    "/lines.txt.gz",
+                    "/lines.txt.zst",
+                ]
+
+    expected_lines = line_fixtures * 3
+    if binary:
+        expected_lines = [line.encode("utf-8") for line in expected_lines]
+    assert lines_read == expected_lines
+    assert entered_locations == urls
+
+
+def test_read_lines_remote_multiple_stop_early(http_server):
+    """
+    Stopping early cancels the downloads in the background.
+    """
+    urls = [f"http://localhost:{http_server}/lines.txt.zst"] * 3
+
+    with read_lines(urls) as lines:
+        assert next(lines) == line_fixtures[0]
+
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith("prefetch")]
+
+
+def test_prefetched_download_streams_after_prefetch(http_server, monkeypatch):
+    """
+    Only the start of the file is written to the temporary file, and the rest of it is read
+    from the open download.
+    """
+    monkeypatch.setattr(downloads, "COPY_CHUNK_BYTES", 4)
+    prefetched = downloads._PrefetchedDownload(
+        f"http://localhost:{http_server}/lines.txt", prefetch_bytes=10
+    )
+    try:
+        prefetched.thread.join()
+        assert prefetched.downloaded_bytes == 12
+        assert prefetched.source
+        assert prefetched.open().read() == line_fixtures_bytes
+    finally:
+        prefetched.close()
+    assert prefetched.file.closed
+
+
+def test_prefetched_download_close_doesnt_wait(monkeypatch):
+    """
+    Closing doesn't wait on a download that is blocked, and the thread cleans up after it.
+    """
+    monkeypatch.setattr(downloads, "PREFETCH_CLOSE_TIMEOUT_SEC", 0.1)
+    unblock = threading.Event()
+
+    def blocked_content_type(url: str) -> str:
+        unblock.wait()
+        return "text/plain"
+
+    monkeypatch.setattr(downloads, "get_content_type", blocked_content_type)
+    prefetched = downloads._PrefetchedDownload("http://localhost:1/lines.txt")
+    start = time.monotonic()
+    prefetched.close()
+    assert time.monotonic() - start < 5
+    assert prefetched.thread.is_alive()
+
+    unblock.set()
+    prefetched.thread.join()
+    assert prefetched.file.closed
+    assert prefetched.source is None
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_read_lines_remote_zip(binary, http_server):
+    """
+    A remote zip is read with range requests, which skip the files that aren't read.
+    """
+    url = f"http://localhost:{http_server}/lines.zip"
+    with read_lines(url, path_in_archive="corpus/lines.txt", binary=binary) as lines:
+        if binary:
+            assert list(lines) == [line.encode("utf-8") for line in line_fixtures]
+        else:
+            assert list(lines) == line_fixtures
+
+    get_requests = CustomHTTPRequestHandler.get_requests
+    requested_ranges = CustomHTTPRequestHandler.requested_ranges
+    assert get_requests
+    assert len(requested_ranges) == len(get_requests), "Every request is a range request."
+    assert all(start > 500_000 for start, _ in requested_ranges), "other.bin is skipped."
+
+
+def test_read_lines_remote_zip_missing_path(http_server):
+    url = f"http://localhost:{http_server}/lines.zip"
+    with pytest.raises(Exception, match="Path did not exist in the zip file"):
+        with read_lines(url, path_in_archive="missing.txt"):
+            pass
+
+
+@pytest.mark.parametrize(
+    "connections, range_bytes, ranges_in_flight, expected_ranges",
+    [
+        # A single connection uses a single request.
+        (1, 10_000, None, 0),
+        # The file is smaller than a range, so it's not split.
+        (4, 1_000_000, None, 0),
+        (4, 10_000, None, 10),
+        (4, 30_000, None, 4),
+        (8, 7_000, 2, 15),
+    ],
+)
+def test_download_chunk_streamer_ranges(
+    connections, range_bytes, ranges_in_flight, expected_ranges, http_server
+):
+    url = f"http://localhost:{http_server}/random.bin"
+    with open(CustomHTTPRequestHandler.bin_path, "rb") as file:
+        expected_bytes = file.read()
+
+    with DownloadChunkStreamer(
+        url,
+        connections=connections,
+        range_bytes=range_bytes,
+        ranges_in_flight=ranges_in_flight,
+    ) as chunk_streamer:
+        chunks = list(chunk_streamer.download_chunks())
+
+    assert b"".join(chunks) == expected_bytes
+    assert max(len(chunk) for chunk in chunks) <= 8 * 1024
+    assert len(CustomHTTPRequestHandler.requested_ranges) == expected_ranges
+
+    # The streamer can also be read as a file handle.
+    with DownloadChunkStreamer(url, connections=connections, range_bytes=range_bytes) as file:
+        assert file.read(10) == expected_bytes[:10]
+        assert file.read(25_000) == expected_bytes[10:25_010]
+        assert file.read() == expected_bytes[25_010:]
+        assert file.read() == b""
+
+
+def test_download_chunk_streamer_read(http_server):
+    """
+    Reads of different sizes span across the downloaded chunks.
+    """
+    url = f"http://localhost:{http_server}/random.bin"
+    with open(CustomHTTPRequestHandler.bin_path, "rb") as file:
+        expected_bytes = file.read()
+
+    with DownloadChunkStreamer(url) as file:
+        results = []
+        for size in [0, 1, 8191, 8192, 8193, 20_000, 1]:
+            result = file.read(size)
+            assert len(result) == size
+            results.append(result)
+
+        buffer = bytearray(30_000)
+        assert file.readinto(buffer) == 30_000
+        results.append(buffer)
+
+        results.append(file.read())
+        assert file.read(10) == b""
+        assert file.readinto(buffer) == 0
+
+    assert b"".join(results) == expected_bytes
+
+    # The streamer can back a BufferedReader, which fills its buffer with readinto.
+    with DownloadChunkStreamer(url) as file:
+        reader = io.BufferedReader(file, buffer_size=50_000)
+        assert reader.read(10) == expected_bytes[:10]
+        assert reader.read() == expected_bytes[10:]
+
+
+def test_download_chunk_streamer_range_retry(http_server):
+    """
+    Dropped connections for a range are resumed from where the range left off.
+    """
+    url = f"http://localhost:{http_server}/random.bin"
+    with open(CustomHTTPRequestHandler.bin_path, "rb") as file:
+        expected_bytes = file.read()
+
+    CustomHTTPRequestHandler.truncate_ranges = 2
+    with DownloadChunkStreamer(
+        url, connections=2, range_bytes=50_000, wait_before_retry_sec=0.0
+    ) as chunk_streamer:
+        assert b"".join(chunk_streamer.download_chunks()) == expected_bytes
+
+    assert CustomHTTPRequestHandler.truncate_ranges == 0
+    # Only whole 8 KiB chunks are received before the connection drops.
+    assert sorted(CustomHTTPRequestHandler.requested_ranges) == [
+        (0, 49_999),
+        (24_576, 49_999),
+        (50_000, 99_999),
+        (74_576, 99_999),
+    ]
+
+
+def test_download_chunk_streamer_range_not_honored(http_server):
+    """
+    When the server stops honoring the ranges, the rest of the file is downloaded with a
+    single connection, which skips the bytes that were already yielded.
+    """
+    url = f"http://localhost:{http_server}/random.bin"
+    with open(CustomHTTPRequestHandler.bin_path, "rb") as file:
+        expected_bytes = file.read()
+
+    CustomHTTPRequestHandler.ignore_ranges_after = 1
+    with DownloadChunkStreamer(
+        url, connections=2, range_bytes=30_000, ranges_in_flight=1
+    ) as chunk_streamer:
+        assert b"".join(chunk_streamer.download_chunks()) == expected_bytes
+
+    assert CustomHTTPRequestHandler.requested_ranges == [(0, 29_999)]
+    # The first range, the ignored second range, and the single connection fallback.
+    assert len(CustomHTTPRequestHandler.get_requests) == 3
+
+
+def test_download_transient_status_retry(http_server, monkeypatch):
+    """
+    Transient errors are retried for the HEAD requests and for each range.
+    """
+    monkeypatch.setattr(downloads, "HEAD_WAIT_BEFORE_RETRY_SEC", 0.0)
+    url = f"http://localhost:{http_server}/random.bin"
+    with open(CustomHTTPRequestHandler.bin_path, "rb") as file:
+        expected_bytes = file.read()
+
+    CustomHTTPRequestHandler.fail_heads = 2
+    assert get_download_size(url) == len(expected_bytes)
+    assert CustomHTTPRequestHandler.fail_heads == 0
+
+    CustomHTTPRequestHandler.fail_heads = 1
+    CustomHTTPRequestHandler.fail_gets = 1
+    with DownloadChunkStreamer(
+        url, connections=2, range_bytes=50_000, ranges_in_flight=1, wait_before_retry_sec=0.0
+    ) as chunk_streamer:
+        assert b"".join(chunk_streamer.download_chunks()) == expected_bytes
+
+    assert CustomHTTPRequestHandler.fail_heads == 0
+    assert CustomHTTPRequestHandler.fail_gets == 0
+    assert CustomHTTPRequestHandler.requested_ranges == [(0, 49_999), (50_000, 99_999)]
+
+
+def test_stream_download_to_file_ranges(http_server):
+    data_dir = DataDir("test_stream_download_to_file")
+    destination = data_dir.join("random.bin")
+    url = f"http://localhost:{http_server}/random.bin"
+
+    stream_download_to_file(url, destination, connections=4)
+
+    with open(CustomHTTPRequestHandler.bin_path, "rb") as expected, open(destination, "rb") as f:
+        assert f.read() == expected.read()
+    assert len(CustomHTTPRequestHandler.requested_ranges) == 0, "The file fits in one range."
+
+
+@pytest.fixture(scope="function")
+def download_cache_dir(monkeypatch):
+    """
+    Enables the download cache for a test.
+    """
+    data_dir = DataDir("test_download_cache")
+    cache_dir = data_dir.join("cache")
+    monkeypatch.setenv("DOWNLOAD_CACHE_DIR", cache_dir)
+    monkeypatch.setattr(downloads, "_download_caches", {})
+    return cache_dir
+
+
+def list_cached_files(cache_dir: str) -> list[str]:
+    return os.listdir(os.path.join(cache_dir, "files"))
+
+
+@pytest.mark.parametrize(
+    "filename",
+    ["lines.txt.gz", "lines.txt.zst", "lines.txt"],
+)
+def test_download_cache_read_lines(filename, http_server, download_cache_dir):
+    url = f"http://localhost:{http_server}/{filename}"
+
+    for _ in range(3):
+        with read_lines(url) as lines:
+            assert list(lines) == line_fixtures
+
+    assert CustomHTTPRequestHandler.get_requests == [f"/{filename}"], "Only downloaded once"
+    assert len(list_cached_files(download_cache_dir)) == 1
+
+    download_cache = get_download_cache()
+    assert download_cache.hits == 2
+    assert download_cache.misses == 1
+    file_size = os.path.getsize(
+        os.path.join(os.path.dirname(CustomHTTPRequestHandler.txt_path), filename)
+    )
+    assert download_cache.bytes_saved == 2 * file_size
+    assert get_download_size(url) == file_size
+
+
+def test_download_cache_partial_read(http_server, download_cache_dir):
+    """
+    A download that is not fully read is not cached.
+    """
+    url = f"http://localhost:{http_server}/lines.txt.zst"
+
+    with read_lines(url) as lines:
+        assert next(lines) == line_fixtures[0]
+
+    assert list_cached_files(download_cache_dir) == []
+
+    with read_lines(url) as lines:
+        assert list(lines) == line_fixtures
+
+    assert len(list_cached_files(download_cache_dir)) == 1
+
+
+def test_download_cache_stream_download_to_file(http_server, download_cache_dir):
+    data_dir = DataDir("test_stream_download_to_file")
+    url = f"http://localhost:{http_server}/random.bin"
+    with open(CustomHTTPRequestHandler.bin_path, "rb") as file:
+        expected_bytes = file.read()
+
+    for name in ["random-1.bin", "random-2.bin"]:
+        stream_download_to_file(url, data_dir.join(name), connections=4)
+        with open(data_dir.join(name), "rb") as file:
+            assert file.read() == expected_bytes
+
+    assert CustomHTTPRequestHandler.get_requests == ["/random.bin"]
+    assert get_download_cache().hits == 1
+
+
+def test_download_cache_eviction(http_server, download_cache_dir, monkeypatch):
+    """
+    The least recently used files are evicted when the cache is over its byte budget.
+    """
+
+    def get_size(filename):
+        return os.path.getsize(
+            os.path.join(os.path.dirname(CustomHTTPRequestHandler.txt_path), filename)
+        )
+
+    def read_url(filename):
+        with read_lines(f"http://localhost:{http_server}/{filename}") as lines:
+            assert list(lines) == line_fixtures
+
+    # Only the .txt and .gz files fit together in the cache.
+    max_bytes = get_size("lines.txt") + get_size("lines.txt.gz")
+    monkeypatch.setenv("DOWNLOAD_CACHE_MAX_BYTES", str(max_bytes))
+
+    read_url("lines.txt")
+    read_url("lines.txt.zst")
+    assert len(list_cached_files(download_cache_dir)) == 2
+
+    # Make the .txt file the most recently used one.
+    time.sleep(0.01)
+    read_url("lines.txt")
+    time.sleep(0.01)
+
+    # The .zst file is evicted, as it was the least recently used.
+    read_url("lines.txt.gz")
+    assert len(list_cached_files(download_cache_dir)) == 2
+
+    read_url("lines.txt")
+    read_url("lines.txt.gz")
+    read_url("lines.txt.zst")
+    assert CustomHTTPRequestHandler.get_requests == [
+        "/lines.txt",
+        "/lines.txt.zst",
+        "/lines.txt.gz",
+        "/lines.txt.zst",
+    ]
+
+
+def test_download_cache_mocked_downloads(download_cache_dir, monkeypatch):
+    """
+    The download cache can serve mocked downloads.
+    """
+    data_dir = DataDir("test_download_cache_mocked")
+    url = "https://example.com/lines.txt.gz"
+    file_path = write_test_content(data_dir.join("lines.txt.gz"))
+    monkeypatch.setenv("MOCKED_DOWNLOADS", json.dumps({url: file_path}))
+
+    for _ in range(2):
+        with RemoteGzipLineStreamer(url) as lines:
+            assert list(lines) == line_fixtures
+
+    assert len(list_cached_files(download_cache_dir)) == 1
+    assert get_download_cache().hits == 1
+
+
 @pytest.mark.parametrize(
     "filename",
     ["lines.txt.gz", "lines.txt.zst", "lines.txt"],
@@ -172,6 +687,55 @@ def test_read_lines_local_multiple():
         assert list(lines) == [*line_fixtures, *line_fixtures, *line_fixtures]
 
 
+@pytest.mark.parametrize(
+    "filename",
+    ["lines.txt.gz", "lines.txt.zst", "lines.txt"],
+)
+def test_read_write_lines_local_binary(filename):
+    """
+    This test round-trips a binary write_lines and read_lines, and checks that the text and
+    binary modes are interchangeable.
+    """
+    data_dir = DataDir("test_read_lines")
+    text_path = data_dir.join(f"text.{filename}")
+    binary_path = data_dir.join(f"binary.{filename}")
+    write_test_content(text_path)
+
+    with read_lines(text_path, binary=True) as lines, write_lines(
+        binary_path, binary=True
+    ) as outfile:
+        for line in lines:
+            assert isinstance(line, bytes)
+            outfile.write(line)
+
+    with read_lines(binary_path) as lines:
+        assert list(lines) == line_fixtures
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_read_lines_local_zip(binary: bool):
+    data_dir = DataDir("test_read_lines")
+    zip_path = data_dir.join("lines.zip")
+    with ZipFile(zip_path, "w") as zip_file:
+        zip_file.writestr("corpus/lines.txt", line_fixtures_bytes)
+
+    with read_lines(zip_path, path_in_archive="corpus/lines.txt", binary=binary) as lines:
+        if binary:
+            assert list(lines) == [line.encode("utf-8") for line in line_fixtures]
+        else:
+            assert list(lines) == line_fixtures
+
+
+def test_read_lines_local_multiple_binary():
+    data_dir = DataDir("test_read_lines")
+    file_paths = [data_dir.join(path) for path in ["lines.txt.gz", "lines.txt.zst", "lines.txt"]]
+    for file_path in file_paths:
+        write_test_content(data_dir.join(file_path))
+
+    with read_lines(file_paths, binary=True) as lines:
+        assert b"".join(lines) == line_fixtures_bytes * 3
+
+
 def assert_matches_test_content(file_path: str):
     with read_lines(file_path) as lines:
         assert list(lines) == line_fixtures, f"{file_path} matches the fixtures"
@@ -195,6 +759,246 @@ def test_compress_file(compression: str, keep_original: bool):
     assert_matches_test_content(compressed_file)
 
 
+@pytest.mark.parametrize(
+    "compression, compression_level, compression_threads",
+    [("gz", 1, 0), ("zst", 10, 0), ("zst", 1, 2), ("zst", None, -1)],
+)
+def test_compress_file_settings(compression, compression_level, compression_threads):
+    data_dir = DataDir("test_compress_file")
+
+    text_file = data_dir.join("text_file.txt")
+    # Write enough data that it is compressed across several chunks and worker threads.
+    lines = [f"line {i}\n" for i in range(500_000)]
+    with write_lines(text_file) as outfile:
+        outfile.writelines(lines)
+
+    compressed_file = compress_file(
+        text_file,
+        compression=compression,
+        compression_level=compression_level,
+        compression_threads=compression_threads,
+    )
+
+    with read_lines(compressed_file) as compressed_lines:
+        assert list(compressed_lines) == lines
+
+
+@pytest.mark.parametrize(
+    "filename, compression_level, compression_threads",
+    [("lines.txt.gz", 1, 0), ("lines.txt.zst", 10, 0), ("lines.txt.zst", None, -1)],
+)
+def test_write_lines_compression_settings(filename, compression_level, compression_threads):
+    data_dir = DataDir("test_write_lines")
+    file_path = data_dir.join(filename)
+    lines = [f"line {i}\n" for i in range(500_000)]
+
+    with write_lines(
+        file_path, compression_level=compression_level, compression_threads=compression_threads
+    ) as outfile:
+        outfile.writelines(lines)
+
+    with read_lines(file_path) as written_lines:
+        assert list(written_lines) == lines
+
+    if filename.endswith(".zst"):
+        # Multi-threaded compression produces a standard zstd file.
+        with open(file_path, "rb") as file:
+            decompressed = zstandard.ZstdDecompressor().stream_reader(file).read()
+        assert decompressed == "".join(lines).encode("utf-8")
+
+
+@pytest.mark.parametrize("compression_threads", [0, 2])
+@pytest.mark.parametrize("binary", [False, True])
+def test_write_lines_seekable(compression_threads, binary, monkeypatch):
+    monkeypatch.setattr(downloads._SeekableZstdWriter, "frame_bytes", 1000)
+    data_dir = DataDir("test_write_lines")
+    file_path = data_dir.join("lines.txt.zst")
+    lines = [f"line {i} {'ü' * (i % 50)}\n" for i in range(2_000)] + ["no newline"]
+    if binary:
+        lines = [line.encode("utf-8") for line in lines]
+
+    with write_lines(
+        file_path, seekable=True, compression_threads=compression_threads, binary=binary
+    ) as outfile:
+        outfile.writelines(lines)
+
+    index = json.loads(get_seekable_index_path(file_path).read_text())
+    assert index["lines"] == len(lines)
+    assert len(index["frames"]) > 50
+    assert count_lines(file_path) == len(lines)
+
+    # The frames can be decompressed as a standard zstd file.
+    with open(file_path, "rb") as file:
+        decompressed = zstandard.ZstdDecompressor().stream_reader(file).read()
+    joined = b"".join(lines) if binary else "".join(lines).encode("utf-8")
+    assert decompressed == joined
+
+    for decompression_threads in [0, 3]:
+        for start_line, end_line in [
+            (None, None),
+            (0, 1),
+            (None, 10),
+            (25, 1_234),
+            (1_999, None),
+            (2_000, 5_000),
+        ]:
+            with read_lines(
+                file_path,
+                binary=binary,
+                start_line=start_line,
+                end_line=end_line,
+                decompression_threads=decompression_threads,
+            ) as written_lines:
+                assert list(written_lines) == lines[start_line:end_line]
+
+
+def test_write_lines_seekable_append(monkeypatch):
+    monkeypatch.setattr(downloads._SeekableZstdWriter, "frame_bytes", 1000)
+    data_dir = DataDir("test_write_lines")
+    file_path = data_dir.join("lines.txt.zst")
+    lines = [f"line {i}\n" for i in range(2_000)]
+
+    with write_lines(file_path, seekable=True) as outfile:
+        outfile.writelines(lines[:500])
+    with write_lines(file_path, seekable=True, append=True, compression_threads=2) as outfile:
+        outfile.writelines(lines[500:])
+
+    index = json.loads(get_seekable_index_path(file_path).read_text())
+    assert index["lines"] == len(lines)
+    assert index["size"] == os.path.getsize(file_path)
+    with read_lines(file_path) as written_lines:
+        assert list(written_lines) == lines
+    with read_lines(file_path, start_line=490, end_line=510, decompression_threads=2) as written:
+        assert list(written) == lines[490:510]
+
+    # Only a seekable file with its index can be appended to.
+    get_seekable_index_path(file_path).unlink()
+    with pytest.raises(ValueError):
+        with write_lines(file_path, seekable=True, append=True):
+            pass
+    with pytest.raises(ValueError):
+        with write_lines(data_dir.join("lines.txt.gz"), append=True):
+            pass
+
+
+@pytest.mark.parametrize("filename", ["lines.txt.gz", "lines.txt.zst", "lines.txt"])
+@pytest.mark.parametrize("final_newline", [True, False])
+def test_count_lines(filename, final_newline):
+    data_dir = DataDir("test_count_lines")
+    file_path = data_dir.join(filename)
+    lines = [f"line {i}\n" for i in range(300_000)]
+    if not final_newline:
+        lines.append("no newline")
+    with write_lines(file_path) as outfile:
+        outfile.writelines(lines)
+
+    # The sidecar is only written when it's asked for.
+    get_line_count_path(file_path).unlink(missing_ok=True)
+    assert count_lines(file_path) == len(lines)
+    assert not get_line_count_path(file_path).exists()
+
+    assert count_lines(file_path, cache=True) == len(lines)
+    cached = json.loads(get_line_count_path(file_path).read_text())
+    assert cached["lines"] == len(lines)
+
+    # The cached count is used while the file is unchanged.
+    cached["lines"] = 5
+    get_line_count_path(file_path).write_text(json.dumps(cached))
+    assert count_lines(file_path) == 5
+
+    # Changing the file invalidates the cache.
+    write_test_content(file_path)
+    assert count_lines(file_path) == len(line_fixtures)
+
+
+def test_count_lines_remote(http_server):
+    assert count_lines(f"http://localhost:{http_server}/lines.txt.zst") == len(line_fixtures)
+
+
+def test_read_lines_range_without_index():
+    data_dir = DataDir("test_read_lines")
+    file_path = data_dir.join("lines.txt.zst")
+    with write_lines(file_path, seekable=True) as outfile:
+        outfile.write("seekable\n")
+
+    # Rewriting the file removes the index, and the lines are skipped instead.
+    write_test_content(file_path)
+    assert not get_seekable_index_path(file_path).exists()
+
+    with read_lines(file_path, start_line=1, end_line=3, decompression_threads=2) as lines:
+        assert list(lines) == line_fixtures[1:3]
+
+
+def test_read_lines_range_stale_index_of_same_size():
+    data_dir = DataDir("test_read_lines")
+    file_path = data_dir.join("lines.txt.zst")
+
+    def write_random_lines(seed: int) -> list[bytes]:
+        # Random bytes don't compress, so the files are stored with the same size.
+        random = Random(seed)
+        lines = [random.randbytes(100).replace(b"\n", b" ") + b"\n" for _ in range(100)]
+        with write_lines(file_path, seekable=True, binary=True) as outfile:
+            outfile.writelines(lines)
+        return lines
+
+    write_random_lines(1)
+    index_text = get_seekable_index_path(file_path).read_text()
+
+    # Rewrite the file with different lines of the same size, and restore the old index.
+    lines = write_random_lines(2)
+    get_seekable_index_path(file_path).write_text(index_text)
+    assert json.loads(index_text)["size"] == os.path.getsize(file_path)
+
+    # The checksum of the last frame doesn't match, so the index is ignored.
+    assert downloads._load_seekable_index(str(file_path)) is None
+    with read_lines(file_path, start_line=10, end_line=12, binary=True) as read:
+        assert list(read) == lines[10:12]
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_read_lines_seekable_newlines(binary, monkeypatch):
+    monkeypatch.setattr(downloads._SeekableZstdWriter, "frame_bytes", 100)
+    data_dir = DataDir("test_read_lines")
+    seekable_path = data_dir.join("seekable.txt.zst")
+    stream_path = data_dir.join("stream.txt.zst")
+    # Only "\n" ends a line in the index, while the text streams also split on "\r".
+    lines = [f"line {i}\r carriage return\n" for i in range(50)]
+    lines += [f"line {i} \u2028 line separator\r\n" for i in range(50)]
+    with write_lines(seekable_path, seekable=True) as outfile:
+        outfile.writelines(lines)
+    with write_lines(stream_path) as outfile:
+        outfile.writelines(lines)
+    assert not get_seekable_index_path(stream_path).exists()
+
+    with read_lines(seekable_path, binary=binary, decompression_threads=2) as read:
+        seekable_lines = list(read)
+    with read_lines(stream_path, binary=binary) as read:
+        assert seekable_lines == list(read)
+    assert len(seekable_lines) == (100 if binary else 150)
+
+    # A range of the lines in the index is decoded the same way.
+    with read_lines(seekable_path, binary=binary, start_line=48, end_line=52) as read:
+        range_lines = list(read)
+    expected = "".join(lines[48:52]).encode("utf-8")
+    if binary:
+        assert range_lines == io.BytesIO(expected).readlines()
+    else:
+        assert range_lines == io.TextIOWrapper(io.BytesIO(expected)).readlines()
+
+
+@pytest.mark.parametrize("index_text", ["", "{", '{"size": 1}', '{"frames": []}', "[]"])
+def test_read_lines_unreadable_index(index_text):
+    data_dir = DataDir("test_read_lines")
+    file_path = data_dir.join("lines.txt.zst")
+    write_test_content(file_path)
+    get_seekable_index_path(file_path).write_text(index_text)
+
+    assert downloads._load_seekable_index(str(file_path)) is None
+    with read_lines(file_path, start_line=1, end_line=3) as lines:
+        assert list(lines) == line_fixtures[1:3]
+    assert count_lines(file_path) == len(line_fixtures)
+
+
 @pytest.mark.parametrize(
     "compression, keep_original",
     [("gz", False), ("zst", True)],
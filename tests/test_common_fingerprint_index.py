@@ -0,0 +1,214 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from pipeline.common import fingerprint_index
+from pipeline.common.datasets import WeakStringSet, get_line_fingerprint
+from pipeline.common.fingerprint_index import (
+    FingerprintIndex,
+    FingerprintIndexWriter,
+    FingerprintPool,
+    PartitionedFingerprintSet,
+    batch_lines,
+    get_column_fingerprints,
+    get_line_fingerprints,
+)
+
+
+def test_fingerprints_are_stable():
+    """
+    The fingerprints are shared between tasks, so they can't depend on the hash seed.
+    """
+    script = "from pipeline.common.datasets import get_line_fingerprint as f; print(f('Hello'))"
+    fingerprints = set()
+    for hash_seed in ["1", "2"]:
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            env={**os.environ, "PYTHONHASHSEED": hash_seed},
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        fingerprints.add(int(result.stdout))
+    assert fingerprints == {get_line_fingerprint("Hello")}
+
+
+def test_fingerprints_normalize_lines():
+    # "é" as a single code point, and as an "e" with a combining accent.
+    assert get_line_fingerprint("café\n") == get_line_fingerprint("  café")
+    assert get_line_fingerprint("cafe") != get_line_fingerprint("café")
+    assert list(get_line_fingerprints(["a", "b"])) == [
+        get_line_fingerprint("a"),
+        get_line_fingerprint("b"),
+    ]
+
+
+@pytest.mark.parametrize("batch_size", [3, 1_000_000])
+def test_fingerprint_index(tmp_path: Path, monkeypatch, batch_size: int):
+    monkeypatch.setattr(FingerprintIndexWriter, "batch_size", batch_size)
+    # Write in small chunks to check the de-duplication across the chunk boundaries.
+    monkeypatch.setattr(fingerprint_index, "WRITE_CHUNK_SIZE", 4)
+    lines = [f"line {i % 50}\n" for i in range(200)]
+    path = tmp_path / "corpus.en.hashes"
+
+    with FingerprintIndexWriter(path) as writer:
+        for line in lines:
+            writer.add(line)
+
+    assert os.listdir(tmp_path) == ["corpus.en.hashes"], "The temporary file is removed."
+    fingerprints = np.fromfile(path, dtype="<u8")
+    assert list(fingerprints) == sorted({get_line_fingerprint(line) for line in lines})
+
+    index = FingerprintIndex(path)
+    assert len(index) == 50
+    assert "line 7" in index
+    assert "line 50" not in index
+    assert list(index.contains_many(["line 0", "missing", "line 49"])) == [True, False, True]
+
+
+def test_fingerprint_index_empty(tmp_path: Path):
+    path = tmp_path / "corpus.en.hashes"
+    with FingerprintIndexWriter(path):
+        pass
+
+    index = FingerprintIndex(path)
+    assert len(index) == 0
+    assert "line" not in index
+
+
+def test_fingerprint_index_error(tmp_path: Path):
+    path = tmp_path / "corpus.en.hashes"
+    with pytest.raises(RuntimeError):
+        with FingerprintIndexWriter(path) as writer:
+            writer.add("line")
+            raise RuntimeError("Failed to merge")
+    assert not path.exists(), "An incomplete index isn't written."
+
+    path.write_bytes(b"1234")
+    with pytest.raises(ValueError):
+        FingerprintIndex(path)
+
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_fingerprint_pool(processes: int):
+    lines = [f"line {i}\n" for i in range(1_000)]
+    batches = list(batch_lines(lines, batch_size=7))
+    assert sum(batches, []) == lines
+
+    with FingerprintPool(processes=processes) as pool:
+        results = list(pool.imap(batches))
+        # Only the lines are sent to the workers, while the rest of the batch is kept.
+        column_results = list(
+            pool.imap(
+                (
+                    (index, [(line, line.upper()) for line in batch])
+                    for index, batch in enumerate(batches)
+                ),
+                get_column_fingerprints,
+                get_lines=lambda batch: batch[1],
+            )
+        )
+
+    # The batches are returned in order, with the same fingerprints as serially.
+    assert [batch for batch, _ in results] == batches
+    assert np.concatenate([fingerprints for _, fingerprints in results]).tolist() == [
+        get_line_fingerprint(line) for line in lines
+    ]
+    assert [index for (index, _), _ in column_results] == list(range(len(batches)))
+    src_fingerprints, trg_fingerprints = np.concatenate(
+        [fingerprints for _, fingerprints in column_results], axis=1
+    )
+    assert src_fingerprints.tolist() == [get_line_fingerprint(line) for line in lines]
+    assert trg_fingerprints.tolist() == [get_line_fingerprint(line.upper()) for line in lines]
+
+
+def test_fingerprint_index_add_fingerprints(tmp_path: Path):
+    path = tmp_path / "corpus.en.hashes"
+    with FingerprintIndexWriter(path) as writer:
+        writer.add("line 1")
+        writer.add_fingerprints(get_line_fingerprints(["line 2", "line 1"]))
+        writer.add("line 3")
+
+    index = FingerprintIndex(path)
+    assert len(index) == 3
+    assert list(index.contains_many(["line 1", "line 2", "line 3", "line 4"])) == [
+        True,
+        True,
+        True,
+        False,
+    ]
+
+
+@pytest.mark.parametrize("partitions", [1, 3])
+def test_partitioned_fingerprint_set(partitions: int):
+    rng = np.random.default_rng(seed=1234)
+    repeated = rng.integers(0, 2**64 - 1, 1_000, dtype=np.uint64, endpoint=True)
+    batches = [
+        np.concatenate(
+            [
+                rng.integers(0, 2**64 - 1, 200, dtype=np.uint64, endpoint=True),
+                # Repeat fingerprints within and across the batches, including 0.
+                rng.choice(repeated, 50),
+                np.zeros(1, dtype=np.uint64),
+            ]
+        )
+        for _ in range(20)
+    ]
+
+    strings_seen = WeakStringSet()
+    expected = [strings_seen.add_fingerprints(fingerprints) for fingerprints in batches]
+
+    with PartitionedFingerprintSet(partitions) as fingerprints_seen:
+        results = list(
+            fingerprints_seen.imap_add_fingerprints(
+                enumerate(batches), get_fingerprints=lambda item: item[1]
+            )
+        )
+        assert len(fingerprints_seen) == len(strings_seen)
+        assert not fingerprints_seen.add_fingerprints(batches[0]).any()
+
+    # Only the first occurrences are new, exactly as with a single set.
+    assert [index for (index, _), _ in results] == list(range(len(batches)))
+    for (_, is_new), expected_is_new in zip(results, expected):
+        assert is_new.tolist() == expected_is_new.tolist()
+
+
+def test_partitioned_fingerprint_set_stop_early():
+    """
+    The results of the batches that were sent ahead are larger than a pipe's buffer, so the
+    workers can only exit once they're read.
+    """
+    batches = list(np.random.default_rng(0).integers(1, 2**63, (5, 500_000), dtype=np.uint64))
+
+    # The loop is stopped while the next batch is in flight.
+    with PartitionedFingerprintSet(partitions=2) as fingerprints_seen:
+        for _, is_new in fingerprints_seen.imap_add_fingerprints(batches, lambda batch: batch):
+            assert is_new.all()
+            break
+        # The batch that was sent ahead was still added, and the set is still in step.
+        assert len(fingerprints_seen) == 1_000_000
+        assert not fingerprints_seen.add_fingerprints(batches[1]).any()
+        assert fingerprints_seen.add_fingerprints(batches[2]).all()
+
+    # The set is closed while the generator still holds its batches in flight.
+    with PartitionedFingerprintSet(partitions=2) as fingerprints_seen:
+        results = fingerprints_seen.imap_add_fingerprints(batches, lambda batch: batch)
+        next(results)
+    assert not fingerprints_seen.processes
+    results.close()
+
+
+def test_partitioned_fingerprint_set_error():
+    batches = list(np.random.default_rng(0).integers(1, 2**63, (5, 500_000), dtype=np.uint64))
+    with pytest.raises(ValueError, match="Stopped"):
+        with PartitionedFingerprintSet(partitions=2) as fingerprints_seen:
+            processes = fingerprints_seen.processes
+            for _ in fingerprints_seen.imap_add_fingerprints(batches, lambda batch: batch):
+                raise ValueError("Stopped")
+
+    # The workers were terminated rather than waited on.
+    assert not any(process.is_alive() for process in processes)
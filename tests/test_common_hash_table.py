@@ -0,0 +1,63 @@
+import random
+
+import numpy as np
+import pytest
+
+from pipeline.common.hash_table import UInt64HashTable
+
+
+def random_fingerprint(rng: random.Random) -> int:
+    # Include small values so that the fingerprints collide on slots, and the edge values.
+    return rng.choice([rng.getrandbits(64), rng.getrandbits(6), 0, 2**64 - 1])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_hash_table_matches_set(seed):
+    """
+    Run random operations against the table and a Python set, and check they agree.
+    """
+    rng = random.Random(seed)
+    table = UInt64HashTable(capacity=8)
+    expected: set[int] = set()
+
+    for _ in range(5_000):
+        fingerprint = random_fingerprint(rng)
+        # A fingerprint of 0 is stored as 1.
+        stored = fingerprint or 1
+        if rng.random() < 0.6:
+            assert table.add(fingerprint) == (stored not in expected)
+            expected.add(stored)
+        else:
+            assert table.discard(fingerprint) == (stored in expected)
+            expected.discard(stored)
+        assert len(table) == len(expected)
+
+    for fingerprint in expected:
+        assert fingerprint in table
+    assert table.capacity > 8, "The table grew."
+    assert len(table) <= table.capacity * table.max_load_factor
+
+
+def test_hash_table_add_many():
+    table = UInt64HashTable(capacity=8)
+    table.add(5)
+
+    added = table.add_many(np.array([1, 5, 2, 1, 0, 3], dtype=np.uint64))
+    # 5 was already added, the second 1 repeats the first, and 0 is stored as 1.
+    assert added.tolist() == [True, False, True, False, False, True]
+    assert len(table) == 4
+
+    fingerprints = np.arange(10_000, 20_000, dtype=np.uint64)
+    assert table.add_many(fingerprints).all()
+    assert not table.add_many(fingerprints).any()
+    assert len(table) == 10_004
+
+    assert table.contains_many(np.array([1, 4, 5, 15_000, 20_000], dtype=np.uint64)).tolist() == [
+        True,
+        False,
+        True,
+        True,
+        False,
+    ]
+    for fingerprint in fingerprints.tolist():
+        assert fingerprint in table
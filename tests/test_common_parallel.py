@@ -0,0 +1,90 @@
+import os
+import time
+from functools import partial
+
+import pytest
+
+from pipeline.common.parallel import BlockPool, read_blocks
+
+# The suffix that the initializer sets in each worker.
+_suffix = None
+
+
+def init_suffix(suffix: str) -> None:
+    global _suffix
+    _suffix = f"{suffix}{os.getpid()}"
+
+
+def add_suffix(lines: list[str], sleep: float = 0.0) -> list[str]:
+    # Sleep on the first blocks, so that the later blocks finish first.
+    if sleep and lines[0] < "0002":
+        time.sleep(sleep)
+    return [f"{line} {_suffix}" for line in lines]
+
+
+def fail_on_block(lines: list[str], failing_line: str) -> list[str]:
+    if failing_line in lines:
+        raise ValueError(f"Failed on {failing_line}")
+    return lines
+
+
+def test_read_blocks():
+    lines = ["a" * 3, "b" * 3, "c" * 10, "d", "e", "f"]
+    assert list(read_blocks(lines, block_size=5)) == [
+        ["aaa", "bbb"],
+        ["cccccccccc"],
+        ["d", "e", "f"],
+    ]
+    assert list(read_blocks(lines, block_size=100, max_lines=4)) == [
+        ["aaa", "bbb", "cccccccccc", "d"],
+        ["e", "f"],
+    ]
+    # The size of zipped lines is the sum of their sizes.
+    assert list(read_blocks(zip(lines, lines), block_size=12)) == [
+        [("aaa", "aaa"), ("bbb", "bbb")],
+        [("cccccccccc", "cccccccccc")],
+        [("d", "d"), ("e", "e"), ("f", "f")],
+    ]
+    assert list(read_blocks([], block_size=5)) == []
+
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_block_pool_is_ordered(processes: int):
+    lines = [f"{index:04}" for index in range(1_000)]
+    with BlockPool(processes, initializer=init_suffix, initargs=("pid",)) as pool:
+        blocks = list(pool.imap_lines(partial(add_suffix, sleep=0.05), lines, max_lines=10))
+
+    assert [len(block) for block in blocks] == [10] * 100
+    results = [line for block in blocks for line in block]
+    assert [result.split()[0] for result in results] == lines
+    # The initializer ran once in each worker, rather than for each block.
+    pids = {result.split()[1] for result in results}
+    assert len(pids) <= processes
+    if processes == 1:
+        assert pids == {f"pid{os.getpid()}"}
+
+
+def test_block_pool_back_pressure():
+    read = []
+
+    def read_lines():
+        for index in range(1_000):
+            read.append(index)
+            yield f"{index:04}"
+
+    with BlockPool(2, initializer=init_suffix, initargs=("pid",)) as pool:
+        results = pool.imap_lines(add_suffix, read_lines(), max_lines=10)
+        next(results)
+        # Only `processes * 2` blocks are read ahead of the consumer.
+        assert len(read) <= 10 * 4 + 1
+        assert len(list(results)) == 99
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_block_pool_raises_errors(processes: int):
+    lines = [str(index) for index in range(100)]
+    with BlockPool(processes) as pool:
+        results = pool.imap_lines(partial(fail_on_block, failing_line="55"), lines, max_lines=10)
+        assert next(results) == lines[:10]
+        with pytest.raises(ValueError, match="Failed on 55"):
+            list(results)
@@ -1,8 +1,12 @@
 import json
+import os
+from pathlib import Path
+
 import pytest
 from fixtures import DataDir
 
 from pipeline.common.downloads import read_lines
+from pipeline.common.fingerprint_index import FingerprintIndex
 
 ada = [
     ("ADA 1", "АДА 1"),
@@ -121,6 +125,13 @@ def test_merge_corpus(data_dir, name):
         ],
     )
 
+    # The fingerprints of each language are indexed for de-duplicating the mono data.
+    for locale, line in [("en", "WIKI 1\n"), ("ru", "АДА 5\n")]:
+        index = FingerprintIndex(Path(data_dir.join(f"artifacts/{name}.{locale}.hashes")))
+        assert len(index) == 17
+        assert line in index
+        assert "MISSING 1\n" not in index
+
     assert json.loads(data_dir.load(f"artifacts/{name}.stats.json")) == {
         "parallel_corpus": {
             "description": "The parallel corpora are merged and deduplicated",
@@ -217,3 +228,72 @@ def test_merge_devset_trimmed(data_dir, name):
             {"description": "ada83_v1", "filtered": 2, "kept": 5, "visited": 7},
         ],
     }
+
+
+def test_merge_corpus_incremental():
+    """
+    A new dataset is appended to a previous merge of the other datasets. The new dataset is
+    merged last, as it would be in a full merge, so the results are the same.
+    """
+    data_dir = DataDir("test_merge_corpus_incremental")
+    data_dir.mkdir("artifacts")
+    data_dir.create_zst("ELRC-3075-wikipedia_health_v1.en.zst", build_dataset_contents(wiki, 0))
+    data_dir.create_zst("ELRC-3075-wikipedia_health_v1.ru.zst", build_dataset_contents(wiki, 1))
+    data_dir.create_zst("ELRC-web_acquired_data.en.zst", build_dataset_contents(web_acquired, 0))
+    data_dir.create_zst("ELRC-web_acquired_data.ru.zst", build_dataset_contents(web_acquired, 1))
+    data_dir.run_task("merge-corpus-en-ru", extra_args=["--write_manifest"])
+    os.rename(data_dir.join("artifacts"), data_dir.join("previous"))
+
+    data_dir.mkdir("artifacts")
+    data_dir.create_zst("ada83_v1.en.zst", build_dataset_contents(ada, 0))
+    data_dir.create_zst("ada83_v1.ru.zst", build_dataset_contents(ada, 1))
+    data_dir.run_task(
+        "merge-corpus-en-ru", extra_args=["--previous_corpus", data_dir.join("previous")]
+    )
+    data_dir.print_tree()
+
+    with read_lines(data_dir.join("artifacts/corpus.en.zst")) as lines:
+        en_lines = list(lines)
+    # The previous corpus is kept as it was, and the new pairs are appended.
+    with read_lines(data_dir.join("previous/corpus.en.zst")) as lines:
+        assert en_lines[:11] == list(lines)
+    assert en_lines[11:] == ["ADA 1\n", "ADA 2\n", "ADA 3\n", "ADA 4\n", "ADA 5\n"]
+
+    index = FingerprintIndex(Path(data_dir.join("artifacts/corpus.ru.hashes")))
+    assert len(index) == 17
+    assert "АДА 5\n" in index
+
+    manifest = json.loads(data_dir.load("artifacts/corpus.manifest.json"))
+    assert list(manifest["datasets"]) == [
+        "ELRC-3075-wikipedia_health_v1.en.zst",
+        "ELRC-web_acquired_data.en.zst",
+        "ELRC-3075-wikipedia_health_v1.ru.zst",
+        "ELRC-web_acquired_data.ru.zst",
+        "ada83_v1.en.zst",
+        "ada83_v1.ru.zst",
+    ]
+
+    assert json.loads(data_dir.load("artifacts/corpus.stats.json")) == {
+        "parallel_corpus": {
+            "description": "The parallel corpora are merged and deduplicated",
+            "filtered": 4,
+            "kept": 17,
+            "visited": 21,
+        },
+        "final_truncated": {
+            "description": "The final result can be truncated by max_lines",
+            "filtered": 0,
+            "kept": 17,
+            "visited": 17,
+        },
+        "datasets": [
+            {
+                "description": "ELRC-3075-wikipedia_health_v1",
+                "filtered": 0,
+                "kept": 7,
+                "visited": 7,
+            },
+            {"description": "ELRC-web_acquired_data", "filtered": 2, "kept": 5, "visited": 7},
+            {"description": "ada83_v1", "filtered": 2, "kept": 5, "visited": 7},
+        ],
+    }
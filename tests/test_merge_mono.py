@@ -1,9 +1,11 @@
 import json
+from pathlib import Path
 
 import pytest
 from fixtures import DataDir
 
 from pipeline.common.downloads import read_lines
+from pipeline.common.fingerprint_index import FingerprintIndexWriter
 
 corpus_sample = """CORPUS 1
 CORPUS 2
@@ -39,7 +41,9 @@ def test_merge_mono(task: str):
     sample_size = 5
     data_dir = DataDir("test_merge_mono")
     data_dir.mkdir("corpus")
-    data_dir.create_zst(f"corpus/corpus.{locale}.zst", corpus_sample)
+    with FingerprintIndexWriter(Path(data_dir.join(f"corpus/corpus.{locale}.hashes"))) as writer:
+        for line in corpus_sample.splitlines(keepends=True):
+            writer.add(line)
     data_dir.create_zst(f"news_2014.{locale}.zst", news_2014_sample)
     data_dir.create_zst(f"nllb.{locale}.zst", nllb_sample)
     data_dir.run_task(
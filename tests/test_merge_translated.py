@@ -0,0 +1,70 @@
+import json
+
+from fixtures import DataDir
+
+from pipeline.common.downloads import read_lines
+
+corpus = [
+    ("CORPUS 1", "КОРПУС 1"),
+    ("CORPUS 2", "КОРПУС 2"),
+    ("SHARED 1", "ШАРЕД 1"),
+    ("CORPUS 3", "КОРПУС 3"),
+    ("CORPUS 3", "КОРПУС 3"),
+]
+
+mono = [
+    ("MONO 1", "МОНО 1"),
+    ("SHARED 1", "ШАРЕД 1"),
+    # The same source sentence with a different translation is kept.
+    ("CORPUS 1", "КОРПУС 1 ДРУГОЙ"),
+    ("MONO\t2", "МОНО 2"),
+    ("MONO 3", "МОНО 3"),
+]
+
+
+def build_dataset_contents(lines: list[tuple[str, str]], index: int) -> str:
+    return "\n".join([line[index] for line in lines]) + "\n"
+
+
+def test_merge_translated():
+    data_dir = DataDir("test_merge_translated")
+    data_dir.mkdir("artifacts")
+    data_dir.create_zst("corpus.en.zst", build_dataset_contents(corpus, 0))
+    data_dir.create_zst("corpus.ru.zst", build_dataset_contents(corpus, 1))
+    data_dir.create_zst("mono.en.zst", build_dataset_contents(mono, 0))
+    data_dir.create_zst("mono.ru.zst", build_dataset_contents(mono, 1))
+    data_dir.run_task("merge-translated-en-ru")
+    data_dir.print_tree()
+
+    with read_lines(data_dir.join("artifacts/corpus.en.zst")) as lines:
+        src_lines = list(lines)
+    with read_lines(data_dir.join("artifacts/corpus.ru.zst")) as lines:
+        trg_lines = list(lines)
+
+    # The pairs are shuffled, but stay aligned.
+    assert sorted(zip(src_lines, trg_lines)) == [
+        ("CORPUS 1\n", "КОРПУС 1\n"),
+        ("CORPUS 1\n", "КОРПУС 1 ДРУГОЙ\n"),
+        ("CORPUS 2\n", "КОРПУС 2\n"),
+        ("CORPUS 3\n", "КОРПУС 3\n"),
+        ("MONO 1\n", "МОНО 1\n"),
+        ("MONO 3\n", "МОНО 3\n"),
+        ("SHARED 1\n", "ШАРЕД 1\n"),
+    ]
+
+    assert json.loads(data_dir.load("artifacts/corpus.stats.json")) == {
+        "merged_corpus": {
+            "description": "The parallel corpus and the translated monolingual data are merged "
+            "and deduplicated",
+            "filtered": 2,
+            "kept": 8,
+            "visited": 10,
+        },
+        "lines_with_tabs": {
+            "description": "Sentence pairs are removed when a line contains a tab, as they "
+            "can't be shuffled",
+            "filtered": 1,
+            "kept": 7,
+            "visited": 8,
+        },
+    }
@@ -1,9 +1,14 @@
+import json
+from pathlib import Path
+
 import pytest
-from fixtures import get_full_taskgraph
+from fixtures import DataDir, get_full_taskgraph
 
+from pipeline.common.downloads import count_lines
 from tracking.translations_parser.utils import (
     ParsedTaskLabel,
     build_task_name,
+    get_lines_count,
     parse_task_label,
     parse_gcp_metric,
 )
@@ -209,3 +214,23 @@ def test_gcp_metric(filename, parsed_values):
 def test_wrong_gcp_metric(filename):
     with pytest.raises(ValueError):
         parse_gcp_metric(filename)
+
+
+def test_get_lines_count():
+    data_dir = DataDir("test_get_lines_count")
+    file_path = data_dir.create_file("lines.txt", "line 1\nline 2\nno newline")
+    assert get_lines_count(file_path) == 3
+    cache_path = Path(f"{file_path}.lines.json")
+    cached = json.loads(cache_path.read_text())
+    assert cached["lines"] == 3
+
+    # The cached count is used while the file is unchanged, and is shared with count_lines.
+    cached["lines"] = 5
+    cache_path.write_text(json.dumps(cached))
+    assert get_lines_count(file_path) == 5
+    assert count_lines(file_path) == 5
+
+    # Changing the file invalidates the cache.
+    with open(file_path, "a") as file:
+        file.write("\nline 4\n")
+    assert get_lines_count(file_path) == 4
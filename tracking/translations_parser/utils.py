@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 import re
@@ -300,8 +301,37 @@ def suffix_from_group(task_group_id: str) -> str:
 
 
 def get_lines_count(file_path: str) -> int:
-    with open(file_path, "r") as f:
-        return sum(1 for _ in f)
+    """
+    Count the lines of a file by counting the newlines in large blocks. The count is cached in
+    the same `<path>.lines.json` sidecar as pipeline.common.downloads.count_lines, which is keyed
+    by the size and modification time of the file, so the counts are shared with the pipeline.
+    """
+    stat = os.stat(file_path)
+    cache_path = Path(f"{file_path}.lines.json")
+    try:
+        cached = json.loads(cache_path.read_text())
+        if cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached["lines"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    line_count = 0
+    last_byte = b"\n"
+    with open(file_path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            line_count += block.count(b"\n")
+            last_byte = block[-1:]
+    # Count a final line without a newline.
+    if last_byte != b"\n":
+        line_count += 1
+
+    cached = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "lines": line_count}
+    try:
+        cache_path.write_text(json.dumps(cached))
+    except OSError as exception:
+        # The cache is optional, e.g. the directory could be read-only.
+        logger.warning(f"The line count could not be cached: {exception}")
+    return line_count
 
 
 def parse_gcp_metric(filename: str) -> tuple[str, str, str]:
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Measure the throughput of copying and counting the lines of a zst corpus with read_lines and
+write_lines, in text mode and in binary mode. Binary mode skips decoding and encoding the
+text, which is all that the copy-only callers need.
+
+Usage:
+    PYTHONPATH=$(pwd) poetry run python utils/benchmarks/binary_lines.py --megabytes 1000
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from pipeline.common.downloads import read_lines, write_lines
+
+
+def write_corpus(path: Path, megabytes: int) -> int:
+    """Write a zst corpus with a mix of scripts, and return the uncompressed size."""
+    lines = [
+        "The little girl, seeing she had lost one of her pretty shoes, grew angry.\n",
+        "La petite fille, voyant qu'elle avait perdu une de ses jolies chaussures, se fâcha.\n",
+        "Маленькая девочка, увидев, что потеряла одну из своих красивых туфель, рассердилась.\n",
+        "小女孩看到自己丢了一只漂亮的鞋子，生气了。\n",
+    ]
+    block = "".join(f"{index} {line}" for index in range(2_500) for line in lines).encode()
+    total_bytes = 0
+    with write_lines(path, binary=True) as outfile:
+        while total_bytes < megabytes * 1_000_000:
+            outfile.write(block)
+            total_bytes += len(block)
+    return total_bytes
+
+
+def benchmark(name: str, action, uncompressed_bytes: int) -> None:
+    start = time.perf_counter()
+    line_count = action()
+    elapsed = time.perf_counter() - start
+    megabytes_per_sec = uncompressed_bytes / 1_000_000 / elapsed
+    print(f"{name:<8} {line_count:,} lines in {elapsed:.2f}s ({megabytes_per_sec:.1f} MB/s)")
+
+
+def count(path: Path, binary: bool) -> int:
+    with read_lines(path, binary=binary) as lines:
+        return sum(1 for _ in lines)
+
+
+def copy(path: Path, destination: Path, binary: bool) -> int:
+    line_count = 0
+    with read_lines(path, binary=binary) as lines, write_lines(
+        destination, binary=binary
+    ) as outfile:
+        for line in lines:
+            outfile.write(line)
+            line_count += 1
+    return line_count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--megabytes", type=int, default=1000, help="The uncompressed size of the corpus."
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus = Path(temp_dir) / "corpus.txt.zst"
+        destination = Path(temp_dir) / "copy.txt.zst"
+        uncompressed_bytes = write_corpus(corpus, args.megabytes)
+
+        print("Count lines:")
+        benchmark("  text", lambda: count(corpus, binary=False), uncompressed_bytes)
+        benchmark("  binary", lambda: count(corpus, binary=True), uncompressed_bytes)
+
+        print("Copy lines:")
+        benchmark("  text", lambda: copy(corpus, destination, binary=False), uncompressed_bytes)
+        benchmark("  binary", lambda: copy(corpus, destination, binary=True), uncompressed_bytes)
+
+
+if __name__ == "__main__":
+    main()
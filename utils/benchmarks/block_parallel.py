@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Compare the throughput of the rule-based cleaning of tools/clean_mono.py when it's fanned out by
+`parallel --pipe -k`, which starts an interpreter for every block, and by its --processes, which
+maps the blocks in a persistent BlockPool. The outputs are checked to be the same.
+
+The fan-outs that are compared:
+  gnu_parallel  `parallel --pipe -k --block`, which is skipped when GNU parallel isn't installed.
+  per_block     An emulation of it, which pipes each block to a new tools/clean_mono.py with at
+                most --processes of them running at a time, and writes their outputs in order.
+  block_pool    `tools/clean_mono.py --processes`.
+
+Usage:
+    PYTHONPATH=$(pwd) poetry run python utils/benchmarks/block_parallel.py \\
+        --lines 2_000_000 --processes 1 4 16 --block_megabytes 1
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from random import Random
+
+from pipeline.common.parallel import read_blocks
+
+ROOT_DIR = Path(__file__).parent.parent.parent
+CLEAN_DIR = ROOT_DIR / "pipeline/clean"
+WORDS = "The little girl seeing she had lost one of her pretty shoes grew angry".split()
+NOISE = ["123", "4.5", "--", "(c)", "http://example.com", "©", "#"]
+
+
+def generate_lines(count: int) -> bytes:
+    random = Random(1234)
+    lines = []
+    for _ in range(count):
+        tokens = [
+            random.choice(NOISE) if random.random() < 0.3 else random.choice(WORDS)
+            for _ in range(random.randrange(1, 30))
+        ]
+        lines.append(" ".join(tokens) + "\n")
+    return "".join(lines).encode("utf-8")
+
+
+def get_env() -> dict:
+    return {**os.environ, "PYTHONPATH": f"tools:{ROOT_DIR}"}
+
+
+def run_gnu_parallel(input_path: Path, processes: int, block_megabytes: int) -> bytes:
+    command = [
+        "parallel",
+        "--no-notice",
+        "--pipe",
+        "-k",
+        "-j",
+        str(processes),
+        "--block",
+        f"{block_megabytes}M",
+        f"{sys.executable} tools/clean_mono.py -l en",
+    ]
+    with open(input_path, "rb") as infile:
+        return subprocess.run(
+            command, stdin=infile, capture_output=True, check=True, cwd=CLEAN_DIR, env=get_env()
+        ).stdout
+
+
+def run_interpreter_per_block(input_path: Path, processes: int, block_megabytes: int) -> bytes:
+    def clean_block(block: list[bytes]) -> bytes:
+        return subprocess.run(
+            [sys.executable, "tools/clean_mono.py", "-l", "en"],
+            input=b"".join(block),
+            capture_output=True,
+            check=True,
+            cwd=CLEAN_DIR,
+            env=get_env(),
+        ).stdout
+
+    with open(input_path, "rb") as infile, ThreadPoolExecutor(processes) as executor:
+        blocks = read_blocks(infile, block_size=block_megabytes << 20)
+        return b"".join(executor.map(clean_block, blocks))
+
+
+def run_block_pool(input_path: Path, processes: int, block_megabytes: int) -> bytes:
+    command = [sys.executable, "tools/clean_mono.py", "-l", "en", "--processes", str(processes)]
+    with open(input_path, "rb") as infile:
+        return subprocess.run(
+            command, stdin=infile, capture_output=True, check=True, cwd=CLEAN_DIR, env=get_env()
+        ).stdout
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--lines",
+        type=lambda value: int(value.replace("_", "")),
+        default=2_000_000,
+        help="How many lines to clean.",
+    )
+    parser.add_argument(
+        "--processes", type=int, nargs="+", default=[1, 4], help="The numbers of processes."
+    )
+    parser.add_argument(
+        "--block_megabytes", type=int, default=1, help="The size of a block, like --block."
+    )
+    args = parser.parse_args()
+
+    fan_outs = [("per_block", run_interpreter_per_block), ("block_pool", run_block_pool)]
+    if shutil.which("parallel"):
+        fan_outs.insert(0, ("gnu_parallel", run_gnu_parallel))
+    else:
+        print("GNU parallel isn't installed, so only its emulation is compared.")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_path = Path(temp_dir) / "mono.txt"
+        input_path.write_bytes(generate_lines(args.lines))
+        megabytes = input_path.stat().st_size / 1_000_000
+        print(f"{args.lines:,} lines, {megabytes:.1f} MB")
+
+        for processes in args.processes:
+            outputs = []
+            for name, run in fan_outs:
+                start = time.perf_counter()
+                outputs.append(run(input_path, processes, args.block_megabytes))
+                elapsed = time.perf_counter() - start
+                print(
+                    f"{name:<13} {processes:>3} processes {elapsed:>7.2f}s "
+                    f"{args.lines / elapsed / 1000:>8.1f}k lines/s"
+                )
+            assert all(output == outputs[-1] for output in outputs), "The outputs differ"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Compare the throughput of the rule-based cleaning of clean_parallel.py with the regular
+expressions it used before, which were matched once per word and once per sentence, and the
+lookup tables of clean_batch. The skip reasons of every pair are checked to be the same.
+
+Usage:
+    PYTHONPATH=$(pwd) poetry run python utils/benchmarks/clean_rules.py \\
+        --pairs 1_000_000 --src en --trg ru
+"""
+
+import argparse
+import re
+import time
+from random import Random
+from typing import Optional
+
+from pipeline.clean.tools.clean_parallel import (
+    CHARS,
+    MAX_LENGTH,
+    MIN_LENGTH,
+    RATIO_ALPHA_CHARS,
+    RATIO_ALPHA_WORDS,
+    RATIO_LENGTH,
+    clean_batch,
+    get_alpha_tables,
+)
+
+WORDS = {
+    "en": "The little girl seeing she had lost one of her pretty shoes grew angry".split(),
+    "fr": "La petite fille voyant qu'elle avait perdu une de ses jolies chaussures".split(),
+    "ru": "Маленькая девочка увидев что потеряла одну из своих красивых туфель".split(),
+    "de": "Das kleine Mädchen sah dass es einen seiner hübschen Schuhe verloren hatte".split(),
+}
+NOISE = ["123", "4.5", "--", "(c)", "http://example.com", "K", "ſ", "©", "®", "#"]
+
+
+def regex_clean_parallel(src: str, trg: str, src_lang: str, trg_lang: str) -> Optional[str]:
+    """The rules of clean_parallel.py, as they were implemented with regular expressions."""
+    if src.lower() == trg.lower():
+        return "IDENTICAL"
+
+    src_toks = src.split()
+    trg_toks = trg.split()
+    src_len = len(src_toks)
+    trg_len = len(trg_toks)
+
+    if not src_len or not trg_len:
+        return "EMPTY"
+
+    ratio_len = src_len / float(trg_len)
+    if ratio_len < RATIO_LENGTH or ratio_len > (1.0 / RATIO_LENGTH):
+        return "RATIO_LENGTH"
+
+    if src_len < MIN_LENGTH or trg_len < MIN_LENGTH:
+        return "TOO_SHORT"
+
+    if src_len > MAX_LENGTH or trg_len > MAX_LENGTH:
+        return "TOO_LONG"
+
+    for lang, text, toks, suffix in (
+        (src_lang, src, src_toks, "SRC"),
+        (trg_lang, trg, trg_toks, "TRG"),
+    ):
+        if lang in CHARS:
+            num_alpha = sum([1 if re.match(CHARS[lang], t, re.IGNORECASE) else 0 for t in toks])
+            if num_alpha / float(len(toks)) < RATIO_ALPHA_WORDS:
+                return f"RATIO_ALPHA_{suffix}"
+
+            char_alpha = len(re.findall(CHARS[lang], text, re.IGNORECASE))
+            if char_alpha / float(len(text.replace(" ", ""))) < RATIO_ALPHA_CHARS:
+                return f"RATIO_CHARS_{suffix}"
+
+    return None
+
+
+def generate_sentence(random: Random, lang: str) -> str:
+    words = WORDS.get(lang, WORDS["en"])
+    tokens = [
+        random.choice(NOISE) if random.random() < 0.3 else random.choice(words)
+        for _ in range(random.randrange(1, 30))
+    ]
+    return " ".join(tokens)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--pairs",
+        type=lambda value: int(value.replace("_", "")),
+        default=1_000_000,
+        help="How many sentence pairs to clean.",
+    )
+    parser.add_argument("--src", type=str, default="en", help="The source language.")
+    parser.add_argument("--trg", type=str, default="ru", help="The target language.")
+    args = parser.parse_args()
+
+    random = Random(1234)
+    pairs = [
+        (generate_sentence(random, args.src), generate_sentence(random, args.trg))
+        for _ in range(args.pairs)
+    ]
+
+    start = time.perf_counter()
+    get_alpha_tables(args.src)
+    get_alpha_tables(args.trg)
+    print(f"Building the lookup tables took {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    regex_reasons = [regex_clean_parallel(src, trg, args.src, args.trg) for src, trg in pairs]
+    regex_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch_reasons = []
+    for index in range(0, len(pairs), 10_000):
+        batch_reasons.extend(clean_batch(pairs[index : index + 10_000], args.src, args.trg))
+    batch_elapsed = time.perf_counter() - start
+
+    assert batch_reasons == regex_reasons, "The skip reasons differ"
+    kept = batch_reasons.count(None)
+    print(f"{len(pairs):,} pairs, {kept:,} kept")
+    for name, elapsed in (("regex", regex_elapsed), ("clean_batch", batch_elapsed)):
+        print(f"{name:<12} {elapsed:>7.2f}s {len(pairs) / elapsed / 1000:>8.1f}k pairs/s")
+    print(f"{regex_elapsed / batch_elapsed:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
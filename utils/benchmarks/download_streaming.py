@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Measure the throughput of streaming lines from a remote file through RemoteGzipLineStreamer and
+RemoteZstdLineStreamer. The files are served from a local http server, and the lines are
+streamed with the current DownloadChunkStreamer, and with the previous implementation that
+concatenated the buffer on every read. The zstd decompressor issues larger reads than gzip.
+
+The cost of the concatenation grows with the size of the read, so the raw streamer is also
+measured with large reads.
+
+Usage:
+    PYTHONPATH=$(pwd) poetry run python utils/benchmarks/download_streaming.py --megabytes 200
+"""
+
+import argparse
+import gzip
+import os
+import tempfile
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+from typing import Optional
+
+from zstandard import ZstdCompressor
+
+from pipeline.common import downloads
+from pipeline.common.downloads import (
+    DownloadChunkStreamer,
+    RemoteDecodingLineStreamer,
+    RemoteGzipLineStreamer,
+    RemoteZstdLineStreamer,
+)
+
+
+class ConcatenatingChunkStreamer(DownloadChunkStreamer):
+    """
+    The previous implementation of `read`, which copied the whole buffer on every call.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.buffer = b""
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        if not self.chunk_iter:
+            return b""
+
+        if size is None or size < 0:
+            for chunk in self.chunk_iter:
+                self.buffer += chunk
+            result = self.buffer
+            self.buffer = b""
+            return result
+
+        while len(self.buffer) < size:
+            chunk = next(self.chunk_iter, None)
+            if chunk:
+                self.buffer += chunk
+            else:
+                break
+
+        result = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return result
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def write_corpus(directory: Path, megabytes: int) -> int:
+    """Write a gzip and zstd file of sentences, and return the uncompressed size."""
+    line = "The little girl, seeing she had lost one of her pretty shoes, grew angry.\n"
+    block = line.encode("utf-8") * 10_000
+    total_bytes = 0
+    with gzip.open(directory / "corpus.txt.gz", "wb", compresslevel=1) as gz_file, open(
+        directory / "corpus.txt.zst", "wb"
+    ) as zst_file, ZstdCompressor().stream_writer(zst_file) as zst_writer:
+        while total_bytes < megabytes * 1_000_000:
+            gz_file.write(block)
+            zst_writer.write(block)
+            total_bytes += len(block)
+
+    # The corpus compresses well, so use random bytes to measure the raw reads.
+    with open(directory / "random.bin", "wb") as outfile:
+        for _ in range(megabytes):
+            outfile.write(os.urandom(1_000_000))
+
+    return total_bytes
+
+
+def benchmark(
+    name: str, streamer: type[RemoteDecodingLineStreamer], url: str, uncompressed_bytes: int
+) -> None:
+    start = time.perf_counter()
+    line_count = 0
+    with streamer(url) as lines:
+        for _ in lines:
+            line_count += 1
+    elapsed = time.perf_counter() - start
+    megabytes_per_sec = uncompressed_bytes / 1_000_000 / elapsed
+    print(f"{name:<12} {line_count:,} lines in {elapsed:.2f}s ({megabytes_per_sec:.1f} MB/s)")
+
+
+def benchmark_raw_reads(
+    name: str, streamer: type[DownloadChunkStreamer], url: str, read_bytes: int
+) -> None:
+    start = time.perf_counter()
+    total_bytes = 0
+    with streamer(url) as file:
+        while data := file.read(read_bytes):
+            total_bytes += len(data)
+    elapsed = time.perf_counter() - start
+    megabytes_per_sec = total_bytes / 1_000_000 / elapsed
+    print(f"{name:<12} {total_bytes:,} bytes in {elapsed:.2f}s ({megabytes_per_sec:.1f} MB/s)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--megabytes", type=int, default=100, help="The uncompressed size of the corpus."
+    )
+    args = parser.parse_args()
+
+    # Don't measure the download cache.
+    os.environ.pop("DOWNLOAD_CACHE_DIR", None)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        uncompressed_bytes = write_corpus(Path(temp_dir), args.megabytes)
+
+        handler = partial(QuietHandler, directory=temp_dir)
+        httpd = ThreadingHTTPServer(("localhost", 0), handler)
+        thread = Thread(target=httpd.serve_forever)
+        thread.start()
+        base_url = f"http://localhost:{httpd.server_address[1]}"
+
+        try:
+            for extension, streamer in [
+                ("gz", RemoteGzipLineStreamer),
+                ("zst", RemoteZstdLineStreamer),
+            ]:
+                url = f"{base_url}/corpus.txt.{extension}"
+                print(f"{streamer.__name__}:")
+                downloads.DownloadChunkStreamer = ConcatenatingChunkStreamer
+                benchmark("  before", streamer, url, uncompressed_bytes)
+                downloads.DownloadChunkStreamer = DownloadChunkStreamer
+                benchmark("  after", streamer, url, uncompressed_bytes)
+
+            url = f"{base_url}/random.bin"
+            read_bytes = 1024 * 1024
+            print(f"DownloadChunkStreamer.read({read_bytes:,}):")
+            benchmark_raw_reads("  before", ConcatenatingChunkStreamer, url, read_bytes)
+            benchmark_raw_reads("  after", DownloadChunkStreamer, url, read_bytes)
+        finally:
+            downloads.DownloadChunkStreamer = DownloadChunkStreamer
+            httpd.shutdown()
+            thread.join()
+
+
+if __name__ == "__main__":
+    main()
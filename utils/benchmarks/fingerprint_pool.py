@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Measure the throughput of normalizing and hashing lines into fingerprints with a FingerprintPool,
+for different numbers of processes. The main process only batches the lines and collects the
+fingerprints, as it does in merge-corpus and merge-mono. The throughput should scale with the
+processes until the main process is the bottleneck, or the cores run out.
+
+Usage:
+    PYTHONPATH=$(pwd) poetry run python utils/benchmarks/fingerprint_pool.py \\
+        --lines 5_000_000 --processes 1 2 4 8 16 32
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from pipeline.common.fingerprint_index import FingerprintPool, batch_lines
+
+
+def generate_lines(count: int) -> list[str]:
+    """Generate lines with a mix of scripts, so that the normalization isn't trivial."""
+    lines = [
+        "The little girl, seeing she had lost one of her pretty shoes, grew angry.\n",
+        "La petite fille, voyant qu'elle avait perdu une de ses jolies chaussures, se fâcha.\n",
+        "Маленькая девочка, увидев, что потеряла одну из своих красивых туфель, рассердилась.\n",
+        "小女孩看到自己丢了一只漂亮的鞋子，生气了。\n",
+    ]
+    return [f"{index} {lines[index % len(lines)]}" for index in range(count)]
+
+
+def benchmark(lines: list[str], processes: int) -> np.ndarray:
+    with FingerprintPool(processes=processes) as pool:
+        start = time.perf_counter()
+        fingerprints = [fingerprints for _, fingerprints in pool.imap(batch_lines(lines))]
+        elapsed = time.perf_counter() - start
+
+    print(
+        f"{processes:>3} processes {len(lines):>12,} lines {elapsed:>7.2f}s "
+        f"{len(lines) / elapsed / 1_000_000:>6.2f}M lines/s"
+    )
+    return np.concatenate(fingerprints)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--lines",
+        type=lambda value: int(value.replace("_", "")),
+        default=5_000_000,
+        help="How many lines to fingerprint.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16, 32],
+        help="The numbers of processes to measure.",
+    )
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} logical CPUs")
+    lines = generate_lines(args.lines)
+    serial_fingerprints = None
+    for processes in args.processes:
+        fingerprints = benchmark(lines, processes)
+        if serial_fingerprints is None:
+            serial_fingerprints = fingerprints
+        assert np.array_equal(fingerprints, serial_fingerprints), "The fingerprints differ"
+
+
+if __name__ == "__main__":
+    main()
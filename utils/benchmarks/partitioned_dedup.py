@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Compare de-duplicating the fingerprints of a large corpus with a single WeakStringSet, which
+checks every fingerprint on one core, and with a PartitionedFingerprintSet, which checks a slice
+of each batch in a process per partition. This is the de-duplication of merge-corpus.py with
+--dedup_partitions. The masks of the new fingerprints are checked to be the same.
+
+The fingerprints are random 64 bit ints, with a share of them repeated, which measures the
+de-duplication rather than the hashing of the lines, which costs the same for every case.
+
+The partitions only help when there is a core for each of them. This process partitions and
+sends every batch, so "parent busy" is the bound on the speedup with enough cores.
+
+Usage:
+    PYTHONPATH=$(pwd) poetry run python utils/benchmarks/partitioned_dedup.py \\
+        --lines 100_000_000 --partitions 2 4 8
+"""
+
+import argparse
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from pipeline.common.datasets import WeakStringSet
+from pipeline.common.fingerprint_index import PartitionedFingerprintSet
+
+BATCH_SIZE = 1_000_000
+
+
+def generate_batches(lines: int, duplicate_ratio: float) -> list[np.ndarray]:
+    rng = np.random.default_rng(1234)
+    fingerprints = rng.integers(1, 2**64, size=lines, dtype=np.uint64, endpoint=False)
+    # Repeat earlier fingerprints, like the duplicated lines of a corpus.
+    duplicates = rng.random(lines) < duplicate_ratio
+    duplicates[0] = False
+    sources = (rng.random(lines) * np.arange(lines)).astype(np.int64)
+    fingerprints[duplicates] = fingerprints[sources[duplicates]]
+    return [fingerprints[start : start + BATCH_SIZE] for start in range(0, lines, BATCH_SIZE)]
+
+
+def run_single(batches: list[np.ndarray]) -> tuple[float, float, str]:
+    masks_digest = hashlib.sha256()
+    start = time.perf_counter()
+    strings_seen = WeakStringSet()
+    for batch in batches:
+        masks_digest.update(np.packbits(strings_seen.add_fingerprints(batch)).tobytes())
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed, masks_digest.hexdigest()
+
+
+def run_partitioned(batches: list[np.ndarray], partitions: int) -> tuple[float, float, str]:
+    masks_digest = hashlib.sha256()
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    with PartitionedFingerprintSet(partitions) as fingerprints_seen:
+        for _, is_new in fingerprints_seen.imap_add_fingerprints(batches, lambda batch: batch):
+            masks_digest.update(np.packbits(is_new).tobytes())
+    parent_busy = time.process_time() - start_cpu
+    return time.perf_counter() - start, parent_busy, masks_digest.hexdigest()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--lines",
+        type=lambda value: int(value.replace("_", "")),
+        default=100_000_000,
+        help="How many line fingerprints to de-duplicate.",
+    )
+    parser.add_argument(
+        "--partitions", type=int, nargs="+", default=[2, 4, 8], help="The numbers of partitions."
+    )
+    parser.add_argument(
+        "--duplicate_ratio", type=float, default=0.3, help="The share of repeated fingerprints."
+    )
+    args = parser.parse_args()
+
+    batches = generate_batches(args.lines, args.duplicate_ratio)
+    print(f"{args.lines:,} fingerprints on {os.cpu_count()} CPUs")
+
+    single_elapsed, _, expected_digest = run_single(batches)
+    print(
+        f"{'single':<16} {single_elapsed:>7.2f}s "
+        f"{args.lines / single_elapsed / 1_000_000:>6.2f}M lines/s"
+    )
+
+    for partitions in args.partitions:
+        elapsed, parent_busy, digest = run_partitioned(batches, partitions)
+        assert digest == expected_digest, "The de-duplicated lines differ"
+        print(
+            f"{f'{partitions} partitions':<16} {elapsed:>7.2f}s "
+            f"{args.lines / elapsed / 1_000_000:>6.2f}M lines/s "
+            f"{single_elapsed / elapsed:>5.2f}x, parent busy {parent_busy:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
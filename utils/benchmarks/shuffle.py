@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Compare shuffling a dataset on disk with shuffle_in_temp_files, which writes uncompressed chunks
+and shuffles on one core, and shuffle_in_compressed_buckets, which writes zstd compressed
+buckets and shuffles them in a pool of processes. The peak disk usage is sampled while the
+shuffle runs.
+
+Usage:
+    PYTHONPATH=$(pwd) poetry run python utils/benchmarks/shuffle.py \\
+        --lines 10_000_000 --bucket_count 64 --processes 1 4 16
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+from typing import Callable
+
+from pipeline.common.datasets import shuffle_in_compressed_buckets, shuffle_in_temp_files
+
+
+def generate_lines(count: int) -> list[str]:
+    """Generate lines of text that compress about as well as a real corpus."""
+    lines = [
+        "The little girl, seeing she had lost one of her pretty shoes, grew angry.",
+        "La petite fille, voyant qu'elle avait perdu une de ses jolies chaussures, se fâcha.",
+        "Маленькая девочка, увидев, что потеряла одну из своих красивых туфель, рассердилась.",
+        "小女孩看到自己丢了一只漂亮的鞋子，生气了。",
+    ]
+    return [f"{index} {lines[index % len(lines)]}" for index in range(count)]
+
+
+def get_disk_usage(directory: str) -> int:
+    size = 0
+    for root, _dirs, files in os.walk(directory):
+        for file in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file))
+            except FileNotFoundError:
+                # The file was removed while walking the directory.
+                pass
+    return size
+
+
+def benchmark(name: str, shuffle: Callable[[str, object], None]) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir, open(os.devnull, "w") as output:
+        peak_bytes = 0
+        done = threading.Event()
+
+        def sample_disk_usage() -> None:
+            nonlocal peak_bytes
+            while not done.wait(0.1):
+                peak_bytes = max(peak_bytes, get_disk_usage(temp_dir))
+
+        sampler = threading.Thread(target=sample_disk_usage)
+        sampler.start()
+        start = time.perf_counter()
+        shuffle(temp_dir, output)
+        elapsed = time.perf_counter() - start
+        done.set()
+        sampler.join()
+
+    print(f"{name:<40} {elapsed:>7.2f}s {peak_bytes / 1024 / 1024:>9.1f} MB peak disk")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--lines",
+        type=lambda value: int(value.replace("_", "")),
+        default=10_000_000,
+        help="How many lines to shuffle.",
+    )
+    parser.add_argument(
+        "--bucket_count",
+        type=int,
+        default=64,
+        help="How many buckets shuffle_in_compressed_buckets partitions the lines into.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16],
+        help="The numbers of processes to measure.",
+    )
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} logical CPUs")
+    lines = generate_lines(args.lines)
+    total_bytes = sum(len(line.encode("utf-8")) + 1 for line in lines)
+    print(f"{args.lines:,} lines, {total_bytes / 1024 / 1024:.1f} MB")
+
+    bucket_bytes = total_bytes // args.bucket_count
+    benchmark(
+        "shuffle_in_temp_files",
+        lambda temp_dir, output: shuffle_in_temp_files(
+            lines,
+            output,
+            seed="benchmark",
+            chunk_bytes=bucket_bytes // 10,
+            bucket_bytes=bucket_bytes,
+            chunk_dir=temp_dir,
+        ),
+    )
+    for processes in args.processes:
+        benchmark(
+            f"shuffle_in_compressed_buckets {processes:>3} procs",
+            lambda temp_dir, output: shuffle_in_compressed_buckets(
+                lines,
+                output,
+                seed="benchmark",
+                bucket_count=args.bucket_count,
+                bucket_dir=temp_dir,
+                processes=processes,
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
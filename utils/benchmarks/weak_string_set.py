@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Measure the memory and throughput of storing line hashes for de-duplication, comparing the
+Python set[int] that WeakStringSet used to be backed by with the UInt64HashTable. Each case
+runs in its own process so that the memory is measured by the growth of the resident set size.
+
+The hashes are random 64 bit ints, which measures the storage rather than the string hashing,
+which costs the same for every case.
+
+Usage:
+    PYTHONPATH=$(pwd) poetry run python utils/benchmarks/weak_string_set.py \
+        --lines 10_000_000 100_000_000
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+import numpy as np
+import psutil
+
+from pipeline.common import format_bytes
+from pipeline.common.hash_table import UInt64HashTable
+
+BATCH_SIZE = 1_000_000
+CASES = ["set", "table.add", "table.add_many"]
+
+
+def run_case(case: str, lines: int) -> None:
+    rng = np.random.default_rng(1234)
+    process = psutil.Process()
+    start_rss = process.memory_info().rss
+    hashes = set() if case == "set" else UInt64HashTable()
+    elapsed = 0.0
+
+    for batch_start in range(0, lines, BATCH_SIZE):
+        batch = rng.integers(
+            0, 2**64, size=min(BATCH_SIZE, lines - batch_start), dtype=np.uint64, endpoint=False
+        )
+        if case == "table.add_many":
+            start = time.perf_counter()
+            hashes.add_many(batch)
+            elapsed += time.perf_counter() - start
+        else:
+            values = batch.tolist()
+            start = time.perf_counter()
+            for value in values:
+                hashes.add(value)
+            elapsed += time.perf_counter() - start
+
+    memory = process.memory_info().rss - start_rss
+    print(
+        f"{case:<16} {lines:>13,} lines {elapsed:>7.2f}s "
+        f"{lines / elapsed / 1_000_000:>6.2f}M lines/s "
+        f"{format_bytes(memory):>10} ({memory / lines:.1f} bytes per line)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        # Preserves whitespace in the help text.
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--lines",
+        type=lambda value: int(value.replace("_", "")),
+        nargs="+",
+        default=[10_000_000, 100_000_000],
+        help="How many line hashes to store.",
+    )
+    parser.add_argument("--cases", nargs="+", default=CASES, choices=CASES)
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        run_case(args.run_case, args.lines[0])
+        return
+
+    for lines in args.lines:
+        for case in args.cases:
+            subprocess.run(
+                [sys.executable, __file__, "--run-case", case, "--lines", str(lines)], check=True
+            )
+
+
+if __name__ == "__main__":
+    main()
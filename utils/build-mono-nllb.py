@@ -1,16 +1,13 @@
 import argparse
 import gzip
-import io
 import json
 import os
 import unicodedata
 import zipfile
 from pathlib import Path
 
-import requests
-
 from pipeline.common.datasets import shuffle_with_max_lines
-from pipeline.common.downloads import stream_download_to_file
+from pipeline.common.downloads import read_lines, stream_download_to_file
 
 """
 Build a monolingual dataset based off of NLLB.
@@ -22,13 +19,10 @@ DATA_PATH = (Path(__file__).parent / "../data/nllb").resolve()
 
 
 def stream_lines_from_remote_zip(url, filename):
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
-
-    with zipfile.ZipFile(io.BytesIO(response.content)) as zip:
-        with zip.open(filename, force_zip64=True) as file:
-            for line in file:
-                yield line.decode("utf-8").strip()
+    # The zip is read with range requests, so only the file's bytes are downloaded.
+    with read_lines(url, path_in_archive=filename) as lines:
+        for line in lines:
+            yield line.strip()
 
 
 def compute_hashes_in_parallel_data(parallel_path: Path, lang: str):
@@ -135,12 +129,12 @@ def main() -> None:
         if mono_path.exists():
             print(f"{mono_file} exists")
         else:
-            stream_download_to_file(mono_url, mono_path)
+            stream_download_to_file(mono_url, mono_path, connections=8)
 
         if parallel_path.exists():
             print(f"{parallel_file} exists")
         else:
-            stream_download_to_file(parallel_url, parallel_path)
+            stream_download_to_file(parallel_url, parallel_path, connections=8)
             # zip contents:
             # ├── README
             # ├── LICENSE